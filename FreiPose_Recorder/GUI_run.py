@@ -9,33 +9,30 @@ import json
 import logging
 import sys
 import time
-import shutil
 
 from queue import Empty
-from threading import Event
+from threading import Event, Thread
 
 from PyQt6.QtWidgets import QApplication, QMainWindow, QFileDialog, QMessageBox
 from PyQt6.QtCore import QTimer
-from PyQt6 import uic, QtGui, QtSerialPort
+from PyQt6 import uic, QtGui
 
 from pathlib import Path
 from FreiPose_Recorder.core.Recorder import Recorder
-from FreiPose_Recorder.ImageViewer import SingleCamViewer, RemoteConnDialog
+from FreiPose_Recorder.version import VERSION
+from FreiPose_Recorder.ImageViewer import SingleCamViewer, RemoteConnDialog, PreviewSignal, RemoteSignal
 from FreiPose_Recorder.utils.socket_utils import SocketComm, SocketMessage, MessageType
+from FreiPose_Recorder.utils.async_server import RemoteServer
+from FreiPose_Recorder.utils.preview_stream import PreviewStreamer
 from FreiPose_Recorder.configs.params import *
-from FreiPose_Recorder.utils.serial_utils import QtPicoSerial
+from FreiPose_Recorder.utils.transfer_utils import FileTransfer, SessionFiles
+from FreiPose_Recorder.utils.task_utils import CameraTaskRunner
+from FreiPose_Recorder.utils.bandwidth_planner import BandwidthPlanner
+from FreiPose_Recorder.utils.encoder_profiler import AUTO_CODEC
 
 log = logging.getLogger('main')
 log.setLevel(logging.DEBUG)
 
-#make the logging to file
-log_path = Path('logs')
-log_path.mkdir(exist_ok=True)
-if LOG2FILE:
-    logging.basicConfig(filename=log_path / f'GUI_run{datetime.datetime.now().strftime("%m%d_%H%M")}.log', filemode='w',
-                        format='%(asctime)s - %(levelname)s - %(message)s')
-
-VERSION = "0.5.1"
 
 # TODO
 # move camera enums somewhere less convoluted
@@ -43,19 +40,23 @@ VERSION = "0.5.1"
 # Write documentation for the functions make a docs for it
 # implement connection to raspberry pico (scan ports etc)
 
-class BASLER_GUI(QMainWindow):
+class BASLER_GUI(QMainWindow, SessionFiles):
     def __init__(self):
         super(BASLER_GUI, self).__init__()
         self.MultiViewWidget = None  # is loaded from the GUI_design.ui
         self.CameraSettings = None   # is loaded from the GUI_design.ui
         self.session_path = None  # path to the current session
         self.files_copied = False  # flag to check if files have been copied
-        self.timer_update_counter = 0
+        self.copy_thread = None  # thread copying the files in the background
+        self.uploader = None  # copies data to the session path during recording
         self.rec_start_time = None  # time when recording started
         self.calib_start_timer = None
         self.calib_stop_timer = None
         self.trigger_timer = None
         self.session_id = "test_sess"
+        self.cam_lib = {}  # content of the last loaded settings file
+        self.bandwidth_planner = BandwidthPlanner()
+        self.profile = None  # recording profile (ROI/binning) of the settings file
         self.single_camviewer = None
         self.multi_view_timer = None
         self.stop_event = None
@@ -66,7 +67,7 @@ class BASLER_GUI(QMainWindow):
         self.log = logging.getLogger('GUI')
         self.log.setLevel(logging.DEBUG)
 
-        self.Codec_comboBox.addItems(codec_to_try)
+        self.Codec_comboBox.addItems(codec_to_try + [AUTO_CODEC])
 
         #Setting icons for some buttons for prettiness
         self.RUNButton.setIcon(QtGui.QIcon("GUI/icons/play.svg"))
@@ -82,23 +83,38 @@ class BASLER_GUI(QMainWindow):
         self.FlipYButton.setIcon(QtGui.QIcon("GUI/icons/ArrowsUpDown.svg"))
         self.Rec_status.setPixmap(QtGui.QIcon("GUI/icons/VideoCameraSlash.svg").pixmap(64))
 
+        self.camera_tasks = CameraTaskRunner(self)  # runs auto exposure etc. in the background
         self.ConnectSignals()
         self.basler_recorder = Recorder(write_timestamps=SAVE_TIMESTAMPS)
-        self.scan_cams()
-
-        if ENABLE_REMOTE:
+        # the grab thread announces new preview frames, the signal delivers them queued to the main thread
+        self.preview_signal = PreviewSignal()
+        self.preview_signal.frames_ready.connect(self.show_preview)
+        self.basler_recorder.preview_callback = self.preview_signal.frames_ready.emit
+        QTimer.singleShot(0, self.scan_cams)  # after the window is shown, enumerating cameras takes a while
+
+        if ENABLE_REMOTE and MULTI_CLIENT_REMOTE:
+            # messages are handled as soon as they arrive, the signal wakes up the main thread
+            self.remote_signal = RemoteSignal()
+            self.remote_signal.received.connect(self.remote_message_received)
+            self.socket_comm = RemoteServer(host=HOST, port=PORT, message_callback=self.remote_signal.received.emit)
+        elif ENABLE_REMOTE:
             self.socket_comm = SocketComm(type='server', host=HOST, port=PORT)
         else:  # disable remote mode
             self.socket_comm = None
             self.RemoteModeButton.deleteLater()
             self.Client_label.deleteLater()
+        # previews for remote dashboards, streamed on request (stream_preview)
+        self.preview_streamer = PreviewStreamer(host=HOST, port=PREVIEW_STREAM_PORT) if ENABLE_REMOTE else None
 
         self.is_remote_ctr = False  # bool whether the GUI is currently in remote mode
+        self.remote_message_timer = None  # polls SocketComm, RemoteServer signals its messages
+        self.file_transfer = FileTransfer(max_workers=COPY_WORKERS, progress_callback=self.report_copy_progress)
 
         if USE_ARDUINO_TRIGGER:  # NOT IMPLEMENTE
             #serial_port = f"/dev/{QtSerialPort.QSerialPortInfo.availablePorts()[0].portName()}"
             # find a way to get the port name on windows machines
             #self.trigger = TriggerArduino(serial_port)
+            from FreiPose_Recorder.utils.serial_utils import QtPicoSerial
             self.scan_ports()
             self.trigger = QtPicoSerial(self)
             #raise NotImplementedError('Arduino trigger not implemented')
@@ -112,6 +128,7 @@ class BASLER_GUI(QMainWindow):
     ### Serial connectivity ####
     def scan_ports(self):
         """scans for available serial ports"""
+        from PyQt6 import QtSerialPort  # only needed with a trigger
         self.log.debug(f'Scanning serial ports')
         self.PortsCombo.clear()
         self.PortsCombo.addItem("<no port selected>")
@@ -244,7 +261,18 @@ class BASLER_GUI(QMainWindow):
 
 
 
+    def acquisition_buttons_enabled(self, enabled: bool):
+        """RUN, REC and single camera view"""
+        self.RUNButton.setEnabled(enabled)
+        self.RECButton.setEnabled(enabled)
+        self.ShowSingleCamButton.setEnabled(enabled)
+
     def start_recording(self):
+        # dont run auto functions while recording, they close the cameras when done. Started once they stopped
+        self.acquisition_buttons_enabled(False)
+        self.camera_tasks.when_idle(self._start_recording)
+
+    def _start_recording(self):
         self.files_copied = False
         self.stop_event = Event()
         session_id = self.SessionIDlineEdit.text()
@@ -255,13 +283,17 @@ class BASLER_GUI(QMainWindow):
         self.basler_recorder.crf = self.crf_spinBox.value()
         self.number_cams = self.basler_recorder.cam_array.GetSize()
         use_hw_trigger = self.HWTrig_checkBox.isChecked()
+        self.check_bandwidth()
+        self.basler_recorder.snapshot_settings(self.session_id, self.general_settings())
 
         self.basler_recorder.run_multi_cam_record(self.stop_event, filename=self.session_id,
-                                                  use_hw_trigger=use_hw_trigger)
+                                                  use_hw_trigger=use_hw_trigger,
+                                                  camera_settings=self.basler_recorder.snapshot_cameras)
+        self.start_uploader()
 
         self.multi_view_timer = QTimer()
         self.multi_view_timer.timeout.connect(self.update_multi_view)
-        self.multi_view_timer.start(5)  # dependign on frame rate ..
+        self.multi_view_timer.start(STATUS_INTERVAL)  # frames arrive via show_preview
 
         self.STOPButton.setEnabled(True)
         self.RUNButton.setEnabled(False)
@@ -291,6 +323,21 @@ class BASLER_GUI(QMainWindow):
             self.trigger_timer.timeout.connect(self.trigger.start_trigger)
             self.trigger_timer.start(500)
 
+    def check_bandwidth(self) -> list:
+        """
+        Estimates link, cpu and disk load of the recording and warns if frames would be dropped
+        :return: list of warnings
+        """
+        cameras = BandwidthPlanner.cameras_from_recorder(self.basler_recorder)
+        codec = self.basler_recorder.resolve_codec(self.Codec_comboBox.currentText(), self.FrameRateSpin.value())
+        plan = self.bandwidth_planner.plan(cameras, self.FrameRateSpin.value(), codec, self.crf_spinBox.value())
+        self.log.debug(BandwidthPlanner.format_report(plan))
+        for warning in plan['warnings']:
+            self.log.warning(warning)
+        if plan['warnings']:
+            self.statusbar.showMessage(f"Recording might drop frames: {plan['warnings'][0]}")
+        return plan['warnings']
+
     def start_recording_calib(self):
         self.HWTrig_checkBox.setChecked(True)  # making sure calib mode is on
         self.log.info(f'Started Calibration sequence..\nwaiting for {CALIB_WAIT}s to start recording')
@@ -340,6 +387,8 @@ class BASLER_GUI(QMainWindow):
             self.multi_view_timer = None
             if self.basler_recorder.is_recording:
                 self.basler_recorder.stop_multi_cam_record()
+                if self.uploader:
+                    self.uploader.stop_event.set()  # joined before the final copy
             else:
                 self.basler_recorder.stop_multi_cam_show()
 
@@ -376,11 +425,15 @@ class BASLER_GUI(QMainWindow):
 
     def show_single_cam(self):
         """
-        Show single camera in a separate window
+        Show single camera in a separate window, once no camera task is running
         """
         self.All_cams_checkBox.setChecked(False)  # uncheck to not mess up with settings
 
         current_camid = self.get_current_tab()
+        self.acquisition_buttons_enabled(False)
+        self.camera_tasks.when_idle(lambda: self._show_single_cam(current_camid))
+
+    def _show_single_cam(self, current_camid: int):
         self.stop_event = Event()
         self.basler_recorder.fps = self.FrameRateSpin.value()
         self.basler_recorder.run_single_cam_show(current_camid, self.stop_event)
@@ -419,6 +472,10 @@ class BASLER_GUI(QMainWindow):
         self.single_camviewer.updateView(currentImg)
 
     def show_multiple_cam(self):
+        self.acquisition_buttons_enabled(False)
+        self.camera_tasks.when_idle(self._show_multiple_cam)
+
+    def _show_multiple_cam(self):
         self.stop_event = Event()
         self.basler_recorder.fps = self.FrameRateSpin.value()
         self.number_cams = self.basler_recorder.cam_array.GetSize()
@@ -427,7 +484,7 @@ class BASLER_GUI(QMainWindow):
 
         self.multi_view_timer = QTimer()
         self.multi_view_timer.timeout.connect(self.update_multi_view)
-        self.multi_view_timer.start(int(1000 // (self.FrameRateSpin.value() * 1.2)))
+        self.multi_view_timer.start(STATUS_INTERVAL)  # frames arrive via show_preview
 
         self.STOPButton.setEnabled(True)
         self.RUNButton.setEnabled(False)
@@ -449,28 +506,31 @@ class BASLER_GUI(QMainWindow):
             self.trigger_timer.timeout.connect(self.trigger.start)
             self.trigger_timer.start(500)
 
+    def show_preview(self, cam_id: int):
+        """
+        Shows the newest frame of a camera, called via preview_signal when the camera has new frames. Each camera is
+        updated on its own, a slow camera does not hold back the others.
+        """
+        curr_image = self.basler_recorder.take_preview(cam_id)
+        if curr_image is None:
+            return
+        if self.preview_streamer is not None:
+            self.preview_streamer.offer(cam_id, curr_image)
+        if self.DisableViz_checkBox.isChecked():
+            return
+        self.MultiViewWidget.update_camera(cam_id, curr_image)
+        self.MultiViewWidget.paint()
+
     def update_multi_view(self):
-        # call this from a thread ? or maybe not
+        """status of the running acquisition, called by multi_view_timer"""
         if self.basler_recorder.error_event.is_set():  # if an error occured
             self.log.error('Error in Basler recorder')
             self.stop_cams()
-            if self.socket_comm:
-                self.socket_comm.send_json_message(SocketMessage.respond_recording_fail)
+            if self.socket_comm:  # not a reply, all clients have to know
+                self.socket_comm.broadcast(SocketMessage.respond_recording_fail)
             return
 
-        self.timer_update_counter += 1
-        if self.timer_update_counter >= 20:
-            self.update_rec_timer()  # dont call this too often ?
-            self.timer_update_counter = 0
-        try:
-            for c_id in range(self.number_cams):
-                curr_image = self.basler_recorder.multi_view_queue[c_id].get_nowait()
-                if self.DisableViz_checkBox.isChecked():
-                    continue  # return fast
-                else:
-                    self.MultiViewWidget.cam_viewers[c_id].updateView(curr_image)
-        except Empty:
-            return
+        self.update_rec_timer()
 
         writerstatus = f"\tVideoWriter {self.basler_recorder.video_writer_list[0].get_state()}" if len(
             self.basler_recorder.video_writer_list) >= 1 else "not recording"
@@ -479,6 +539,10 @@ class BASLER_GUI(QMainWindow):
         for i in range(len(self.basler_recorder.multi_view_queue)):
             display_string += f"Q{i}: {self.basler_recorder.multi_view_queue[i].qsize()}"
         display_string += f"{writerstatus}"
+        problems = [f"{cam['name']} {cam['state']}" for cam in self.basler_recorder.get_camera_status()
+                    if cam['state'] != 'ok']
+        if problems:
+            display_string += f"\t{', '.join(problems)}"
 
         self.statusbar.showMessage(display_string)
         # self.ViewWidget.updateView(currentImg)
@@ -486,7 +550,8 @@ class BASLER_GUI(QMainWindow):
 
         if not self.basler_recorder.is_recording and not self.basler_recorder.is_viewing:
             self.log.error('Basler recording stopped internally')
-            self.socket_comm.send_json_message(SocketMessage.respond_recording_fail)
+            if self.socket_comm:
+                self.socket_comm.broadcast(SocketMessage.respond_recording_fail)
 
     def update_rec_timer(self):
         current_run_time = time.monotonic() - self.rec_start_time
@@ -510,14 +575,9 @@ class BASLER_GUI(QMainWindow):
             return
 
         # get active camera settings.. save those to json with cam name
-        cam_lib = {}
-        for cam in self.basler_recorder.cam_array:
-            cam_settings = self.basler_recorder.get_cam_settings(cam)
-            cam_lib.update(**cam_settings)
+        cam_lib = self.basler_recorder.read_settings()
 
-        cam_lib.update(**{'save_path': self.basler_recorder.save_path, 'fps': self.FrameRateSpin.value(),
-                          "HW_trigg": self.HWTrig_checkBox.isChecked(), 'codec': self.Codec_comboBox.currentText(),
-                          "crf": self.crf_spinBox.value()})
+        cam_lib.update(**self.general_settings())
 
         # open file dialog for where to save
         settings_file = QFileDialog.getSaveFileName(self, 'Save settings file', "",
@@ -553,14 +613,52 @@ class BASLER_GUI(QMainWindow):
         with open(file, 'r') as fi:
             cam_lib = json.load(fi)
 
+        self.cam_lib = cam_lib
+        self.profile = cam_lib.get('profile', None)
+        self.basler_recorder.apply_settings(cam_lib, self.profile)
+        self.show_settings(cam_lib, cam_lib)
+
+    def select_profile(self, profile: (str, None)):
+        """
+        Switches the recording profile (ROI/binning) of the loaded settings file, None uses the full sensor
+        """
+        if profile and profile not in self.cam_lib.get('profiles', {}):
+            self.log.error(f'Recording profile {profile} not found in the settings file')
+            return
+        self.profile = profile
+        self.basler_recorder.apply_settings(self.cam_lib, profile or '')
+
+    def restore_snapshot(self, reference: str) -> bool:
+        """
+        Restores a settings snapshot, only the differences to the current camera state are applied
+        :param reference: snapshot ID or session ID for the latest snapshot of that session
+        :return: False if there is no such snapshot
+        """
+        snapshot = self.basler_recorder.restore_snapshot(reference)
+        if snapshot is None:
+            return False
+        self.show_settings(snapshot['cameras'], snapshot['general'])
+        return True
+
+    def general_settings(self) -> dict:
+        """settings which are not camera specific, as stored in settings files and snapshots"""
+        general = {'save_path': self.basler_recorder.save_path, 'fps': self.FrameRateSpin.value(),
+                   "HW_trigg": self.HWTrig_checkBox.isChecked(), 'codec': self.Codec_comboBox.currentText(),
+                   "crf": self.crf_spinBox.value()}
+        if self.cam_lib.get('profiles', None):
+            general.update(profiles=self.cam_lib['profiles'], profile=self.profile)
+        return general
+
+    def show_settings(self, cam_lib: dict, general: dict):
+        """
+        Updates the widgets with applied settings
+        :param cam_lib: dict camera name -> settings
+        :param general: general settings, see general_settings
+        """
         for c_id, cam in enumerate(self.basler_recorder.cam_array):
-            try:
-                settings = cam_lib[cam.DeviceInfo.GetUserDefinedName()]
-            except KeyError:
-                self.log.info(f'No settings found for cam: {cam.DeviceInfo.GetUserDefinedName()} '
-                              f'with SN: {cam.DeviceInfo.GetSerialNumber()}')
+            settings = cam_lib.get(cam.DeviceInfo.GetUserDefinedName(), None)
+            if settings is None:
                 continue
-            self.basler_recorder.set_cam_settings(cam, settings)
             self.CameraSettings.exposure_spin_list[c_id].blockSignals(True)
             self.CameraSettings.gain_spin_list[c_id].blockSignals(True)
             self.CameraSettings.color_mode_list[c_id].blockSignals(True)
@@ -572,11 +670,11 @@ class BASLER_GUI(QMainWindow):
             self.CameraSettings.color_mode_list[c_id].blockSignals(False)
 
         try:
-            self.HWTrig_checkBox.setChecked(cam_lib['HW_trigg'])
-            self.crf_spinBox.setValue(cam_lib['crf'])
-            self.Codec_comboBox.setCurrentText(cam_lib['codec'])
-            self.FrameRateSpin.setValue(cam_lib['fps'])
-            self.set_save_path(cam_lib['save_path'])
+            self.HWTrig_checkBox.setChecked(general['HW_trigg'])
+            self.crf_spinBox.setValue(general['crf'])
+            self.Codec_comboBox.setCurrentText(general['codec'])
+            self.FrameRateSpin.setValue(general['fps'])
+            self.set_save_path(general['save_path'])
             #self.basler_recorder.save_path = cam_lib['save_path']
         except KeyError:
             self.log.info('No-full general settings found in file')
@@ -597,38 +695,72 @@ class BASLER_GUI(QMainWindow):
         """Returns the ID of currently open tab"""
         return self.CameraSettings.toolbox.currentIndex()
 
-    # those functions are now blocking ? maybe make sure they r not ? create threads for actual adjustments ?
+    def run_camera_task(self, task_name: str, function):
+        """Runs a blocking camera routine in the background for given/all camera, a second click cancels it"""
+        if self.camera_tasks.is_running():
+            if self.camera_tasks.task_name == task_name:
+                self.log.info(f'Cancelling {task_name}')
+                self.camera_tasks.cancel()
+            return
+        self.task_buttons_enabled(False, keep=task_name)
+        grabbing = self.basler_recorder.is_viewing or self.single_view_timer is not None
+        if grabbing and task_name in ('exposure', 'gain'):
+            # cameras are busy, adjust from the histograms of the frames which are grabbed anyway
+            cam_ids = None if self.All_cams_checkBox.isChecked() else [self.get_current_tab()]
+            if self.single_view_timer is not None:
+                cam_ids = [self.basler_recorder.current_cam_id]
+            self.camera_tasks.start_array(
+                task_name, lambda **kwargs: self.basler_recorder.run_software_auto(task_name, cam_ids, **kwargs))
+        elif self.All_cams_checkBox.isChecked():
+            # configure all cameras and let them converge at the same time
+            self.camera_tasks.start_array(task_name,
+                                          lambda **kwargs: self.basler_recorder.run_auto_array(task_name, **kwargs))
+        else:
+            self.camera_tasks.start(task_name, function, [self.get_current_tab()])
+
+    def task_buttons_enabled(self, enabled: bool, keep: str = None):
+        """en/disables the buttons of the camera routines, the button of the running routine stays enabled to cancel"""
+        for task_name, button in (('exposure', self.AutoExposeButton), ('gain', self.AutoGainButton),
+                                  ('white balance', self.WhiteBalanceButton)):
+            button.setEnabled(enabled or task_name == keep)
+        self.All_cams_checkBox.setEnabled(enabled)
+        self.CameraSettings.toolbox.setEnabled(enabled)
+
     def auto_expose(self):
         """Runs autoexposure routine for given/all camera"""
-        if self.All_cams_checkBox.isChecked():
-            for current_camid in range(len(self.basler_recorder.cam_array)):
-                final_exp = self.basler_recorder.run_auto_exposure(current_camid)
-                # todo block triggerign of setting values !
-                self.CameraSettings.exposure_spin_list[current_camid].setValue(final_exp)
-        else:
-            current_camid = self.get_current_tab()
-            final_exp = self.basler_recorder.run_auto_exposure(current_camid)
-            self.CameraSettings.exposure_spin_list[current_camid].setValue(final_exp)
+        self.run_camera_task('exposure', self.basler_recorder.run_auto_exposure)
 
     def auto_gain(self):
         """Runs autogain routine for given/all camera"""
-        if self.All_cams_checkBox.isChecked():
-            for current_camid in range(len(self.basler_recorder.cam_array)):
-                final_gain = self.basler_recorder.run_auto_gain(current_camid)
-                self.CameraSettings.gain_spin_list[current_camid].setValue(final_gain)
-        else:
-            current_camid = self.get_current_tab()
-            final_gain = self.basler_recorder.run_auto_gain(current_camid)
-            self.CameraSettings.gain_spin_list[current_camid].setValue(final_gain)
+        self.run_camera_task('gain', self.basler_recorder.run_auto_gain)
 
     def white_balance(self):
         """Runs auto white balance routine for given/all camera"""
-        if self.All_cams_checkBox.isChecked():
-            for current_camid in range(len(self.basler_recorder.cam_array)):
-                self.basler_recorder.run_white_balance(current_camid)
+        self.run_camera_task('white balance', self.basler_recorder.run_white_balance)
+
+    def camera_task_progress(self, cam_id: int, task_name: str, n_images: int):
+        self.statusbar.showMessage(f'Auto {task_name} camera {cam_id}: {n_images} images')
+
+    def camera_task_finished(self, cam_id: int, task_name: str, value: float):
+        """sets the resulting value of a camera routine to the GUI, without triggering setting it again"""
+        if task_name == 'exposure':
+            spin = self.CameraSettings.exposure_spin_list[cam_id]
+        elif task_name == 'gain':
+            spin = self.CameraSettings.gain_spin_list[cam_id]
         else:
-            current_camid = self.get_current_tab()
-            self.basler_recorder.run_white_balance(current_camid)
+            return
+        spin.blockSignals(True)
+        spin.setValue(value)
+        spin.blockSignals(False)
+
+    def camera_task_failed(self, cam_id: int, task_name: str, error: str):
+        self.statusbar.showMessage(f'Auto {task_name} failed for camera {cam_id}: {error}')
+
+    def camera_tasks_done(self, task_name: str):
+        self.log.debug(f'Auto {task_name} finished for all cameras')
+        # a recording started once the cancelled task finished, its buttons stay disabled
+        if not self.is_remote_ctr and not self.basler_recorder.is_recording:
+            self.task_buttons_enabled(True)
 
     def set_gain_exposure(self):
         """set the gain and exposure time for the current camera"""
@@ -673,6 +805,10 @@ class BASLER_GUI(QMainWindow):
         self.WhiteBalanceButton.clicked.connect(self.white_balance)
         self.FlipXButton.clicked.connect(self.flip_x)
         self.FlipYButton.clicked.connect(self.flip_y)
+        self.camera_tasks.progress.connect(self.camera_task_progress)
+        self.camera_tasks.finished.connect(self.camera_task_finished)
+        self.camera_tasks.failed.connect(self.camera_task_failed)
+        self.camera_tasks.all_finished.connect(self.camera_tasks_done)
 
         self.ShowSingleCamButton.clicked.connect(self.show_single_cam)
 
@@ -722,14 +858,20 @@ class BASLER_GUI(QMainWindow):
         self.FrameRateSpin.setEnabled(False)
         self.SessionIDlineEdit.setEnabled(False)
 
-        self.remote_message_timer = QTimer()
-        self.remote_message_timer.timeout.connect(self.check_and_parse_messages)
-        self.remote_message_timer.start(500)
         self.is_remote_ctr = True
+        if isinstance(self.socket_comm, RemoteServer):
+            # later messages arrive via remote_signal, handle those received before remote mode was entered
+            for _ in range(self.socket_comm.messages.qsize()):
+                self.check_and_parse_messages()
+        else:  # SocketComm has to be polled
+            self.remote_message_timer = QTimer()
+            self.remote_message_timer.timeout.connect(self.check_and_parse_messages)
+            self.remote_message_timer.start(500)
         self.socket_comm.send_json_message(SocketMessage.status_ready)
 
     def exit_remote_mode(self):
         self.socket_comm.close_socket()
+        self.preview_streamer.close()
         self.Client_label.setText("disconnected")
         self.RemoteModeButton.setText("Enable\nREMOTE-mode")
         self.RemoteModeButton.setIcon(QtGui.QIcon("GUI/icons/Signal.svg"))
@@ -758,6 +900,22 @@ class BASLER_GUI(QMainWindow):
         self.SessionIDlineEdit.setEnabled(True)
         self.SessionIDlineEdit.setText("")
 
+    def remote_message_received(self):
+        """a remote client sent a message, handled right away in remote mode (otherwise once remote mode starts)"""
+        if self.is_remote_ctr:
+            self.check_and_parse_messages()
+
+    def current_status(self) -> dict:
+        """status message for the remote clients"""
+        cameras = self.basler_recorder.get_camera_status()
+        if self.basler_recorder.is_recording:
+            return SocketMessage.with_cameras(SocketMessage.status_recording, cameras)
+        elif self.basler_recorder.is_viewing:
+            return SocketMessage.with_cameras(SocketMessage.status_viewing, cameras)
+        elif self.is_remote_ctr:
+            return SocketMessage.status_ready
+        return SocketMessage.status_error
+
     def check_and_parse_messages(self):
         message = self.socket_comm.read_json_message_fast_linebreak()
         if message:
@@ -773,30 +931,38 @@ class BASLER_GUI(QMainWindow):
 
                 # combined for rec types
                 try:
-                    if message["setting_file"]:
+                    if message["setting_file"] and self.restore_snapshot(message["setting_file"]):
+                        self.log.debug(f"restored settings snapshot {message['setting_file']}")
+                    elif message["setting_file"]:
                         self.load_settings(message["setting_file"])
                         self.log.debug(f"loaded settings from {message['setting_file']}")
                 except (FileNotFoundError, KeyError):
                     self.log.error("passed settings file not found")
+                if message.get("profile", None) is not None:
+                    self.select_profile(message["profile"])
 
                 self.session_id = message["session_id"]
+                self.session_path = message.get("session_path", None)
                 self.SessionIDlineEdit.setText(self.session_id)
                 try:
                     if message["frame_rate"]:
                         self.FrameRateSpin.setValue(message["frame_rate"])
                 except KeyError:
                     pass
-                self.remote_message_timer.setInterval(5000)  # increase the interval to 10s
+                if self.remote_message_timer:
+                    self.remote_message_timer.setInterval(5000)  # increase the interval to 10s
 
                 if message['type'] == MessageType.start_video_rec.value:
                     self.log.info("got message to start recording")
                     self.start_recording()
                     self.socket_comm.send_json_message(SocketMessage.respond_recording)
+                    self.socket_comm.push_status(self.current_status())
 
                 elif message['type'] == MessageType.start_video_view.value:
                     self.log.info("got message to start viewing")
                     self.show_multiple_cam()
                     self.socket_comm.send_json_message(SocketMessage.respond_viewing)
+                    self.socket_comm.push_status(self.current_status())
 
                 elif message['type'] == MessageType.start_video_calibrec.value:
                     self.log.info("got message to start calibration_rec")
@@ -806,18 +972,13 @@ class BASLER_GUI(QMainWindow):
             elif message['type'] == MessageType.stop_video.value:
                 self.log.info("got message to stop")
                 self.stop_cams()
-                self.remote_message_timer.setInterval(500)
+                if self.remote_message_timer:
+                    self.remote_message_timer.setInterval(500)
                 self.socket_comm.send_json_message(SocketMessage.respond_stop)
+                self.socket_comm.push_status(self.current_status())
 
             elif message['type'] == MessageType.poll_status.value:
-                if self.basler_recorder.is_recording:
-                    self.socket_comm.send_json_message(SocketMessage.status_recording)
-                elif self.basler_recorder.is_viewing:
-                    self.socket_comm.send_json_message(SocketMessage.status_viewing)
-                elif self.is_remote_ctr:
-                    self.socket_comm.send_json_message(SocketMessage.status_ready)
-                else:
-                    self.socket_comm.send_json_message(SocketMessage.status_error)
+                self.socket_comm.send_json_message(self.current_status())
 
             elif message['type'] == MessageType.disconnected.value:
                 self.log.info("got message that client disconnected")
@@ -833,44 +994,27 @@ class BASLER_GUI(QMainWindow):
                 self.log.debug('got message to purge files')
                 self.purge_recorded_file()
 
-    def purge_recorded_file(self):
-        for videowriter in self.basler_recorder.video_writer_list:
-            if videowriter.stopped:
-                self.log.info(f"Deleting file {videowriter.video_path}")
-                Path(videowriter.video_path).unlink()
-            else:
-                self.log.info(f"Cant delete file {videowriter.video_path} as recorder hasnt finished yet")
-
-    def copy_recorded_file(self):
-        if not self.basler_recorder.is_recording and not self.files_copied:
-            for videowriter in self.basler_recorder.video_writer_list:
-                if videowriter.stopped:
-                    self.log.info(f"Copying file {videowriter.video_path} to {Path(self.session_path) / VIDEO_FOLDER}")
-
-                    try:
-                        if 'MusterMaus' in self.session_id:
-                            shutil.copyfile(videowriter.video_path,
-                                            Path(self.session_path) / Path(videowriter.video_path).name)
-                        else:
-                            if Path(self.session_path).exists():
-                                #if not (Path(self.session_path) / VIDEO_FOLDER).exists():
-                                (Path(self.session_path) / VIDEO_FOLDER).mkdir(exist_ok=True)
-                            shutil.copyfile(videowriter.video_path,
-                                            Path(self.session_path) / VIDEO_FOLDER / Path(videowriter.video_path).name)
-                    except (FileNotFoundError, IOError) as e:
-                        self.socket_comm.send_json_message(SocketMessage.respond_copy_fail)
-                        self.log.error(f"Error copying file {e}")
-                        return
-            self.files_copied = True
-            self.log.info(f"Finished copying files to {Path(self.session_path) / VIDEO_FOLDER}")
-            self.socket_comm.send_json_message(SocketMessage.respond_copy)
+            elif message['type'] == MessageType.stream_preview.value:
+                self.log.debug('got message to stream previews')
+                try:
+                    settings = self.preview_streamer.configure(message)
+                except ValueError as e:
+                    self.log.error(f'invalid stream_preview message: {e}')
+                    self.socket_comm.send_json_message(
+                        SocketMessage.respond_stream_fail(str(e), self.preview_streamer.settings))
+                    return
+                self.socket_comm.send_json_message(SocketMessage.respond_stream(PREVIEW_STREAM_PORT, settings))
 
     def app_is_exiting(self):
         """Routine to be run when the app is exiting, cleanup and release of resources"""
         # check if recording is running stop if does.
+        self.camera_tasks.wait()  # the tasks must not hold the cameras while they are disconnected
         self.stop_cams()  # stop any grabbing still ongoing
+        self.file_transfer.shutdown(wait=True)  # let running copies finish
         if self.socket_comm:
             self.socket_comm.close_socket()
+        if self.preview_streamer is not None:
+            self.preview_streamer.close()
         self.basler_recorder.disconnect_cams()  # close and release cameras
 
     def closeEvent(self, event):
@@ -897,7 +1041,17 @@ class BASLER_GUI(QMainWindow):
         super(BASLER_GUI, self).closeEvent(event)
 
 
+def setup_logging():
+    """make the logging to file"""
+    if LOG2FILE:
+        log_path = Path('logs')
+        log_path.mkdir(exist_ok=True)
+        logging.basicConfig(filename=log_path / f'GUI_run{datetime.datetime.now().strftime("%m%d_%H%M")}.log',
+                            filemode='w', format='%(asctime)s - %(levelname)s - %(message)s')
+
+
 def start_gui():
+    setup_logging()
     app = QApplication([])
     win = BASLER_GUI()
     win.show()
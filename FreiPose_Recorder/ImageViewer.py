@@ -8,19 +8,34 @@ from PyQt6.QtWidgets import QWidget, QHBoxLayout, QVBoxLayout, QDialog, QSizePol
 from PyQt6 import uic, QtCore, QtGui, QtWidgets
 import numpy as np
 
-import cv2
 import time
 
+from FreiPose_Recorder.utils.preview import downscale, PreviewThrottle, Mosaic, grid_columns
+from FreiPose_Recorder.configs.params import PREVIEW_MAX_FPS, PREVIEW_RESAMPLING, PREVIEW_MOSAIC
+
+
+class PreviewSignal(QtCore.QObject):
+    """carries preview notifications of the grab thread (cam_id) into the Qt main thread"""
+    frames_ready = QtCore.pyqtSignal(int)
+
+
+class RemoteSignal(QtCore.QObject):
+    """wakes up the Qt main thread when a remote client sent a message"""
+    received = QtCore.pyqtSignal()
+
 
 class MultiCameraViewer(QWidget):
     """
     A widget that displays the images from multiple cameras.
+    With mosaic all cameras are composed into a single image, which is painted once per tick.
     """
-    def __init__(self, parent=None, num_cameras=4):
+    def __init__(self, parent=None, num_cameras=4, mosaic=PREVIEW_MOSAIC):
         super().__init__(parent)
         self.grid = None
         self._num_cameras = num_cameras
         self.cam_viewers = []
+        self.mosaic_view = None
+        self.mosaic = mosaic
         self.parent = parent
         self.init_ui()
         self.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
@@ -45,31 +60,70 @@ class MultiCameraViewer(QWidget):
         # self.grid.setContentsMargins(0, 0, 0, 0)
         self.setLayout(self.grid)
 
-        # create a RawImageWidget for each camera and add it to the layout
-        if self.num_cameras <= 4:
-            step = 2
-        else:
-            step = 3
+        self.add_views()
+        self.show()
+        self.grid.setSpacing(0)
+
+    def add_views(self):
+        """create a RawImageWidget for each camera (or one for the mosaic) and add it to the layout"""
+        if self.mosaic:
+            self.mosaic_view = MosaicView(self.num_cameras, self.parent)
+            self.grid.addWidget(self.mosaic_view, 0, 0)
+            return
+        step = grid_columns(self.num_cameras)
         for i in range(self.num_cameras):
             widget = ImageView_camera(self.parent)
             self.cam_viewers.append(widget)
             self.grid.addWidget(widget, i // step, i % step)
 
-        self.show()
-        self.grid.setSpacing(0)
-
     def change_ui(self):
         for view in self.cam_viewers:
             self.grid.removeWidget(view)
+        if self.mosaic_view is not None:
+            self.grid.removeWidget(self.mosaic_view)
+            self.mosaic_view = None
         self.cam_viewers = []
-        if self.num_cameras <= 4:
-            step = 2
+        self.add_views()
+
+    def update_camera(self, cam_id: int, image):
+        """new preview image of a camera, shown with the next paint()"""
+        if self.mosaic_view is not None:
+            self.mosaic_view.put(cam_id, image)
         else:
-            step = 3
-        for i in range(self.num_cameras):
-            widget = ImageView_camera(self.parent)
-            self.cam_viewers.append(widget)
-            self.grid.addWidget(widget, i // step, i % step)
+            self.cam_viewers[cam_id].updateView(image)
+
+    def paint(self):
+        """called once per tick after the cameras were updated, paints the mosaic"""
+        if self.mosaic_view is not None:
+            self.mosaic_view.paint()
+
+
+class MosaicView(QWidget):
+    """a single RawImageWidget showing the previews of all cameras in a grid"""
+    def __init__(self, num_cameras, parent=None):
+        super(MosaicView, self).__init__(parent)
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.image_view = pg.RawImageWidget(scaled=True)
+        self.image_view.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
+        layout.addWidget(self.image_view)
+        self.mosaic = Mosaic(num_cameras, self.view_size())
+        self.throttle = PreviewThrottle(PREVIEW_MAX_FPS)
+
+    def view_size(self) -> tuple:
+        """size of the image widget in device pixels"""
+        ratio = self.image_view.devicePixelRatioF()
+        return int(self.image_view.width() * ratio), int(self.image_view.height() * ratio)
+
+    def put(self, cam_id, image):
+        self.mosaic.put(cam_id, image)
+
+    def paint(self):
+        if not self.mosaic.dirty or not self.throttle.should_draw():
+            return
+        self.image_view.setImage(self.mosaic.canvas.transpose(1, 0, 2))
+        self.mosaic.dirty = False
+        self.mosaic.resize(self.view_size())  # takes effect with the next frames
 
 
 class ImageView_camera(QWidget):
@@ -88,12 +142,22 @@ class ImageView_camera(QWidget):
         layout.addWidget(self.image_view)
 
         self.image_view.setImage(np.random.randint(0, 255, (128, 128), np.uint8))
+        self.throttle = PreviewThrottle(PREVIEW_MAX_FPS)
+
+    def view_size(self) -> tuple:
+        """size of the image widget in device pixels"""
+        ratio = self.image_view.devicePixelRatioF()
+        return int(self.image_view.width() * ratio), int(self.image_view.height() * ratio)
 
     def updateView(self, image):
         """
         Set the image to be displayed in the RawImageWidget.
         image: numpy array containing the image data
         """
+        if not self.throttle.should_draw(image):
+            return
+        # converting and painting the full resolution costs a lot of cpu, reduce it to the size of the widget
+        image = downscale(image, self.view_size(), PREVIEW_RESAMPLING)
         # rotate img such that if it 2 dimentional it s transposed if 3 dimentional only first 2 axis are transposed
         try:
             if len(image.shape) == 3:
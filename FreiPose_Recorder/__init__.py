@@ -4,6 +4,13 @@ FreiPose_Recorder
 A module for Recording Videos using Basler Cameras
 
 """
-from FreiPose_Recorder.GUI_run import VERSION
+from FreiPose_Recorder.version import VERSION
 __version__ = VERSION
-from FreiPose_Recorder.GUI_run import start_gui as startRecorder
\ No newline at end of file
+
+
+def __getattr__(name):
+    # the GUI imports Qt, it is only loaded when it is used (not by the headless recorder)
+    if name == 'startRecorder':
+        from FreiPose_Recorder.GUI_run import start_gui
+        return start_gui
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
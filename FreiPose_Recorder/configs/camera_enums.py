@@ -46,6 +46,7 @@ class CameraRegistry:
     }
     """
     def __init__(self):
+        self._dirty = False  # cameras were added but not written yet
         try:
             with open('../cameras.json', 'r') as f:
                 self._cameras = json.load(f)
@@ -58,19 +59,29 @@ class CameraRegistry:
         """write the camera dict to a json file"""
         with open('../cameras.json', 'w') as f:
             json.dump(self._cameras, f, indent=4)
+        self._dirty = False
 
-    def get_camera(self, serial_number):
+    def get_camera(self, serial_number, write: bool = True):
         """get the camera dict for a given serial number
-        if the camera is not in the dict, add it"""
+        if the camera is not in the dict, add it
+        :param write: write the json file directly if a camera was added, otherwise call flush once all cameras are
+        looked up"""
         if serial_number not in self._cameras:
             # Add a new camera if it does not exist
             index = len(self._cameras)
             #context = self.hash_camera_name(f'cam_{index:02d}')
             self._cameras[serial_number] = {'name': f'cam{index:02d}', 'context': index}
             self.validate_cameras()
-            self.write_newcam()
+            self._dirty = True
+            if write:
+                self.write_newcam()
         return self._cameras[serial_number]
 
+    def flush(self):
+        """write the json file if cameras were added with get_camera(..., write=False)"""
+        if self._dirty:
+            self.write_newcam()
+
     @classmethod
     def hash_camera_name(cls, name):
         """hash the camera name to a fixed size integer for the context value"""
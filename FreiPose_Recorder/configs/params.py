@@ -12,4 +12,32 @@ TRIGGER_LINE_OUT = "Line1"  # Outputline for the camera
 MAX_FPS = 150    # maximum fps for the camera
 codec_to_try = ["h264_nvenc", "libx264", "mpeg4", "mpeg2video", "libxvid", "libx264rgb"]
 LOG2FILE = True  # Boolean to log to a file
-CONVERT2 = 'RGB8' # Mono8 or RGB8 Colorformat for conversion
\ No newline at end of file
+CONVERT2 = 'RGB8' # Mono8 or RGB8 Colorformat for conversion
+SEGMENT_FRAMES = 0  # roll over to a new video file every n frames, 0 disables
+SEGMENT_MINUTES = 0  # roll over to a new video file every n minutes, 0 disables
+COPY_WORKERS = 4  # number of files copied in parallel to the session path
+COPY_WHILE_RECORDING = False  # copy recorded data to the session path during recording, if it is sent with start_rec
+UPLOAD_RATE_LIMIT = 50e6  # maximal write rate in bytes/s when copying during recording
+SNAPSHOT_FOLDER = 'settings_snapshots'  # folder of the versioned settings snapshots, one per session and change
+GRAB_TIMEOUT = 10000  # ms without any frame of all cameras until the acquisition is stopped with an error
+STALL_INTERVALS = 5  # a single camera is flagged as stalled after this many missed frame intervals
+ENCODER_PROFILE_FILE = 'encoder_profiles.json'  # measured encoder throughput of this machine, see bandwidth_planner
+DISK_WRITE_RATE = 200e6  # sustained write rate of the recording disk in bytes/s, used to warn before recording
+DEFAULT_CODEC = 'libx264'  # used for the codec 'auto' if no profiled codec is fast enough
+ENCODER_PRESET = None  # encoder preset of the writers, e.g. 'veryfast' for libx264, None keeps the ffmpeg default
+ENCODER_TUNE = None  # encoder tune of the writers, e.g. 'zerolatency' for libx264, None keeps the ffmpeg default
+ENCODER_PIX_FMT = None  # pixel format of the videos, e.g. 'yuv420p', None keeps the ffmpeg default
+ENCODER_THREADS = 0  # encoder threads per writer, 0 divides the cores among the writers, None keeps the ffmpeg default
+RESERVED_CORES = 1  # cores kept free for grabbing and conversion when the cores are divided among the writers
+PIN_CORES = False  # pin the grab thread and each camera writer (incl. its ffmpeg) to fixed cores, Linux only
+GRAB_CORES = [0]  # cores of the grab thread if PIN_CORES, the other cores are divided among the camera writers
+GRAB_NICE = -10  # nice value of the grab thread if PIN_CORES, negative values need CAP_SYS_NICE, None keeps it
+PREVIEW_MAX_FPS = 30  # maximal redraw rate of each camera view, 0 redraws every frame
+PREVIEW_RESAMPLING = 'stride'  # downscaling of the preview to the view size, 'stride' (fast) or 'area' (smoother)
+PREVIEW_MOSAIC = False  # compose all camera views into one image, painted once per tick (for 6-9 cameras)
+STATUS_INTERVAL = 100  # ms between updates of the status bar and the recording time, previews are event driven
+MULTI_CLIENT_REMOTE = True  # remote control server for several clients which handles messages right away
+PREVIEW_STREAM_PORT = PORT + 1  # port of the preview frames requested with stream_preview
+PREVIEW_STREAM_FPS = 5  # default frames per second and camera streamed to remote clients
+PREVIEW_STREAM_SIZE = (320, 256)  # default (width, height) the streamed previews are reduced to (at least this large)
+PREVIEW_STREAM_QUALITY = 70  # default jpeg quality of the streamed previews
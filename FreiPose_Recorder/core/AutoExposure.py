@@ -0,0 +1,157 @@
+"""
+Host side auto exposure/gain computed from the frames which are grabbed anyway.
+
+Unlike the camera auto functions (see Recorder.run_auto_exposure) this does not need GrabOne calls and therefore works
+while the cameras are grabbing. The brightness is measured from the histogram of a strided (downsampled) view of the
+frame and exposure time and gain are adjusted in a damped closed loop until the brightness stays within tolerance.
+"""
+import logging
+import math
+
+import numpy as np
+
+
+class HistogramAutoExposure:
+    """
+    Closed loop auto exposure/gain controller for a single camera.
+
+    :param exposure: current exposure time in us
+    :param gain: current gain in dB
+    :param exposure_limits: (min, max) exposure time in us
+    :param gain_limits: (min, max) gain in dB
+    :param mode: 'exposure' or 'gain' to only adjust one of them, 'both' uses exposure first and gain on top
+    :param target: target mean brightness as fraction of the maximal pixel value (like AutoTargetBrightness)
+    :param tolerance: accepted deviation from target
+    :param max_saturated: maximal fraction of saturated pixels
+    :param downsample: stride used to subsample the frame
+    :param every: only every n-th frame is evaluated, the camera needs some frames to apply new values
+    :param settle: number of consecutive evaluations within tolerance until the loop is considered converged
+    :param damping: exponent < 1 of the correction ratio to avoid overshooting
+    """
+    def __init__(self, exposure: float, gain: float, exposure_limits: tuple, gain_limits: tuple, mode: str = 'both',
+                 target: float = 0.2, tolerance: float = 0.02, max_saturated: float = 0.01, downsample: int = 8,
+                 every: int = 3, settle: int = 2, damping: float = 0.8):
+        self.exposure = exposure
+        self.gain = gain
+        self.exposure_limits = exposure_limits
+        self.gain_limits = gain_limits if gain_limits else (gain, gain)
+        self.mode = mode
+        self.target = target
+        self.tolerance = tolerance
+        self.max_saturated = max_saturated
+        self.downsample = downsample
+        self.every = every
+        self.settle = settle
+        self.damping = damping
+        self.n_frames = 0
+        self.n_updates = 0
+        self._in_tolerance = 0
+        self.converged = False
+        self.brightness = None
+        self.log = logging.getLogger('AutoExposure')
+        self.log.setLevel(logging.DEBUG)
+
+    @staticmethod
+    def measure(frame: np.ndarray, downsample: int = 8) -> (float, float):
+        """
+        Measures the brightness of a frame from the histogram of a subsampled view
+        :param frame: uint8 frame, mono (h, w) or color (h, w, 3)
+        :param downsample: stride in both dimensions
+        :return: mean brightness and fraction of saturated pixels, both in 0..1
+        """
+        sub = frame[::downsample, ::downsample]
+        if sub.ndim == 3:
+            # integer luma approximation, weights sum up to 256
+            sub = (sub[..., 0].astype(np.uint16) * 77 + sub[..., 1].astype(np.uint16) * 150
+                   + sub[..., 2].astype(np.uint16) * 29) >> 8
+        hist = np.bincount(sub.ravel(), minlength=256)
+        n_pixels = hist.sum()
+        mean = float(hist @ np.arange(hist.size)) / n_pixels / 255.0
+        saturated = float(hist[250:].sum()) / n_pixels
+        return mean, saturated
+
+    def update(self, frame: np.ndarray) -> (bool, None):
+        """
+        Feeds the next frame of the camera into the controller
+        :return: True if exposure/gain changed and should be set to the camera, None if the frame was skipped
+        """
+        self.n_frames += 1
+        if self.converged or (self.n_frames - 1) % self.every:
+            return None
+        self.brightness, saturated = self.measure(frame, self.downsample)
+
+        if abs(self.brightness - self.target) <= self.tolerance and saturated <= self.max_saturated:
+            self._in_tolerance += 1
+            self.converged = self._in_tolerance >= self.settle
+            return False
+        self._in_tolerance = 0
+
+        if saturated > self.max_saturated and self.brightness >= self.target:
+            ratio = 0.5  # mean is not reliable when clipping, step down hard
+        else:
+            ratio = self.target / max(self.brightness, 1.0 / 255)
+        ratio = min(max(ratio, 0.125), 8.0) ** self.damping
+        return self._apply_ratio(ratio)
+
+    def _apply_ratio(self, ratio: float) -> bool:
+        """distributes the brightness ratio on exposure time and gain, returns True if anything changed"""
+        old = (self.exposure, self.gain)
+        gain_lin = 10 ** (self.gain / 20.0)
+        if self.mode == 'gain':
+            self.gain = self._clip_gain(20 * math.log10(gain_lin * ratio))
+        elif self.mode == 'exposure':
+            self.exposure = self._clip_exposure(self.exposure * ratio)
+        elif ratio >= 1:
+            # brighter: exposure first, the remaining ratio via gain
+            new_exposure = self._clip_exposure(self.exposure * ratio)
+            rest = ratio * self.exposure / new_exposure
+            self.exposure = new_exposure
+            self.gain = self._clip_gain(20 * math.log10(gain_lin * rest))
+        else:
+            # darker: reduce gain first to keep noise low, the remaining ratio via exposure
+            new_gain = self._clip_gain(20 * math.log10(gain_lin * ratio))
+            rest = ratio * gain_lin / 10 ** (new_gain / 20.0)
+            self.gain = new_gain
+            self.exposure = self._clip_exposure(self.exposure * rest)
+
+        if (self.exposure, self.gain) == old:
+            # at the limits, nothing left to adjust
+            self.converged = True
+            self.log.warning(f'Auto exposure reached its limits at {self.exposure:0.0f} us, {self.gain:0.1f} dB '
+                             f'with brightness {self.brightness:0.2f}')
+            return False
+        self.n_updates += 1
+        return True
+
+    def _clip_exposure(self, exposure: float) -> float:
+        return min(max(exposure, self.exposure_limits[0]), self.exposure_limits[1])
+
+    def _clip_gain(self, gain: float) -> float:
+        return min(max(gain, self.gain_limits[0]), self.gain_limits[1])
+
+
+if __name__ == '__main__':
+    # closed loop on synthetic frames: a camera model with linear response, shot noise and clipping
+    import time
+    rng = np.random.default_rng(0)
+    scene = rng.uniform(0.05, 1.0, (1024, 1280, 3)).astype(np.float32)
+
+    def synthetic_frame(exposure, gain):
+        signal = scene * exposure * 10 ** (gain / 20.0) * 0.02
+        signal += rng.normal(0, 1.0, (1, scene.shape[1], 1))
+        return np.clip(signal, 0, 255).astype(np.uint8)
+
+    for mode, exposure, gain in (('exposure', 500.0, 0.0), ('exposure', 20000.0, 0.0), ('both', 100.0, 0.0),
+                                 ('gain', 1000.0, 0.0)):
+        controller = HistogramAutoExposure(exposure, gain, (20.0, 10000.0), (0.0, 24.0), mode=mode)
+        while not controller.converged and controller.n_frames < 300:
+            controller.update(synthetic_frame(controller.exposure, controller.gain))
+        print(f'{mode:8s} start {exposure:7.0f} us {gain:4.1f} dB -> {controller.exposure:7.0f} us '
+              f'{controller.gain:4.1f} dB, brightness {controller.brightness:0.3f} after {controller.n_frames} frames '
+              f'({controller.n_updates} updates)')
+
+    frame = synthetic_frame(1000.0, 0.0)
+    start = time.perf_counter()
+    for _ in range(100):
+        HistogramAutoExposure.measure(frame)
+    print(f'measure on {frame.shape}: {(time.perf_counter() - start) * 10:0.2f} ms per frame')
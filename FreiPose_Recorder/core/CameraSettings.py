@@ -0,0 +1,357 @@
+"""
+Reading and applying camera settings (gain, exposure, flips, color balance, pixel format, ROI, binning and trigger
+lines).
+
+Node handles are resolved once per camera and cached, values are only written if they differ from the current value
+of the camera and all cameras are handled concurrently, since most of the time is spent waiting for the transport
+layer. Settings dicts have the same format as the per camera entries of the settings files.
+"""
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pypylon import genicam
+from pypylon import pylon
+
+from FreiPose_Recorder.configs.params import TRIGGER_LINE_IN
+
+BALANCE_COLORS = ('Red', 'Green', 'Blue')
+
+
+class CameraNodes:
+    """Resolved GenICam node handles of a single (opened) camera, nodes the camera does not implement are None"""
+    NODE_NAMES = ('Gain', 'ExposureTime', 'ExposureTimeAbs', 'ReverseX', 'ReverseY', 'BalanceRatioSelector',
+                  'BalanceRatio', 'PixelFormat', 'LineSelector', 'LineMode', 'LineSource', 'TriggerSelector',
+                  'TriggerSource', 'Width', 'Height', 'OffsetX', 'OffsetY', 'BinningHorizontal', 'BinningVertical',
+                  'DecimationHorizontal', 'DecimationVertical')
+
+    def __init__(self, cam: pylon.InstantCamera):
+        nodemap = cam.GetNodeMap()
+        self.name = cam.DeviceInfo.GetUserDefinedName()
+        for node_name in self.NODE_NAMES:
+            try:
+                node = nodemap.GetNode(node_name)
+            except genicam.GenericException:
+                node = None
+            if node is not None and not genicam.IsAvailable(node):
+                node = None
+            setattr(self, node_name, node)
+        # some cameras use ExposureTimeAbs instead of ExposureTime
+        self.Exposure = self.ExposureTime if self.ExposureTime is not None else self.ExposureTimeAbs
+
+    def has_color_balance(self) -> bool:
+        return self.BalanceRatioSelector is not None and self.BalanceRatio is not None
+
+    def has_roi(self) -> bool:
+        return None not in (self.Width, self.Height, self.OffsetX, self.OffsetY)
+
+
+class NodeCacheInvalidator(pylon.ConfigurationEventHandler):
+    """drops the cached node handles of a camera as soon as it is closed, whoever closes it"""
+    def __init__(self, engine):
+        super(NodeCacheInvalidator, self).__init__()
+        self.engine = engine
+
+    def OnClosed(self, camera):
+        self.engine._nodes.pop(camera.DeviceInfo.GetSerialNumber(), None)
+
+
+class CameraSettingsEngine:
+    """
+    Reads and diff-applies settings of several cameras concurrently.
+
+    :param max_workers: maximal number of cameras handled at the same time
+    :param rel_tol: relative tolerance below which float values are considered unchanged
+    """
+    def __init__(self, max_workers: int = 8, rel_tol: float = 1e-3):
+        self.max_workers = max_workers
+        self.rel_tol = rel_tol
+        self._nodes = {}  # serial number -> CameraNodes
+        self._invalidators = {}  # serial number -> NodeCacheInvalidator registered with the camera
+        self.log = logging.getLogger('CameraSettings')
+        self.log.setLevel(logging.DEBUG)
+
+    def nodes(self, cam: pylon.InstantCamera) -> CameraNodes:
+        """cached node handles of the camera, the camera has to be open"""
+        sn = cam.DeviceInfo.GetSerialNumber()
+        nodes = self._nodes.get(sn)
+        if nodes is None:
+            nodes = CameraNodes(cam)
+            self._nodes[sn] = nodes
+            if sn not in self._invalidators:
+                invalidator = NodeCacheInvalidator(self)
+                # pylon must not delete the python object, keep our own reference
+                cam.RegisterConfiguration(invalidator, pylon.RegistrationMode_Append, pylon.Cleanup_None)
+                self._invalidators[sn] = invalidator
+        return nodes
+
+    def invalidate(self, cam: pylon.InstantCamera = None):
+        """
+        Drops cached node handles of a camera (or all). Closing a camera drops its handles (NodeCacheInvalidator),
+        all cameras have to be invalidated if the camera objects are replaced, e.g. after disconnecting
+        """
+        if cam is None:
+            self._nodes.clear()
+            self._invalidators.clear()  # the new camera objects need their own
+        else:
+            self._nodes.pop(cam.DeviceInfo.GetSerialNumber(), None)
+
+    def _same(self, current, new) -> bool:
+        if isinstance(new, float) or isinstance(current, float):
+            return math.isclose(current, new, rel_tol=self.rel_tol, abs_tol=1e-6)
+        return current == new
+
+    @staticmethod
+    def _read_balance(nodes: CameraNodes) -> tuple:
+        balance = []
+        for color in BALANCE_COLORS:
+            nodes.BalanceRatioSelector.SetValue(color)
+            balance.append(nodes.BalanceRatio.GetValue())
+        return tuple(balance)
+
+    @staticmethod
+    def _read_lines(nodes: CameraNodes) -> dict:
+        """trigger input line and the first output line driven by ExposureActive"""
+        lines = {'lineIN': nodes.TriggerSource.GetValue()}
+        for line in nodes.LineSelector.Symbolics:
+            nodes.LineSelector.SetValue(line)
+            if nodes.LineMode.GetValue() == 'Output' and nodes.LineSource is not None \
+                    and nodes.LineSource.GetValue() == 'ExposureActive':
+                lines['lineOUT'] = line
+                break
+        return lines
+
+    def read(self, cam: pylon.InstantCamera, full: bool = False) -> dict:
+        """
+        Reads the settings of a camera
+        :param cam: camera object, is opened (and closed again) if needed
+        :param full: also read trigger lines and ROI, e.g. for snapshots
+        :return: dict with settings
+        """
+        was_closed = not cam.IsOpen()
+        if was_closed:
+            cam.Open()
+        nodes = self.nodes(cam)
+        settings = {}
+        try:
+            settings['gain'] = nodes.Gain.GetValue() if nodes.Gain is not None else 0
+            if nodes.Exposure is not None:
+                settings['exp_time'] = nodes.Exposure.GetValue()
+            if nodes.ReverseX is not None and nodes.ReverseY is not None:
+                settings['flipX'] = nodes.ReverseX.GetValue()
+                settings['flipY'] = nodes.ReverseY.GetValue()
+            if nodes.has_color_balance():
+                settings['color_balance'] = self._read_balance(nodes)
+            if nodes.PixelFormat is not None:
+                settings['color_mode'] = nodes.PixelFormat.GetValue()
+            if full and nodes.BinningHorizontal is not None and nodes.BinningVertical is not None:
+                settings['binning'] = [nodes.BinningHorizontal.GetValue(), nodes.BinningVertical.GetValue()]
+            if full and nodes.DecimationHorizontal is not None and nodes.DecimationVertical is not None:
+                settings['decimation'] = [nodes.DecimationHorizontal.GetValue(), nodes.DecimationVertical.GetValue()]
+            if full and nodes.has_roi():
+                settings['roi'] = [nodes.Width.GetValue(), nodes.Height.GetValue(),
+                                   nodes.OffsetX.GetValue(), nodes.OffsetY.GetValue()]
+            if full and nodes.LineSelector is not None and nodes.TriggerSource is not None:
+                settings.update(self._read_lines(nodes))
+        finally:
+            if was_closed:
+                cam.Close()
+                self.invalidate(cam)
+        return settings
+
+    def apply(self, cam: pylon.InstantCamera, settings: dict) -> dict:
+        """
+        Writes all settings which differ from the current values of the camera
+        :param cam: camera object, is opened (and closed again) if needed
+        :param settings: dict with settings, missing keys are left untouched
+        :return: report dict with the names of changed, unchanged and failed settings and the time needed
+        """
+        start = time.perf_counter()
+        was_closed = not cam.IsOpen()
+        if was_closed:
+            cam.Open()
+        nodes = self.nodes(cam)
+        report = {'changed': [], 'unchanged': [], 'failed': {}}
+
+        def set_node(key, node, value):
+            if node is None:
+                report['failed'][key] = 'not implemented'
+                return
+            try:
+                if self._same(node.GetValue(), value):
+                    report['unchanged'].append(key)
+                else:
+                    node.SetValue(value)
+                    report['changed'].append(key)
+            except genicam.GenericException as e:
+                report['failed'][key] = str(e).splitlines()[0]
+
+        try:
+            if 'gain' in settings:
+                set_node('gain', nodes.Gain, settings['gain'])
+            if settings.get('exp_time', None) is not None:
+                set_node('exp_time', nodes.Exposure, settings['exp_time'])
+            if 'flipX' in settings:
+                set_node('flipX', nodes.ReverseX, settings['flipX'])
+            if 'flipY' in settings:
+                set_node('flipY', nodes.ReverseY, settings['flipY'])
+            if 'color_balance' in settings and nodes.has_color_balance():
+                self._apply_balance(nodes, settings['color_balance'], report)
+            if 'color_mode' in settings:
+                set_node('color_mode', nodes.PixelFormat, settings['color_mode'])
+            # binning and decimation change the maximal size, so they have to be set before the roi
+            if 'binning' in settings:
+                self._apply_pair('binning', nodes.BinningHorizontal, nodes.BinningVertical, settings['binning'], report)
+            if 'decimation' in settings:
+                self._apply_pair('decimation', nodes.DecimationHorizontal, nodes.DecimationVertical,
+                                 settings['decimation'], report)
+            if 'roi' in settings and nodes.has_roi():
+                self._apply_roi(nodes, settings['roi'], report)
+            if nodes.has_roi():
+                report['frame_size'] = (nodes.Width.GetValue(), nodes.Height.GetValue())
+            self._apply_lines(nodes, settings, report)
+        finally:
+            if was_closed:
+                cam.Close()
+                self.invalidate(cam)
+
+        report['seconds'] = time.perf_counter() - start
+        for key, error in report['failed'].items():
+            self.log.info(f'Could not set {key} of {nodes.name}: {error}')
+        return report
+
+    def _apply_balance(self, nodes: CameraNodes, balance: (tuple, list), report: dict):
+        """one selector pass, the ratio is only written for colors which changed"""
+        changed = False
+        try:
+            for color, value in zip(BALANCE_COLORS, balance):
+                nodes.BalanceRatioSelector.SetValue(color)
+                if not self._same(nodes.BalanceRatio.GetValue(), value):
+                    nodes.BalanceRatio.SetValue(value)
+                    changed = True
+        except genicam.GenericException as e:
+            report['failed']['color_balance'] = str(e).splitlines()[0]
+            return
+        report['changed' if changed else 'unchanged'].append('color_balance')
+
+    @staticmethod
+    def _apply_pair(key: str, node_h, node_v, values: (tuple, list), report: dict):
+        """horizontal and vertical factor, e.g. binning, a factor of 1 is fine for cameras without the feature"""
+        values = [int(v) for v in values]
+        if node_h is None or node_v is None:
+            if values != [1, 1]:
+                report['failed'][key] = 'not implemented'
+            return
+        try:
+            if [node_h.GetValue(), node_v.GetValue()] == values:
+                report['unchanged'].append(key)
+                return
+            node_h.SetValue(values[0])
+            node_v.SetValue(values[1])
+            report['changed'].append(key)
+        except genicam.GenericException as e:
+            report['failed'][key] = str(e).splitlines()[0]
+
+    @staticmethod
+    def _align(node, value: int) -> int:
+        """rounds down to the increment of the node and clips to its range"""
+        minimum, increment = node.GetMin(), max(node.GetInc(), 1)
+        value = minimum + (int(value) - minimum) // increment * increment
+        return min(max(value, minimum), node.GetMax())
+
+    @classmethod
+    def _apply_roi(cls, nodes: CameraNodes, roi: (tuple, list, str), report: dict):
+        """
+        roi as (width, height, offset x, offset y) or 'full' for the whole sensor, values are aligned to the increments
+        of the camera. Offsets are cleared first so the new size always fits.
+        """
+        full = isinstance(roi, str)
+        try:
+            current = (nodes.Width.GetValue(), nodes.Height.GetValue(), nodes.OffsetX.GetValue(),
+                       nodes.OffsetY.GetValue())
+            if full:
+                # maximal width/height depend on the offsets
+                target = (nodes.Width.GetMax() + current[2], nodes.Height.GetMax() + current[3], 0, 0)
+            else:
+                target = tuple(int(v) for v in roi)
+            if current == target:
+                report['unchanged'].append('roi')
+                return
+            nodes.OffsetX.SetValue(nodes.OffsetX.GetMin())
+            nodes.OffsetY.SetValue(nodes.OffsetY.GetMin())
+            nodes.Width.SetValue(cls._align(nodes.Width, target[0]))
+            nodes.Height.SetValue(cls._align(nodes.Height, target[1]))
+            nodes.OffsetX.SetValue(cls._align(nodes.OffsetX, target[2]))
+            nodes.OffsetY.SetValue(cls._align(nodes.OffsetY, target[3]))
+            report['changed'].append('roi')
+        except genicam.GenericException as e:
+            report['failed']['roi'] = str(e).splitlines()[0]
+
+    def _apply_lines(self, nodes: CameraNodes, settings: dict, report: dict):
+        """configures the trigger input and the optional exposure active output line"""
+        if nodes.LineSelector is None or nodes.TriggerSource is None:
+            return
+        line_in = settings.get('lineIN', None) or TRIGGER_LINE_IN
+        line_out = settings.get('lineOUT', None)
+        try:
+            if nodes.TriggerSelector.GetValue() != 'FrameStart':
+                nodes.TriggerSelector.SetValue('FrameStart')
+            lines = [('lineIN', line_in, (('LineMode', 'Input'),))]
+            if line_out:
+                lines.append(('lineOUT', line_out, (('LineMode', 'Output'), ('LineSource', 'ExposureActive'))))
+            for key, line, values in lines:
+                nodes.LineSelector.SetValue(line)
+                changed = False
+                for node_name, value in values:
+                    node = getattr(nodes, node_name)
+                    if node.GetValue() != value:
+                        node.SetValue(value)
+                        changed = True
+                if key == 'lineIN' and nodes.TriggerSource.GetValue() != line_in:
+                    nodes.TriggerSource.SetValue(line_in)
+                    changed = True
+                report['changed' if changed else 'unchanged'].append(key)
+        except genicam.GenericException as e:
+            report['failed']['trigger lines'] = str(e).splitlines()[0]
+
+    def apply_all(self, cam_settings: list) -> dict:
+        """
+        Applies settings to several cameras concurrently and logs a timing report
+        :param cam_settings: list of (camera, settings dict)
+        :return: dict camera name -> report (see apply)
+        """
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(cam_settings)))) as executor:
+            futures = {cam.DeviceInfo.GetUserDefinedName(): executor.submit(self.apply, cam, settings)
+                       for cam, settings in cam_settings}
+        reports = {}
+        for name, future in futures.items():
+            try:
+                reports[name] = future.result()
+            except genicam.GenericException as e:
+                self.log.error(f'Applying settings to {name} failed: {e}')
+                reports[name] = {'changed': [], 'unchanged': [], 'failed': {'all': str(e)}, 'seconds': 0.0}
+        self.log_report(reports, time.perf_counter() - start)
+        return reports
+
+    def read_all(self, cams, full: bool = False) -> dict:
+        """
+        Reads the settings of several cameras concurrently
+        :param cams: iterable of cameras
+        :param full: also read trigger lines and ROI
+        :return: dict camera name -> settings
+        """
+        cams = list(cams)
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(cams)))) as executor:
+            futures = {cam.DeviceInfo.GetUserDefinedName(): executor.submit(self.read, cam, full) for cam in cams}
+        return {name: future.result() for name, future in futures.items()}
+
+    def log_report(self, reports: dict, total: float):
+        for name, report in reports.items():
+            self.log.debug(f'{name}: {len(report["changed"])} changed {report["changed"]}, '
+                           f'{len(report["unchanged"])} unchanged, {len(report["failed"])} failed '
+                           f'in {report["seconds"] * 1000:0.0f} ms')
+        serial = sum(report['seconds'] for report in reports.values())
+        self.log.info(f'Applied settings to {len(reports)} cameras in {total * 1000:0.0f} ms '
+                      f'(sum of cameras {serial * 1000:0.0f} ms)')
@@ -0,0 +1,185 @@
+"""
+Detection of removed cameras (GigE cable, USB reset) and reconnection in the background.
+
+Removal is reported by pylon device removal events right away instead of a grab timeout of the whole array. While a
+camera is lost the remaining cameras keep grabbing. Once the lost camera shows up again in the device enumeration it
+is marked as ready, the grab loop then re-attaches it (see Recorder._restore_cameras) and its writer continues in a
+new segment.
+
+    PYLON_CAMEMU=2 python -m FreiPose_Recorder.core.DeviceMonitor  # reconnect an emulated camera while recording
+"""
+import logging
+from queue import Queue, Empty
+from threading import Event, Lock, Thread
+
+from pypylon import genicam
+from pypylon import pylon
+
+
+class DeviceRemovalHandler(pylon.ConfigurationEventHandler):
+    """forwards the pylon device removal event of a camera to a callback with its serial number"""
+    def __init__(self, callback):
+        super(DeviceRemovalHandler, self).__init__()
+        self.callback = callback
+
+    def OnCameraDeviceRemoved(self, camera):
+        self.callback(camera.DeviceInfo.GetSerialNumber())
+
+
+class DeviceMonitor:
+    """
+    Keeps track of lost cameras of a camera array and looks for them in the background.
+
+    :param cam_array: pylon InstantCameraArray
+    :param interval: time in s between two device enumerations while cameras are lost
+    :param heartbeat_timeout: GigE heartbeat timeout in ms, lower values detect pulled cables faster, 0 keeps the default
+    """
+    def __init__(self, cam_array, interval: float = 1.0, heartbeat_timeout: int = 1000):
+        self.cam_array = cam_array
+        self.interval = interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.serials = [cam.DeviceInfo.GetSerialNumber() for cam in cam_array]
+        self.lost = {}  # serial number -> cam_id of cameras which are gone
+        self.ready = Queue()  # (cam_id, device info) of lost cameras which are available again
+        self._searching = set()  # serial numbers already put into ready
+        self._lock = Lock()
+        self._handlers = []
+        self.stop_event = Event()
+        self.thread = None
+        self.log = logging.getLogger('DeviceMonitor')
+        self.log.setLevel(logging.DEBUG)
+
+    def start(self):
+        """registers the removal handlers and starts searching for lost cameras"""
+        for cam in self.cam_array:
+            handler = DeviceRemovalHandler(self._on_removed)
+            # pylon must not delete the python object, keep our own reference
+            cam.RegisterConfiguration(handler, pylon.RegistrationMode_Append, pylon.Cleanup_None)
+            self._handlers.append((cam, handler))
+            self.set_heartbeat(cam)
+        self.stop_event.clear()
+        self.thread = Thread(target=self._search, daemon=True)
+        self.thread.start()
+        return self
+
+    def set_heartbeat(self, cam):
+        """sets the heartbeat timeout of a camera, again after it was re-attached to a new device"""
+        if not self.heartbeat_timeout:
+            return
+        try:
+            cam.GetTLNodeMap().GetNode('HeartbeatTimeout').SetValue(self.heartbeat_timeout)
+        except (genicam.GenericException, AttributeError):
+            pass  # not a GigE camera
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        for cam, handler in self._handlers:
+            try:
+                cam.DeregisterConfiguration(handler)
+            except genicam.GenericException:
+                pass
+        self._handlers = []
+
+    def _on_removed(self, serial: str):
+        with self._lock:
+            if serial in self.lost or serial not in self.serials:
+                return
+            self.lost[serial] = self.serials.index(serial)
+        self.log.error(f'Camera {serial} was removed, continuing with the remaining cameras')
+
+    def inject_removal(self, cam_id: int):
+        """simulates the removal event of a camera, e.g. to test reconnection with emulated cameras"""
+        self._on_removed(self.serials[cam_id])
+
+    def is_lost(self, cam_id: int) -> bool:
+        return cam_id in list(self.lost.values())
+
+    def check_removed(self) -> bool:
+        """polls the cameras for removal, e.g. after a grab error, returns True if any camera is lost"""
+        for serial, cam in zip(self.serials, self.cam_array):
+            if cam.IsCameraDeviceRemoved():
+                self._on_removed(serial)
+        return bool(self.lost)
+
+    def restored(self, cam_id: int):
+        """called by the grab loop once a camera is grabbing again"""
+        serial = self.serials[cam_id]
+        with self._lock:
+            self.lost.pop(serial, None)
+            self._searching.discard(serial)
+        self.log.info(f'Camera {serial} reconnected')
+
+    def retry(self, cam_id: int):
+        """re-attaching failed, keep searching for the camera"""
+        with self._lock:
+            self._searching.discard(self.serials[cam_id])
+
+    def _search(self):
+        tl_factory = pylon.TlFactory.GetInstance()
+        while not self.stop_event.wait(self.interval):
+            with self._lock:
+                missing = {serial: cam_id for serial, cam_id in self.lost.items() if serial not in self._searching}
+            if not missing:
+                continue
+            for device in tl_factory.EnumerateDevices():
+                serial = device.GetSerialNumber()
+                if serial in missing:
+                    with self._lock:
+                        self._searching.add(serial)
+                    self.ready.put((missing[serial], device))
+                    self.log.debug(f'Camera {serial} is available again')
+
+    def get_ready(self) -> list:
+        """all (cam_id, device info) which can be re-attached now"""
+        ready = []
+        while True:
+            try:
+                ready.append(self.ready.get_nowait())
+            except Empty:
+                return ready
+
+
+if __name__ == '__main__':
+    # reconnection during a recording with emulated cameras:
+    #     PYLON_CAMEMU=2 python -m FreiPose_Recorder.core.DeviceMonitor
+    import json
+    import os
+    import tempfile
+    import time
+    from FreiPose_Recorder.core.Recorder import Recorder
+
+    logging.basicConfig(level=logging.INFO)
+    if not os.environ.get('PYLON_CAMEMU'):
+        raise SystemExit('needs emulated cameras, e.g. PYLON_CAMEMU=2 python -m FreiPose_Recorder.core.DeviceMonitor')
+    with tempfile.TemporaryDirectory() as folder:
+        recorder = Recorder()
+        recorder.save_path = folder
+        recorder.scan_cams()
+        recorder.connect_cams()
+        stop_event = Event()
+        recorder.run_multi_cam_record(stop_event, filename='reconnect_demo')
+        time.sleep(2)
+        # the emulated device stays enumerable, so it is found again right away and re-attached by the grab loop
+        recorder.device_monitor.inject_removal(0)
+        deadline = time.monotonic() + 10
+        while recorder.get_lost_cameras() and time.monotonic() < deadline:
+            time.sleep(0.1)
+        reconnected = not recorder.get_lost_cameras()
+        time.sleep(2)  # record into the new segment
+        stop_event.set()
+        recorder.stop_multi_cam_record()
+
+        print(f'camera 0 reconnected: {reconnected}')
+        print('files:', ', '.join(sorted(os.listdir(folder))))
+        if recorder.manifest_path is None:  # only written if a writer has several segments
+            recorder.disconnect_cams()
+            raise SystemExit('camera 0 did not continue in a new segment')
+        with open(recorder.manifest_path) as f:
+            manifest = json.load(f)
+        for name, segments in manifest['cameras'].items():
+            print(f'{name}: ' + ', '.join(f"{segment['file']} (frames {segment['first_frame']}-{segment['last_frame']})"
+                                          for segment in segments))
+        recorder.disconnect_cams()
@@ -0,0 +1,104 @@
+"""
+Per camera detection of stalled cameras.
+
+RetrieveResult of the camera array only times out if none of the cameras delivers a frame, a single dead camera is
+masked by the others. The watchdog knows the expected frame interval and flags each camera for which no frame arrived
+within a few intervals, i.e. after tens of ms instead of the grab timeout.
+"""
+import logging
+import time
+
+
+class GrabWatchdog:
+    """
+    Tracks the time of the last frame of every camera.
+
+    :param n_cams: number of cameras
+    :param fps: expected frame rate (free running fps or trigger rate)
+    :param missed_intervals: number of missed frame intervals until a camera is flagged as stalled
+    :param min_stall_time: lower bound of the stall time in s, e.g. for high frame rates
+    :param startup_grace: time in s after start in which cameras without any frame are not flagged
+    """
+    def __init__(self, n_cams: int, fps: float, missed_intervals: int = 5, min_stall_time: float = 0.02,
+                 startup_grace: float = 1.0):
+        self.n_cams = n_cams
+        self.missed_intervals = missed_intervals
+        self.min_stall_time = min_stall_time
+        self.startup_grace = startup_grace
+        self.stall_time = 0.0
+        self.set_fps(fps)
+        self.last_frame = [None] * n_cams  # monotonic time of the last frame
+        self.frames = [0] * n_cams
+        self.stalled = [False] * n_cams
+        self.start_time = time.monotonic()
+        self._last_check = 0.0
+        self.log = logging.getLogger('GrabWatchdog')
+        self.log.setLevel(logging.DEBUG)
+
+    def set_fps(self, fps: float):
+        """updates the expected frame interval, e.g. if the trigger rate changed"""
+        self.stall_time = max(self.missed_intervals / max(fps, 1e-3), self.min_stall_time)
+
+    def start(self):
+        self.start_time = time.monotonic()
+        self.last_frame = [None] * self.n_cams
+        self.frames = [0] * self.n_cams
+        self.stalled = [False] * self.n_cams
+        return self
+
+    def feed(self, cam_id: int):
+        """called for every grabbed frame, cheap enough for the grab loop"""
+        self.last_frame[cam_id] = time.monotonic()
+        self.frames[cam_id] += 1
+
+    def _reference_time(self, cam_id: int) -> float:
+        """time of the last frame, cameras without any frame are measured from the end of the startup grace"""
+        last = self.last_frame[cam_id]
+        return self.start_time + self.startup_grace if last is None else last
+
+    def check(self, force: bool = False) -> list:
+        """
+        Updates the stalled flags, only evaluated once per stall time unless forced
+        :return: ids of cameras which became stalled since the last check
+        """
+        now = time.monotonic()
+        if not force and now - self._last_check < self.stall_time:
+            return []
+        self._last_check = now
+        newly_stalled = []
+        for cam_id in range(self.n_cams):
+            last = self._reference_time(cam_id)
+            stalled = now - last > self.stall_time
+            if stalled and not self.stalled[cam_id]:
+                newly_stalled.append(cam_id)
+                self.log.warning(f'Camera {cam_id} stalled, no frame for {(now - last) * 1000:0.0f} ms '
+                                 f'(limit {self.stall_time * 1000:0.0f} ms)')
+            elif not stalled and self.stalled[cam_id]:
+                self.log.info(f'Camera {cam_id} delivers frames again')
+            self.stalled[cam_id] = stalled
+        return newly_stalled
+
+    def status(self, cam_id: int) -> dict:
+        """
+        State of a single camera: frame count, stalled flag and age of the last frame in ms. The flag is computed from
+        the age, check only runs when frames arrive and would miss that all cameras stopped
+        """
+        now = time.monotonic()
+        last = self.last_frame[cam_id]
+        age = None if last is None else (now - last) * 1000
+        stalled = now - self._reference_time(cam_id) > self.stall_time
+        return {'frames': self.frames[cam_id], 'stalled': stalled, 'last_frame_ms': age}
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.DEBUG)
+    watchdog = GrabWatchdog(3, fps=100, startup_grace=0.05).start()
+    start = time.monotonic()
+    detected = None
+    while time.monotonic() - start < 0.5:
+        for cam_id in (0, 1) if time.monotonic() - start > 0.2 else (0, 1, 2):  # camera 2 dies after 200 ms
+            watchdog.feed(cam_id)
+        if 2 in watchdog.check() and detected is None:
+            detected = time.monotonic() - start - 0.2
+        time.sleep(0.01)
+    print(f'camera 2 flagged {detected * 1000:0.0f} ms after its last frame', [watchdog.status(i) for i in range(3)])
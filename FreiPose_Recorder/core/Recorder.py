@@ -1,21 +1,34 @@
 import logging, random
 # import cv2
+import json
 import time
 import datetime
 from pathlib import Path
 
-from threading import Event, Thread
-from queue import Queue, Full
+from threading import Event, Lock, Thread
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Full, Empty
 
 from pypylon import genicam
 from pypylon import pylon
 
 from FreiPose_Recorder.utils.VideoWriterFast_gear import VideoWriterFast
 from FreiPose_Recorder.utils.VideoWriterFast_gear import QueueOverflow
+from FreiPose_Recorder.utils.VideoWriterFast_gear import partition_cores
+from FreiPose_Recorder.utils.cpu_affinity import plan_affinity, pin_thread, raise_priority, format_layout, \
+    child_processes, process_affinity
+from FreiPose_Recorder.utils.encoder_profiler import AUTO_CODEC, choose_codec, load_encoder_profiles
 
 from FreiPose_Recorder.configs.camera_enums import CameraRegistry
+from FreiPose_Recorder.core.AutoExposure import HistogramAutoExposure
+from FreiPose_Recorder.core.CameraSettings import CameraSettingsEngine
+from FreiPose_Recorder.core.SettingsStore import SettingsStore, apply_profile
+from FreiPose_Recorder.core.DeviceMonitor import DeviceMonitor
+from FreiPose_Recorder.core.GrabWatchdog import GrabWatchdog
 
-from FreiPose_Recorder.configs.params import TIME_STAMP_STRING, TRIGGER_LINE_IN, MAX_FPS, CONVERT2
+from FreiPose_Recorder.configs.params import TIME_STAMP_STRING, TRIGGER_LINE_IN, MAX_FPS, CONVERT2, \
+    SEGMENT_FRAMES, SEGMENT_MINUTES, SNAPSHOT_FOLDER, GRAB_TIMEOUT, STALL_INTERVALS, DEFAULT_CODEC, \
+    ENCODER_PRESET, ENCODER_TUNE, ENCODER_PIX_FMT, ENCODER_THREADS, RESERVED_CORES, PIN_CORES, GRAB_CORES, GRAB_NICE
 
 
 import os
@@ -27,6 +40,10 @@ NUM_CAMERAS = 2  # simulated cameras
 
 CONVERSION_TARGET= {"RGB8":pylon.PixelType_RGB8packed,"Mono8":pylon.PixelType_Mono8}[CONVERT2]
 
+# auto functions and the camera node controlling them
+AUTO_FUNCTION_NODES = {'exposure': 'ExposureAuto', 'gain': 'GainAuto', 'white balance': 'BalanceWhiteAuto'}
+
+
 def rel_close(v, max_v, thresh=5.0):
     v_scaled = v / max_v * 100.0
     if 100.0 - v_scaled < thresh:
@@ -36,16 +53,26 @@ def rel_close(v, max_v, thresh=5.0):
 
 class Recorder(object):
     """Class to handle recording of multiple cameras"""
+    settings_engine = CameraSettingsEngine()  # cached node handles are shared by all recorders
 
     def __init__(self, verbosity=0, write_timestamps=False):
         self.write_timestamps = write_timestamps
         self.codec = 'divx'
+        self.crf = 0
+        self.encoder_preset = ENCODER_PRESET
+        self.encoder_tune = ENCODER_TUNE
+        self.encoder_pix_fmt = ENCODER_PIX_FMT
+        self.encoder_threads = ENCODER_THREADS  # per writer, 0 divides the cores among the writers
+        self.pin_cores = PIN_CORES  # pin grab thread and writers to fixed cores
+        self.cpu_layout = None  # cores of the grab thread and the writers of the running recording
         self.video_writer_list = []  # list of video writers
         self.is_recording = False
         self.is_viewing = False
         self.cams_context = None
         self.multi_record_thread = None
         self.multi_view_queue = None
+        self.preview_callback = None  # called from the grab thread with the cam_id if a camera has new preview frames
+        self._preview_pending = []  # cam_id -> notified but not taken yet, one notification per camera until taken
         self.stop_event = None
         self.error_event = Event()  # event we set if an error occurs to signal the main thread
         self.current_cam = None
@@ -65,8 +92,22 @@ class Recorder(object):
         self._rid = 0
         self.fps = 10
         self._trigger = None
-        self.grab_timeout = 10000  # in
+        self.grab_timeout = GRAB_TIMEOUT  # in ms, for all cameras together, see watchdog for single cameras
         self.internal_queue_size = 100  # Size of the QUEUE for transfering images between threads
+        self.segment_frames = SEGMENT_FRAMES  # roll over to a new file every n frames, 0 disables
+        self.segment_minutes = SEGMENT_MINUTES  # roll over to a new file every n minutes, 0 disables
+        self.manifest_path = None  # path of the manifest of the last segmented recording
+        self._manifest_lock = Lock()  # the manifest is rewritten from the closing threads of all writers
+        self._manifest_names = []  # camera names of the writers, read once, not from the closing threads
+        self.settings_store = SettingsStore(SNAPSHOT_FOLDER)
+        self.snapshot_id = None  # settings snapshot of the last recording
+        self.snapshot_cameras = None  # camera settings of that snapshot
+        self.device_monitor = None  # detects removed cameras while grabbing and reconnects them
+        self.watchdog = None  # flags single cameras which stopped delivering frames
+        self.use_hw_trigger = False
+        self.restore_settings = {}  # camera name -> settings applied to reconnected cameras
+        self.soft_auto = {}  # cam_id -> HistogramAutoExposure, evaluated in the running grab loop
+        self.current_cam_id = None
 
         self.log = logging.getLogger('BaslerRecorder')
         self.log.setLevel(logging.DEBUG)
@@ -109,36 +150,158 @@ class Recorder(object):
         self.log.debug(f'Found {len(devices)} cameras')
 
         self.cam_array = pylon.InstantCameraArray(len(devices))
+        self.settings_engine.invalidate()  # new camera objects
+
+        # creating the devices talks to each camera, do it for all cameras at once
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(devices)) as executor:
+            pylon_devices = list(executor.map(tlFactory.CreateDevice, devices))
+        for cam, device in zip(self.cam_array, pylon_devices):
+            cam.Attach(device)
+            self.cameraregistry.get_camera(cam.DeviceInfo.GetSerialNumber(), write=False)
+        self.cameraregistry.flush()  # a single write for all newly found cameras
+        self.log.debug(f'Attached {len(devices)} cameras in {(time.perf_counter() - start) * 1000:0.0f} ms')
 
-        for idx, cam in enumerate(self.cam_array):
-            cam.Attach(tlFactory.CreateDevice(devices[idx]))
-            sn = cam.DeviceInfo.GetSerialNumber()
-            try:
-                self.cameraregistry.get_camera(sn)
-            except ValueError:
-                self.log.warning(f'Connected camera {sn} not found in Enum')
+    @staticmethod
+    def _open_cam(cam) -> float:
+        """opens a camera and returns the time it took in s"""
+        start = time.perf_counter()
+        cam.Open()
+        return time.perf_counter() - start
 
     def connect_cams(self):
-        self.cam_array.Open()
+        start = time.perf_counter()
+        # opening a GigE camera mostly waits for the network, open all of them concurrently
+        with ThreadPoolExecutor(max_workers=max(1, self.cam_array.GetSize())) as executor:
+            open_times = list(executor.map(self._open_cam, self.cam_array))
         for idx, cam in enumerate(self.cam_array):
             camera_serial = cam.DeviceInfo.GetSerialNumber()
-            try:
-                c = self.cameraregistry.get_camera(camera_serial)
-                self.log.debug(
-                    f"set context {c.get('context')} for camera {camera_serial}")
-                cam.SetCameraContext(c.get('context'))
-                cam.DeviceInfo.SetUserDefinedName(c.get('name'))
-            except ValueError:
-                r_int = random.randint(10, 256)
-                cam.SetCameraContext(r_int)  # for unknown cameras set random context
-                cam.DeviceInfo.SetUserDefinedName(f"cam{r_int}")
+            self._set_cam_identity(cam)
+            self.log.debug(f'Opened {cam.DeviceInfo.GetUserDefinedName()} ({camera_serial}) '
+                           f'in {open_times[idx] * 1000:0.0f} ms')
+        self.cameraregistry.flush()
         self.cams_connected = True
-        self.log.debug(f'Connected to {self.cam_array.GetSize()} cameras')
+        self.log.debug(f'Connected to {self.cam_array.GetSize()} cameras in '
+                       f'{(time.perf_counter() - start) * 1000:0.0f} ms')
+
+    def _set_cam_identity(self, cam):
+        """sets context and name of the camera from the camera registry"""
+        camera_serial = cam.DeviceInfo.GetSerialNumber()
+        try:
+            c = self.cameraregistry.get_camera(camera_serial, write=False)
+            self.log.debug(
+                f"set context {c.get('context')} for camera {camera_serial}")
+            cam.SetCameraContext(c.get('context'))
+            cam.DeviceInfo.SetUserDefinedName(c.get('name'))
+        except ValueError:
+            r_int = random.randint(10, 256)
+            cam.SetCameraContext(r_int)  # for unknown cameras set random context
+            cam.DeviceInfo.SetUserDefinedName(f"cam{r_int}")
+
+    def _start_monitoring(self, use_hw_trigger: bool, camera_settings: dict = None):
+        """
+        Remembers the settings of all cameras for reconnection, starts watching for removed cameras and sets up the
+        watchdog for stalled cameras
+        :param camera_settings: full settings of all cameras if just read (e.g. for the snapshot), read if None
+        """
+        self.use_hw_trigger = use_hw_trigger
+        self.restore_settings = camera_settings if camera_settings is not None else self.read_settings(full=True)
+        self.device_monitor = DeviceMonitor(self.cam_array).start()
+        self.watchdog = GrabWatchdog(self.cam_array.GetSize(), self.fps, missed_intervals=STALL_INTERVALS)
+
+    def _stop_monitoring(self):
+        if self.device_monitor is not None:
+            self.device_monitor.stop()
+
+    def _watch(self, cam_id: int):
+        """bookkeeping of the grab loop for every frame, stalled cameras are checked for removal"""
+        self.watchdog.feed(cam_id)
+        if self.watchdog.check():
+            self.device_monitor.check_removed()
+
+    def _restore_cameras(self, grab_strategy, writers: bool = False):
+        """
+        Re-attaches lost cameras which are available again. The array has to be restarted for this, which pauses the
+        other cameras for the duration of the reconnect.
+        :param grab_strategy: grab strategy the array was started with
+        :param writers: continue the videos of the restored cameras in a new segment
+        """
+        ready = self.device_monitor.get_ready()
+        if not ready:
+            return
+        start = time.perf_counter()
+        self.cam_array.StopGrabbing()
+        tl_factory = pylon.TlFactory.GetInstance()
+        for cam_id, device in ready:
+            cam = self.cam_array[cam_id]
+            try:
+                cam.DestroyDevice()
+                cam.Attach(tl_factory.CreateDevice(device))
+                cam.Open()
+                self.device_monitor.set_heartbeat(cam)  # the new device has the default heartbeat
+                self._set_cam_identity(cam)
+                self.cams_context[cam.GetCameraContext()] = cam_id
+                self.settings_engine.invalidate(cam)
+                settings = self.restore_settings.get(cam.DeviceInfo.GetUserDefinedName(), None)
+                if settings:
+                    self.settings_engine.apply(cam, settings)
+                if self.use_hw_trigger:
+                    self._config_cams_hw_trigger(cam)
+                else:
+                    self._config_cams_continuous(cam)
+                if writers:
+                    self.video_writer_list[cam_id].request_rollover()
+                self.device_monitor.restored(cam_id)
+            except genicam.GenericException as e:
+                self.log.error(f'Reconnecting camera {cam_id} failed: {e}')
+                self.device_monitor.retry(cam_id)
+        self.cam_array.StartGrabbing(grab_strategy)
+        self.log.info(f'Restarted grabbing after reconnecting {len(ready)} camera(s), '
+                      f'paused {(time.perf_counter() - start) * 1000:0.0f} ms')
+
+    def _grab_error(self, e: Exception) -> bool:
+        """
+        Decides whether the grab loop can go on after an error, i.e. if it was caused by removed cameras
+        :return: True if the remaining cameras keep grabbing
+        """
+        if self.device_monitor is not None and self.device_monitor.check_removed() \
+                and len(self.device_monitor.lost) < self.cam_array.GetSize():
+            return True
+        self.log.error(e)
+        self.error_event.set()
+        return False
+
+    def get_camera_status(self) -> list:
+        """
+        State of all cameras of the current acquisition
+        :return: list of dicts with id, name, state ('ok', 'stalled' or 'lost'), frames and last_frame_ms
+        """
+        if self.watchdog is None or not self.cam_array:
+            return []
+        lost = self.get_lost_cameras()
+        cameras = []
+        for cam_id, cam in enumerate(self.cam_array):
+            status = self.watchdog.status(cam_id)
+            if cam_id in lost:
+                state = 'lost'
+            elif status['stalled']:
+                state = 'stalled'
+            else:
+                state = 'ok'
+            cameras.append({'id': cam_id, 'name': cam.DeviceInfo.GetUserDefinedName(), 'state': state, **status})
+        return cameras
+
+    def get_lost_cameras(self) -> list:
+        """ids of cameras which were removed during the current acquisition and are not reconnected yet"""
+        if self.device_monitor is None:
+            return []
+        return sorted(self.device_monitor.lost.values())
 
     def disconnect_cams(self):
         """ Disconnects all cameras"""
         if self.cam_array:
             self.cam_array.Close()
+        self.settings_engine.invalidate()
         self.cams_connected = False
 
     def _config_cams_continuous(self, cam):
@@ -239,21 +402,40 @@ class Recorder(object):
         if was_closed:
             cam.Close()
 
-    def run_white_balance(self, cam_id: int):
-        """Set auto white balance for color cameras"""
-        was_closed = False
-        cam = self.cam_array[cam_id]
-        if not cam.IsOpen():
-            was_closed = True
-            cam.Open()
-        c = self.cameraregistry.get_camera(cam.DeviceInfo.GetSerialNumber())
-        self.log.info(f"Setting white balance for {c.get('name')} "
-                      f"{cam.GetDeviceInfo().GetSerialNumber()}")
+    def _run_auto_loop(self, cam, auto_node, name: str, cancel_event: Event = None, progress_callback=None) -> int:
+        """
+        Grabs images until the 'Once' auto function controlled by auto_node has finished
+        :param cam: camera object
+        :param auto_node: node of the auto function, e.g. cam.ExposureAuto
+        :param name: name of the auto function for logging
+        :param cancel_event: if set, the auto function is switched off and the loop is left
+        :param progress_callback: called with the number of grabbed images after every image
+        :return: number of grabbed images
+        """
+        i = 0
+        while not auto_node.GetValue() == 'Off':
+            if cancel_event is not None and cancel_event.is_set():
+                auto_node.SetValue('Off')
+                self.log.info(f'{name} was cancelled')
+                break
+            if not cam.IsGrabbing():
+                cam.GrabOne(5000)
+                # instead of grabing just waiting if cama is already grabbing ?
+                i += 1
+                if progress_callback is not None:
+                    progress_callback(i)
 
-        if not self.is_color_cam(cam):
-            self.log.info(f"{c.get('name')} is not a color cam\n"
-                          f"Skipping white balancing")
-            return
+                if i > 100:
+                    self.log.error(f'{name} was not successful')
+                    break
+            else:
+                time.sleep(0.01)
+                i = 0
+        return i
+
+    @staticmethod
+    def _config_white_balance_roi(cam) -> bool:
+        """Uses the full frame (ROI2) for auto white balance, returns False if not available"""
         try:
             cam.AutoFunctionROISelector.SetValue('ROI1')
             cam.AutoFunctionROIUseWhiteBalance.SetValue(False)
@@ -267,7 +449,176 @@ class Recorder(object):
             cam.AutoFunctionROIOffsetX.SetValue(0)
             cam.AutoFunctionROIOffsetY.SetValue(0)
         except genicam.LogicalErrorException:
+            return False
+        return True
+
+    @staticmethod
+    def _config_brightness_roi(cam) -> bool:
+        """Uses the central part of the image (ROI1) for auto exposure/gain, returns False if not available"""
+        try:
+            cam.AutoFunctionROISelector.SetValue('ROI1')
+            cam.AutoFunctionROIUseBrightness.SetValue(True)
+            cam.AutoFunctionROISelector.SetValue('ROI2')
+            cam.AutoFunctionROIUseBrightness.SetValue(False)
+        except genicam.LogicalErrorException:
+            return False
+
+        # define ROI to use
+        cam.AutoFunctionROISelector.SetValue('ROI1')
+        wOff = int(cam.Width.GetValue() / 4)
+        hOff = int(cam.Height.GetValue() / 4)
+        wSize = int(cam.Width.GetValue() / 2)
+        hSize = int(cam.Height.GetValue() / 2)
+
+        # Enforce size is a multiple of two (important because of bayer pattern)
+        wSize = int(wSize / 2) * 2
+        hSize = int(hSize / 2) * 2
+
+        # set ROI
+        cam.AutoFunctionROIWidth.SetValue(wSize)
+        cam.AutoFunctionROIHeight.SetValue(hSize)
+        cam.AutoFunctionROIOffsetX.SetValue(wOff)
+        cam.AutoFunctionROIOffsetY.SetValue(hOff)
+
+        # 0.3 means that the target brightness is 30 % of the maximum brightness
+        # of the raw pixel value read out from the sensor.
+        cam.AutoTargetBrightness.SetValue(0.2)
+        return True
+
+    def _config_auto_function(self, cam, function: str) -> bool:
+        """Configures ROI and limits of an auto function ('exposure', 'gain' or 'white balance')"""
+        if function == 'white balance':
+            return self.is_color_cam(cam) and self._config_white_balance_roi(cam)
+        if not self._config_brightness_roi(cam):
+            return False
+        try:
+            if function == 'exposure':
+                cam.AutoExposureTimeLowerLimit.SetValue(cam.AutoExposureTimeLowerLimit.GetMin())
+                cam.AutoExposureTimeUpperLimit.SetValue(cam.AutoExposureTimeUpperLimit.GetMax())
+            else:
+                cam.AutoGainLowerLimit.SetValue(cam.Gain.GetMin())
+                cam.AutoGainUpperLimit.SetValue(cam.Gain.GetMax())
+        except genicam.LogicalErrorException:
+            return False
+        return True
+
+    def run_auto_array(self, function: str, cancel_event: Event = None, progress_callback=None,
+                       max_images: int = 100) -> dict:
+        """
+        Runs an auto function on all cameras at once. All cameras are configured first, then the array grabs
+        continuously and every camera is released from the loop as soon as its auto function has finished, so the
+        whole array converges in about the time of the slowest camera. If the array is already grabbing (viewing),
+        the running acquisition drives the auto functions and only their state is polled.
+        :param function: 'exposure', 'gain' or 'white balance'
+        :param cancel_event: if set, all auto functions are switched off and the loop is left
+        :param progress_callback: called with (cam_id, number of grabbed images) after every image
+        :param max_images: maximal number of images per camera
+        :return: dict cam_id -> {'images': int, 'seconds': float, 'value': float, 'converged': bool}
+        """
+        node_name = AUTO_FUNCTION_NODES[function]
+        was_closed = False
+        if not self.cam_array.IsOpen():
+            was_closed = True
+            self.cam_array.Open()
+
+        start = time.monotonic()
+        grabbing = self.cam_array.IsGrabbing()
+        context, active, results = {}, {}, {}
+        for c_id, cam in enumerate(self.cam_array):
+            context[cam.GetCameraContext()] = c_id
+            try:
+                if not self._config_auto_function(cam, function):
+                    self.log.info(f'Auto {function} is not available for {cam.DeviceInfo.GetUserDefinedName()}')
+                    continue
+            except genicam.AccessException:
+                self.log.info(f'Cant configure auto {function} for {cam.DeviceInfo.GetUserDefinedName()} '
+                              f'while grabbing')
+                continue
+            if not grabbing:
+                self._config_cams_continuous(cam)
+            getattr(cam, node_name).SetValue('Once')
+            active[c_id] = getattr(cam, node_name)
+            results[c_id] = {'images': 0, 'seconds': 0.0, 'value': 0.0, 'converged': False}
+
+        if active and not grabbing:
+            self.cam_array.StartGrabbing(pylon.GrabStrategy_LatestImageOnly)
+        try:
+            while active:
+                if cancel_event is not None and cancel_event.is_set():
+                    self.log.info(f'Auto {function} was cancelled')
+                    break
+                if grabbing:
+                    time.sleep(0.01)
+                    for c_id in [c_id for c_id, node in active.items() if node.GetValue() == 'Off']:
+                        results[c_id].update(converged=True, seconds=time.monotonic() - start)
+                        del active[c_id]
+                    if time.monotonic() - start > self.grab_timeout / 1000 * 3:
+                        self.log.error(f'Auto {function} was not successful for cameras {list(active)}')
+                        break
+                    continue
+                grabResult = self.cam_array.RetrieveResult(5000, pylon.TimeoutHandling_Return)
+                if not grabResult.IsValid():
+                    self.log.error(f'Auto {function}: no image within 5s from cameras {list(active)}')
+                    break
+                c_id = context[grabResult.GetCameraContext()]
+                grabResult.Release()
+                if c_id not in active:
+                    continue
+                results[c_id]['images'] += 1
+                if progress_callback is not None:
+                    progress_callback(c_id, results[c_id]['images'])
+
+                if active[c_id].GetValue() == 'Off':
+                    results[c_id]['converged'] = True
+                elif results[c_id]['images'] >= max_images:
+                    self.log.error(f'Auto {function} was not successful for camera {c_id}')
+                else:
+                    continue
+                results[c_id]['seconds'] = time.monotonic() - start
+                del active[c_id]
+        finally:
+            if not grabbing and self.cam_array.IsGrabbing():
+                self.cam_array.StopGrabbing()
+
+        for c_id, node in active.items():  # cancelled or timed out
+            node.SetValue('Off')
+            results[c_id]['seconds'] = time.monotonic() - start
+
+        for c_id, result in results.items():
+            cam = self.cam_array[c_id]
+            if function == 'exposure':
+                result['value'] = self.get_cam_exposureTime(cam)
+            elif function == 'gain':
+                result['value'] = self.get_cam_gain(cam)
+            self.log.debug(f"Auto {function} {cam.DeviceInfo.GetUserDefinedName()}: {result['images']} images, "
+                           f"{result['seconds']:0.2f}s, value {result['value']:0.1f}")
+        self.log.info(f'Auto {function} for {len(results)} cameras took {time.monotonic() - start:0.2f}s')
+
+        if was_closed:
+            self.cam_array.Close()
+        return results
+
+    def run_white_balance(self, cam_id: int, cancel_event: Event = None, progress_callback=None):
+        """Set auto white balance for color cameras"""
+        was_closed = False
+        cam = self.cam_array[cam_id]
+        if not cam.IsOpen():
+            was_closed = True
+            cam.Open()
+        c = self.cameraregistry.get_camera(cam.DeviceInfo.GetSerialNumber())
+        self.log.info(f"Setting white balance for {c.get('name')} "
+                      f"{cam.GetDeviceInfo().GetSerialNumber()}")
+
+        if not self.is_color_cam(cam):
+            self.log.info(f"{c.get('name')} is not a color cam\n"
+                          f"Skipping white balancing")
+            if was_closed:
+                cam.Close()
+            return
+        if not self._config_white_balance_roi(cam):
             self.log.info('White balance setting is not available for this camera')
+            if was_closed:
+                cam.Close()
             return
 
         # get initial values
@@ -281,19 +632,7 @@ class Recorder(object):
             print('Blue= ', cam.BalanceRatio.GetValue())
 
         cam.BalanceWhiteAuto.SetValue('Once')
-
-        i = 0
-        while not cam.BalanceWhiteAuto.GetValue() == 'Off':
-            if not cam.IsGrabbing():
-                cam.GrabOne(5000)
-                i += 1
-
-                if i > 100:
-                    self.log.error('Auto White balance was not successful')
-                    break
-            else:
-                time.sleep(0.01)
-                i = 0
+        self._run_auto_loop(cam, cam.BalanceWhiteAuto, 'Auto White balance', cancel_event, progress_callback)
 
         # get final values
         if self._verbosity > 1:
@@ -308,7 +647,7 @@ class Recorder(object):
         if was_closed:
             cam.Close()
 
-    def run_auto_exposure(self, cam_id: int) -> float:
+    def run_auto_exposure(self, cam_id: int, cancel_event: Event = None, progress_callback=None) -> float:
         """ Adjust exposure time while keeping gain fixed. """
         was_closed = False
         cam = self.cam_array[cam_id]
@@ -318,56 +657,19 @@ class Recorder(object):
 
         self.log.info(f"Setting auto exposure for {self.cameraregistry.get_camera(cam.GetDeviceInfo().GetSerialNumber()).get('name')}"
                       f"{cam.GetDeviceInfo().GetSerialNumber()}")
-        try:
-            cam.AutoFunctionROISelector.SetValue('ROI1')
-            cam.AutoFunctionROIUseBrightness.SetValue(True)
-            cam.AutoFunctionROISelector.SetValue('ROI2')
-            cam.AutoFunctionROIUseBrightness.SetValue(False)
-        except genicam.LogicalErrorException:
+        if not self._config_brightness_roi(cam):
             self.log.info('Auto exposure setting is not available for this camera')
+            if was_closed:
+                cam.Close()
             return 0
 
-        # define ROI to use
-        cam.AutoFunctionROISelector.SetValue('ROI1')
-        wOff = int(cam.Width.GetValue() / 4)
-        hOff = int(cam.Height.GetValue() / 4)
-        wSize = int(cam.Width.GetValue() / 2)
-        hSize = int(cam.Height.GetValue() / 2)
-
-        # Enforce size is a multiple of two (important because of bayer pattern)
-        wSize = int(wSize / 2) * 2
-        hSize = int(hSize / 2) * 2
-
-        # set ROI
-        cam.AutoFunctionROIWidth.SetValue(wSize)
-        cam.AutoFunctionROIHeight.SetValue(hSize)
-        cam.AutoFunctionROIOffsetX.SetValue(wOff)
-        cam.AutoFunctionROIOffsetY.SetValue(hOff)
-
-        # 0.3 means that the target brightness is 30 % of the maximum brightness
-        # of the raw pixel value read out from the sensor.
-        cam.AutoTargetBrightness.SetValue(0.2)
-
         # give auto some bounds
         cam.AutoExposureTimeLowerLimit.SetValue(cam.AutoExposureTimeLowerLimit.GetMin())
         cam.AutoExposureTimeUpperLimit.SetValue(cam.AutoExposureTimeUpperLimit.GetMax())
 
         # set gain to its reference value
         cam.ExposureAuto.SetValue('Once')
-
-        i = 0
-        while not cam.ExposureAuto.GetValue() == 'Off':
-            if not cam.IsGrabbing():
-                cam.GrabOne(5000)
-                # instead of grabing just waiting if cama is already grabbing ?
-                i += 1
-
-                if i > 100:
-                    self.log.error('Auto Exposure was not successful')
-                    break
-            else:
-                time.sleep(0.01)
-                i = 0
+        i = self._run_auto_loop(cam, cam.ExposureAuto, 'Auto Exposure', cancel_event, progress_callback)
         exposure_time = self.get_cam_exposureTime(cam)
         self.log.debug(f'Final exposure after {i} images {exposure_time:0.1f} us in range '
                        f'{cam.AutoExposureTimeLowerLimit.GetMin()}-{cam.AutoExposureTimeUpperLimit.GetMax()}')
@@ -381,7 +683,7 @@ class Recorder(object):
             cam.Close()
         return exposure_time
 
-    def run_auto_gain(self, cam_id) -> float:
+    def run_auto_gain(self, cam_id, cancel_event: Event = None, progress_callback=None) -> float:
         # check if this can be run while visualization is running ?
         # do a check if grabbing is already grabbing ?
         # if so just wait until th flag gets reset ?
@@ -397,36 +699,12 @@ class Recorder(object):
                       f"{cam.GetDeviceInfo().GetSerialNumber()}")
 
         # no clue whether those are needed / or work
-        try:
-            cam.AutoFunctionROISelector.SetValue('ROI1')
-            cam.AutoFunctionROIUseBrightness.SetValue(True)
-            cam.AutoFunctionROISelector.SetValue('ROI2')
-            cam.AutoFunctionROIUseBrightness.SetValue(False)
-        except genicam.LogicalErrorException:
+        if not self._config_brightness_roi(cam):
             self.log.info('Auto gain setting is not available for this camera')
+            if was_closed:
+                cam.Close()
             return 0
 
-        # define ROI to use
-        cam.AutoFunctionROISelector.SetValue('ROI1')
-        wOff = int(cam.Width.GetValue() / 4)
-        hOff = int(cam.Height.GetValue() / 4)
-        wSize = int(cam.Width.GetValue() / 2)
-        hSize = int(cam.Height.GetValue() / 2)
-
-        # Enforce size is a multiple of two (important because of bayer pattern)
-        wSize = int(wSize / 2) * 2
-        hSize = int(hSize / 2) * 2
-
-        # set ROI
-        cam.AutoFunctionROIWidth.SetValue(wSize)
-        cam.AutoFunctionROIHeight.SetValue(hSize)
-        cam.AutoFunctionROIOffsetX.SetValue(wOff)
-        cam.AutoFunctionROIOffsetY.SetValue(hOff)
-
-        # 0.3 means that the target brightness is 30 % of the maximum brightness
-        # of the raw pixel value read out from the sensor.
-        cam.AutoTargetBrightness.SetValue(0.2)
-
         # give auto some bounds
         cam.AutoGainLowerLimit.SetValue(cam.Gain.GetMin())
         cam.AutoGainUpperLimit.SetValue(cam.Gain.GetMax())
@@ -435,19 +713,7 @@ class Recorder(object):
         # cam.ExposureTime.SetValue(0)
         # print('Initial gain', cam.Gain.GetValue())
         cam.GainAuto.SetValue('Once')
-        i = 0
-        while not cam.GainAuto.GetValue() == 'Off':
-            if not cam.IsGrabbing():
-                cam.GrabOne(5000)
-                # instead of grabing just waiting if cama is already grabbing ?
-                i += 1
-
-                if i > 100:
-                    self.log.error('Auto Gain was not successful')
-                    break
-            else:
-                time.sleep(0.01)
-                i = 0
+        i = self._run_auto_loop(cam, cam.GainAuto, 'Auto Gain', cancel_event, progress_callback)
         gain = self.get_cam_gain(cam)
         self.log.debug(f'Final gain after {i} images {cam.Gain.GetValue():0.1f} in range {cam.Gain.GetMin()}'
                        f'-{cam.Gain.GetMax()}')
@@ -461,6 +727,74 @@ class Recorder(object):
             cam.Close()
         return gain
 
+    def run_software_auto(self, mode: str, cam_ids: list = None, cancel_event: Event = None, progress_callback=None,
+                          timeout: float = 20.0) -> dict:
+        """
+        Host side auto exposure/gain on the frames of the running acquisition (viewing or single view), no GrabOne
+        needed. Blocks until all cameras converged, use from a background thread.
+        :param mode: 'exposure', 'gain' or 'both'
+        :param cam_ids: cameras to adjust, all if None
+        :param cancel_event: if set, the cameras keep their current values and the function returns
+        :param progress_callback: called with (cam_id, number of evaluated frames)
+        :param timeout: maximal time in s
+        :return: dict cam_id -> {'images': int, 'seconds': float, 'value': float, 'converged': bool}
+        """
+        if cam_ids is None:
+            cam_ids = list(range(self.cam_array.GetSize()))
+        start = time.monotonic()
+        for c_id in cam_ids:
+            cam = self.cam_array[c_id]
+            gain_limits, exp_limits, _ = self.get_cam_limits(cam)
+            if not exp_limits:
+                self.log.info(f'Software auto exposure not available for {cam.DeviceInfo.GetUserDefinedName()}')
+                continue
+            # longer exposures than the frame interval would reduce the frame rate
+            exp_limits = (exp_limits[0], min(exp_limits[1], 1e6 / self.fps))
+            self.soft_auto[c_id] = HistogramAutoExposure(self.get_cam_exposureTime(cam), self.get_cam_gain(cam),
+                                                         exp_limits, gain_limits, mode=mode)
+
+        controllers = {c_id: self.soft_auto[c_id] for c_id in cam_ids if c_id in self.soft_auto}
+        reported = {c_id: 0 for c_id in controllers}
+        while not all(controller.converged for controller in controllers.values()):
+            if cancel_event is not None and cancel_event.is_set():
+                self.log.info('Software auto exposure was cancelled')
+                break
+            if time.monotonic() - start > timeout or self.error_event.is_set():
+                self.log.error('Software auto exposure did not converge, are the cameras grabbing ?')
+                break
+            for c_id, controller in controllers.items():
+                if progress_callback is not None and controller.n_frames != reported[c_id]:
+                    reported[c_id] = controller.n_frames
+                    progress_callback(c_id, controller.n_frames)
+            time.sleep(0.02)
+        for c_id in controllers:
+            self.soft_auto.pop(c_id, None)
+
+        results = {}
+        for c_id, controller in controllers.items():
+            value = controller.gain if mode == 'gain' else controller.exposure
+            results[c_id] = {'images': controller.n_frames, 'seconds': time.monotonic() - start, 'value': value,
+                             'converged': controller.converged}
+            self.log.debug(f'Software auto {mode} camera {c_id}: {controller.n_frames} frames, '
+                           f'{controller.exposure:0.0f} us, {controller.gain:0.1f} dB, '
+                           f'brightness {controller.brightness}')
+        return results
+
+    def _software_auto_step(self, cam_id: int, cam, img):
+        """feeds a grabbed frame into the software auto exposure of the camera and applies new values"""
+        controller = self.soft_auto.get(cam_id)
+        if controller is None or controller.converged:
+            return
+        if controller.update(img):
+            try:
+                if controller.mode != 'exposure':
+                    cam.Gain.SetValue(controller.gain)
+                if controller.mode != 'gain':
+                    self.set_cam_exposureTime(cam, controller.exposure)
+            except genicam.GenericException as e:
+                self.log.error(f'Software auto exposure could not set values for camera {cam_id}: {e}')
+                controller.converged = True
+
     @staticmethod
     def get_cam_exposureTime(cam: pylon.InstantCamera) -> float:
         """Wrapper to ge exposure time.. in some cameras has different node"""
@@ -502,80 +836,14 @@ class Recorder(object):
             return [], [], []
 
     @classmethod
-    def set_cam_settings(cls, cam: pylon.InstantCamera, settings: dict):
-        was_closed = False
-        if not cam.IsOpen():
-            was_closed = True
-            cam.Open()
-
-        try:
-            gain = settings['gain']
-            cam.Gain.SetValue(gain)
-        except genicam.OutOfRangeException:
-            print(f'Value{gain:0.0f} is out of range of gain for this camera')
-        except genicam.LogicalErrorException:
-            pass  # Not implemented for this camera
-        except KeyError:
-            pass
-
-        cls.set_cam_exposureTime(cam, settings.get('exp_time', None))
-
-        try:
-            flipX = settings['flipX']
-            cam.ReverseX.SetValue(flipX)
-        except genicam.LogicalErrorException:
-            pass  # Not implemented for this camera
-        except KeyError:
-            pass  # not in settings
-
-        try:
-            flipY = settings['flipY']
-            cam.ReverseX.SetValue(flipY)
-        except genicam.LogicalErrorException:
-            pass  # Not implemented for this camera
-        except KeyError:
-            pass  # not in settings
-
-        try:
-            red_balance, green_balance, blue_balance = settings['color_balance']
-            cam.BalanceRatioSelector.SetValue('Red')
-            cam.BalanceRatio.SetValue(red_balance)
-            cam.BalanceRatioSelector.SetValue('Green')
-            cam.BalanceRatio.SetValue(green_balance)
-            cam.BalanceRatioSelector.SetValue('Blue')
-            cam.BalanceRatio.SetValue(blue_balance)
-        except genicam.LogicalErrorException:
-            pass  # Not implemented for this camera
-        except KeyError:
-            pass  # not in settings
-
-        try:
-            cam.PixelFormat.SetValue(settings['color_mode'])
-        except genicam.LogicalErrorException: # Not implemented for this camera
-            print('Could not set color mode')
-        except genicam.InvalidArgumentException:
-            print(f"Color mode {settings['color_mode']} not available for {cam.DeviceInfo.GetUserDefinedName()} camera")
-
-        line_in = settings.get('lineIN', None)
-        if line_in is None:
-            line_in = TRIGGER_LINE_IN
-        try:
-            cam.LineSelector.Value = line_in
-            cam.LineMode.Value = "Input"
-            cam.TriggerSelector.Value = "FrameStart"
-            cam.TriggerSource.Value = line_in
-        except genicam.LogicalErrorException:
-            print('Could not set trigger line')
-
-        line_out = settings.get('lineOUT', None)
-        if line_out:
-            cam.LineSelector.Value = line_out
-            cam.LineMode.Value = "Output"
-            # set to exposureactive
-            cam.LineSource.Value = "ExposureActive"
-
-        if was_closed:
-            cam.Close()
+    def set_cam_settings(cls, cam: pylon.InstantCamera, settings: dict) -> dict:
+        """
+        Set settings of a camera, only values which differ from the current ones are written
+        :param cam: camera object
+        :param settings: dict with settings of this camera
+        :return: report of changed/unchanged/failed settings
+        """
+        return cls.settings_engine.apply(cam, settings)
 
     @classmethod
     def get_cam_settings(cls, cam: pylon.InstantCamera) -> dict:
@@ -584,48 +852,57 @@ class Recorder(object):
         :param cam: camera object
         :return: dict with settings
         """
-        was_closed = False
-        if not cam.IsOpen():
-            was_closed = True
-            cam.Open()
-
-        cam_settings = {}
-        cam_name = cam.DeviceInfo.GetUserDefinedName()
-        cam_settings[cam_name] = {}
+        return {cam.DeviceInfo.GetUserDefinedName(): cls.settings_engine.read(cam)}
 
-        cam_settings[cam_name]['gain'] = cls.get_cam_gain(cam)
-        cam_settings[cam_name]['exp_time'] = cls.get_cam_exposureTime(cam)
-
-        try:
-            cam_settings[cam_name]['flipX'] = cam.ReverseX.GetValue()
-            cam_settings[cam_name]['flipY'] = cam.ReverseY.GetValue()
-        except genicam.LogicalErrorException:
-            pass  # Not implemented for this camera
-
-        try:
-            if cls.is_color_cam(cam):
-                cam.BalanceRatioSelector.SetValue('Red')
-                red_balance = cam.BalanceRatio.GetValue()
-                cam.BalanceRatioSelector.SetValue('Green')
-                green_balance = cam.BalanceRatio.GetValue()
-                cam.BalanceRatioSelector.SetValue('Blue')
-                blue_balance = cam.BalanceRatio.GetValue()
-                cam_settings[cam_name]['color_balance'] = (red_balance, green_balance, blue_balance)
-        except genicam.LogicalErrorException:
-            pass  # Not implemented for this camera
-
-        try:
-            color_mode = cam.PixelFormat.GetValue()
-            cam_settings[cam_name]['color_mode'] = color_mode
-        except genicam.LogicalErrorException:
-            pass  # Not implemented for this camera
-
-        # if implemet savign and setting lines need to cycle trough all of them
-        #problem need to run trough all lines to get all settings
+    def apply_settings(self, cam_lib: dict, profile: (str, None) = None) -> dict:
+        """
+        Applies the settings of a settings file to all connected cameras concurrently
+        :param cam_lib: dict camera name -> settings, may contain recording profiles (see SettingsStore)
+        :param profile: recording profile (ROI/binning), defaults to the profile selected in cam_lib
+        :return: dict camera name -> report, cameras without settings are left out
+        """
+        cam_lib = apply_profile(cam_lib, profile)
+        cam_settings = []
+        for cam in self.cam_array:
+            name = cam.DeviceInfo.GetUserDefinedName()
+            if name in cam_lib:
+                cam_settings.append((cam, cam_lib[name]))
+            else:
+                self.log.info(f'No settings found for cam: {name} with SN: {cam.DeviceInfo.GetSerialNumber()}')
+        reports = self.settings_engine.apply_all(cam_settings)
+        for name, report in reports.items():
+            if 'frame_size' in report:
+                self.log.debug(f'{name} frame size {report["frame_size"][0]}x{report["frame_size"][1]}')
+        return reports
+
+    def read_settings(self, full: bool = False) -> dict:
+        """settings of all connected cameras, camera name -> settings"""
+        return self.settings_engine.read_all(self.cam_array, full=full)
+
+    def snapshot_settings(self, session_id: str, general: dict = None) -> str:
+        """
+        Stores the full state of all cameras (including ROI and trigger lines) as new snapshot version of the session
+        :param session_id: session the snapshot belongs to
+        :param general: general settings like fps and codec
+        :return: snapshot ID
+        """
+        self.snapshot_cameras = self.read_settings(full=True)
+        self.snapshot_id = self.settings_store.save(session_id, self.snapshot_cameras, general)
+        return self.snapshot_id
 
-        if was_closed:
-            cam.Close()
-        return cam_settings
+    def restore_snapshot(self, reference: str) -> (dict, None):
+        """
+        Applies a snapshot, only settings differing from the current camera state are written
+        :param reference: snapshot ID or session ID for its latest snapshot
+        :return: the snapshot or None if there is no such snapshot
+        """
+        snapshot_id = self.settings_store.resolve(reference)
+        if snapshot_id is None:
+            return None
+        snapshot = self.settings_store.load(snapshot_id)
+        self.apply_settings(snapshot['cameras'])
+        self.log.info(f'Restored settings snapshot {snapshot_id}')
+        return snapshot
 
     def flip_image_x(self, cam_id: int):
         """ Flips the image  of a single camera in the X plane """
@@ -670,6 +947,7 @@ class Recorder(object):
 
         self._config_cams_continuous(cam)
         self.current_cam = cam
+        self.current_cam_id = cam_id
 
         self.stop_event = stop_event
         self.error_event.clear()
@@ -713,6 +991,7 @@ class Recorder(object):
                         targetImage = converter.Convert(grabResult)
                         img = targetImage.GetArray()
 
+                    self._software_auto_step(self.current_cam_id, cam, img)
                     self.single_view_queue.put_nowait(img)
                     grabResult.Release()
                 else:
@@ -731,8 +1010,31 @@ class Recorder(object):
                 break
         cam.StopGrabbing()
 
+    def _put_preview(self, cam_id: int, img):
+        """puts the frame into the preview queue of the camera and notifies the GUI once until it takes the frames"""
+        self.multi_view_queue[cam_id].put_nowait(img)
+        if self.preview_callback is not None and not self._preview_pending[cam_id]:
+            self._preview_pending[cam_id] = True
+            self.preview_callback(cam_id)
+
+    def take_preview(self, cam_id: int):
+        """
+        Empties the preview queue of a camera and re-arms its notification
+        :return: newest frame or None if there is none
+        """
+        if self.multi_view_queue is None or cam_id >= len(self.multi_view_queue):
+            return None
+        self._preview_pending[cam_id] = False  # before draining, frames put meanwhile notify again
+        img = None
+        while True:
+            try:
+                img = self.multi_view_queue[cam_id].get_nowait()
+            except Empty:
+                return img
+
     def run_multi_cam_show(self, stop_event: Event, use_hw_trigger: bool = False):
         self.multi_view_queue = [Queue(self.internal_queue_size) for _ in range(self.cam_array.GetSize())]
+        self._preview_pending = [False] * self.cam_array.GetSize()
         #self.multi_view_queue = [Queue(self.internal_queue_size)] * self.cam_array.GetSize()
         #second option does copies of ques and not references!
 
@@ -753,6 +1055,7 @@ class Recorder(object):
         #self.log.debug(self.cams_context)
         self.stop_event = stop_event
         self.error_event.clear()
+        self._start_monitoring(use_hw_trigger)
         self.multi_view_thread = Thread(target=self.multi_cam_show)
         self.multi_view_thread.start()
         self.is_viewing = True
@@ -774,12 +1077,19 @@ class Recorder(object):
         converter.OutputBitAlignment = pylon.OutputBitAlignment_MsbAligned  # most significant bit first #
         # will i need an array of converters ?
 
+        self.watchdog.start()
         self.cam_array.StartGrabbing(pylon.GrabStrategy_LatestImageOnly)
         while not self.stop_event.is_set():
+            if self.device_monitor.lost:
+                self._restore_cameras(pylon.GrabStrategy_LatestImageOnly)
             try:
                 grabResult = self.cam_array.RetrieveResult(self.grab_timeout, pylon.TimeoutHandling_ThrowException)
                 context_id = self.cams_context[grabResult.GetCameraContext()]
                 #self.log.debug(f"Cam {grabResult.GetCameraContext()} grabbed with context {context_id}")
+                if self.device_monitor.is_lost(context_id):
+                    grabResult.Release()
+                    continue
+                self._watch(context_id)
 
                 if grabResult.GrabSucceeded():
                     if converter.ImageHasDestinationFormat(grabResult):
@@ -791,24 +1101,93 @@ class Recorder(object):
                         img = targetImage.GetArray()
                     #img = grabResult.GetArray()
                     # context_id = self.cams_context[grabResult.GetCameraContext()]
-                    self.multi_view_queue[context_id].put_nowait(img)
+                    self._software_auto_step(context_id, self.cam_array[context_id], img)
+                    self._put_preview(context_id, img)
                     grabResult.Release()
                 else:
                     print("Error: ", grabResult.ErrorCode, grabResult.ErrorDescription)
-            except genicam.TimeoutException as e:
-                self.log.error(e)
-                self.error_event.set()
-                break
+            except (genicam.TimeoutException, genicam.RuntimeException) as e:
+                if not self._grab_error(e):
+                    break
             except Full:
                 self.log.error(f"Queue buffer for camera {context_id} overrun !")
                 self.error_event.set()
                 break
         self.cam_array.StopGrabbing()
+        self._stop_monitoring()
         self.is_viewing = False
 
-    def run_multi_cam_record(self, stop_event: Event, filename: str = 'testrec', use_hw_trigger: bool = False):
+    def resolve_codec(self, codec: str = None, fps: float = None) -> str:
+        """
+        Maps the codec 'auto' to the profiled codec with the lowest cpu load which sustains fps for all cameras
+        :param codec: codec, defaults to self.codec
+        :param fps: recording frame rate, defaults to self.fps
+        :return: codec to use
+        """
+        codec = codec or self.codec
+        if codec != AUTO_CODEC:
+            return codec
+        frame_sizes = [(cam.Width.GetValue(), cam.Height.GetValue()) for cam in self.cam_array]
+        chosen = choose_codec(load_encoder_profiles(), fps or self.fps, frame_sizes)
+        if chosen is None:
+            self.log.warning(f'No profiled codec sustains {fps or self.fps} FPS for {len(frame_sizes)} cameras, '
+                             f'using {DEFAULT_CODEC}. Run the encoder profiler to measure this machine')
+            return DEFAULT_CODEC
+        self.log.info(f'Chose codec {chosen} for {len(frame_sizes)} cameras at {fps or self.fps} FPS')
+        return chosen
+
+    def schedule_encoder_threads(self, n_writers: int) -> list:
+        """
+        Encoder threads of each writer. By default the cores (except RESERVED_CORES for grabbing and conversion)
+        are divided among the writers instead of every ffmpeg starting a thread pool as large as the machine.
+        :param n_writers: number of writers
+        :return: threads per writer, None keeps the ffmpeg default
+        """
+        if self.encoder_threads is None:
+            return [None] * n_writers
+        if self.encoder_threads > 0:
+            return [self.encoder_threads] * n_writers
+        if self.cpu_layout is not None:
+            threads = [len(cores) for cores in self.cpu_layout['writers']]
+        else:
+            threads = partition_cores(n_writers, reserved=RESERVED_CORES)
+        self.log.debug(f'Encoder threads per writer: {threads}')
+        return threads
+
+    def plan_cpu_layout(self):
+        """assigns cores to the grab thread and the camera writers if pin_cores is set and logs the layout"""
+        self.cpu_layout = None
+        if not self.pin_cores:
+            return
+        self.cpu_layout = plan_affinity(self.cam_array.GetSize(), GRAB_CORES)
+        names = [cam.DeviceInfo.GetUserDefinedName() for cam in self.cam_array]
+        self.log.info('CPU layout\n' + format_layout(self.cpu_layout, names, GRAB_NICE))
+
+    def _pin_grab_thread(self):
+        """called by the grab thread before grabbing starts, so the pylon grab threads inherit the affinity"""
+        if self.cpu_layout is None:
+            return
+        pinned = pin_thread(self.cpu_layout['grab'], 'grab thread')
+        prioritized = raise_priority(GRAB_NICE, 'grab thread')
+        self.log.info(f"Grab thread {'pinned to cores ' + str(self.cpu_layout['grab']) if pinned else 'not pinned'}"
+                      f"{', nice ' + str(GRAB_NICE) if prioritized else ', default priority'}")
+
+    def get_cpu_layout(self) -> dict:
+        """planned layout and the cores the running ffmpeg processes actually use (from /proc)"""
+        if self.cpu_layout is None:
+            return {}
+        return dict(self.cpu_layout, ffmpeg={pid: process_affinity(pid) for pid in child_processes('ffmpeg')})
+
+    def run_multi_cam_record(self, stop_event: Event, filename: str = 'testrec', use_hw_trigger: bool = False,
+                             camera_settings: dict = None):
+        """
+        Starts recording all cameras in the background
+        :param camera_settings: full settings of all cameras read right before (see snapshot_settings), restored
+                                on reconnected cameras. Read again if None
+        """
         was_closed = False
         self.multi_view_queue = [Queue(self.internal_queue_size) for _ in range(self.cam_array.GetSize())]
+        self._preview_pending = [False] * self.cam_array.GetSize()
 
         # create path if not exists
         (Path(self.save_path)).mkdir(parents=True, exist_ok=True)
@@ -827,6 +1206,9 @@ class Recorder(object):
         except (TypeError, ValueError):
             timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
 
+        codec = self.resolve_codec()
+        self.plan_cpu_layout()
+        threads = self.schedule_encoder_threads(self.cam_array.GetSize())
         # to make sure all have the same timestamp
         for c_id, cam in enumerate(self.cam_array):
             if use_hw_trigger:
@@ -840,10 +1222,25 @@ class Recorder(object):
             video_name = (Path(self.save_path) / video_name).as_posix()
             self.video_writer_list.append(VideoWriterFast(video_name,
                                                           fps=self.fps,
-                                                          codec=self.codec))  # was DIVX
+                                                          codec=codec,
+                                                          crf=self.crf,
+                                                          segment_frames=self.segment_frames,
+                                                          segment_minutes=self.segment_minutes,
+                                                          preset=self.encoder_preset,
+                                                          tune=self.encoder_tune,
+                                                          threads=threads[c_id],
+                                                          pix_fmt=self.encoder_pix_fmt,
+                                                          cores=self.cpu_layout['writers'][c_id]
+                                                          if self.cpu_layout else None,
+                                                          on_segment_closed=self._segment_closed))  # was DIVX
+        # the manifest is only written for segmented recordings or if a camera was reconnected into a new segment,
+        # it is updated every time a segment is closed, so it covers all complete files if the recording crashes
+        self._manifest_names = [cam.DeviceInfo.GetUserDefinedName() for cam in self.cam_array]
+        self.manifest_path = (Path(self.save_path) / f"{filename}_{timestamp}_manifest.json").as_posix()
         # self.log.debug(print(self.cams_context))
         self.stop_event = stop_event
         self.error_event.clear()
+        self._start_monitoring(use_hw_trigger, camera_settings)
         self.multi_record_thread = Thread(target=self.multi_cam_record)
         self.multi_record_thread.start()
         self.is_recording = True
@@ -856,26 +1253,71 @@ class Recorder(object):
             writer.wait_to_finish()
             writer.stop()
         self.log.debug('writers finished')
+        if self._needs_manifest():
+            self.write_manifest()
+        else:
+            self.manifest_path = None
         self.is_recording = False
         self.error_event.clear()
         self.stop_event = None
         self.multi_record_thread = None
         self.cams_context = None
 
+    def _needs_manifest(self) -> bool:
+        return bool(self.segment_frames or self.segment_minutes
+                    or any(len(writer.segments) > 1 for writer in self.video_writer_list))
+
+    def _segment_closed(self, writer, segment: dict):
+        """Called from the closing thread of a writer, keeps the manifest up to date at every rollover"""
+        self.log.debug(f"Segment {segment['file']} closed")
+        if self.manifest_path and self._needs_manifest():
+            self.write_manifest()
+
+    def write_manifest(self):
+        """
+        Writes the segments of all cameras with their first/last frame indices and timestamps to json. The file is
+        replaced atomically, so a crash while writing keeps the previous manifest.
+        """
+        manifest = {'fps': self.fps, 'segment_frames': self.segment_frames,
+                    'segment_minutes': self.segment_minutes, 'settings_snapshot': self.snapshot_id, 'cameras': {}}
+        for name, writer in zip(self._manifest_names, self.video_writer_list):
+            manifest['cameras'][name] = writer.get_manifest()
+        with self._manifest_lock:
+            tmp_path = self.manifest_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(manifest, f, indent=4)
+            os.replace(tmp_path, self.manifest_path)
+        self.log.info(f'Wrote segment manifest {self.manifest_path}')
+
+    def get_recorded_files(self) -> list:
+        """Returns all files written by the last recording, including the manifest if present"""
+        files = [file for writer in self.video_writer_list for file in writer.get_files()]
+        if self.manifest_path and Path(self.manifest_path).exists():
+            files.append(self.manifest_path)
+        return files
+
     def multi_cam_record(self):
+        self._pin_grab_thread()
         converter = pylon.ImageFormatConverter()
         converter.OutputPixelFormat = pylon.PixelType_RGB8packed
         converter.OutputBitAlignment = pylon.OutputBitAlignment_MsbAligned  # most significant bit first #
 
+        self.watchdog.start()
         self.cam_array.StartGrabbing(pylon.GrabStrategy_LatestImages)
         # cam.StartGrabbing(pylon.GrabStrategy_LatestImageOnly)  # here you dont have any buffer
         # cam.StartGrabbing(pylon.GrabStrategy_OneByOne)  # here you dont get warnings if something gets skipped
 
         while not self.stop_event.is_set():
+            if self.device_monitor.lost:
+                self._restore_cameras(pylon.GrabStrategy_LatestImages, writers=True)
             try:
                 grabResult = self.cam_array.RetrieveResult(self.grab_timeout, pylon.TimeoutHandling_ThrowException)
                 context_id = self.cams_context[grabResult.GetCameraContext()]
                 #self.log.debug(f"Cam {grabResult.GetCameraContext()} grabbed with context {context_id}")
+                if self.device_monitor.is_lost(context_id):
+                    grabResult.Release()
+                    continue
+                self._watch(context_id)
 
                 if grabResult.GetNumberOfSkippedImages() > 0:
                     self.log.warning(f'Cam{context_id}: Missed {grabResult.GetNumberOfSkippedImages()} frames')
@@ -898,17 +1340,16 @@ class Recorder(object):
                         self.video_writer_list[context_id].feed((img, img_nr_camera, img_nr, img_ts))
                     else:
                         self.video_writer_list[context_id].feed(img)
-                    self.multi_view_queue[context_id].put_nowait(img)
+                    self._put_preview(context_id, img)
                     # weirdly enough the recording does not mix up frames.. so maybe mixing up happens later ? in the queue
                     # or at the visualization ?
                     grabResult.Release()
                 else:
                     self.log.error(grabResult.ErrorCode, grabResult.ErrorDescription)
 
-            except genicam.TimeoutException as e:
-                self.log.error(e)
-                self.error_event.set()
-                break
+            except (genicam.TimeoutException, genicam.RuntimeException) as e:
+                if not self._grab_error(e):
+                    break
             except Full:
                 self.log.error(f"Queue buffer{context_id}overrun !")
                 self.error_event.set()
@@ -918,6 +1359,7 @@ class Recorder(object):
                 self.log.error(f"Queue buffer{context_id}overrun !")
                 break
         self.cam_array.StopGrabbing()
+        self._stop_monitoring()
         self.is_recording = False
 
 
@@ -0,0 +1,153 @@
+"""
+Versioned snapshots of the full rig state (settings of all cameras plus general settings like fps and codec).
+
+Snapshots are stored as one json file per snapshot and referenced by their ID, e.g. 'mouse12_v003'. A remote
+start message can pass such an ID (or a session ID for its latest snapshot) as setting_file, the recorder then
+restores it by applying only the differences to the current camera state (see CameraSettingsEngine).
+
+Recording profiles are stored in the settings file as well, e.g. a crop of the arena for high frame rates:
+    "profiles": {"arena": {"all": {"binning": [2, 2]}, "cam00": {"roi": [640, 480, 320, 240]}}},
+    "profile": "arena"
+Entries of the camera override the 'all' entry, a roi of "full" uses the whole sensor.
+"""
+import hashlib
+import json
+import logging
+import re
+import time
+from pathlib import Path
+
+SNAPSHOT_SUFFIX = '.snapshot.json'
+FULL_SENSOR = {'roi': 'full', 'binning': [1, 1], 'decimation': [1, 1]}  # settings without a profile
+
+
+def apply_profile(cam_lib: dict, profile: (str, None) = None) -> dict:
+    """
+    Merges a recording profile into the camera settings of a settings file
+    :param cam_lib: content of a settings file, camera name -> settings plus general settings
+    :param profile: name of the profile, defaults to the 'profile' entry of the file
+    :return: camera name -> settings, cameras get the full sensor if no profile is selected
+    :raises KeyError: if the profile does not exist
+    """
+    profiles = cam_lib.get('profiles', {})
+    profile = profile if profile is not None else cam_lib.get('profile', None)
+    result = {}
+    for name, settings in cam_lib.items():
+        if not isinstance(settings, dict) or name == 'profiles':
+            continue  # general settings
+        settings = dict(settings)
+        if profile:
+            settings.update(profiles[profile].get('all', {}))
+            settings.update(profiles[profile].get(name, {}))
+        elif profiles:
+            # the file uses profiles, switching back to none restores the full sensor
+            settings.update(FULL_SENSOR)
+        result[name] = settings
+    return result
+
+
+class SettingsStore:
+    """
+    Stores and loads settings snapshots.
+
+    :param root: folder of the snapshots, created if needed
+    """
+    def __init__(self, root: (str, Path)):
+        self.root = Path(root)
+        self.log = logging.getLogger('SettingsStore')
+        self.log.setLevel(logging.DEBUG)
+
+    @staticmethod
+    def _digest(cameras: dict, general: dict) -> str:
+        """content hash, identical rig states get the same digest independent of the key order"""
+        content = json.dumps({'cameras': cameras, 'general': general}, sort_keys=True)
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    @staticmethod
+    def _safe_name(session_id: str) -> str:
+        return re.sub(r'[^A-Za-z0-9_\-]', '_', session_id) or 'session'
+
+    def _path(self, snapshot_id: str) -> Path:
+        return self.root / f'{snapshot_id}{SNAPSHOT_SUFFIX}'
+
+    def list(self, session_id: str = None) -> list:
+        """
+        :param session_id: only snapshots of this session, all if None
+        :return: snapshot IDs sorted by session and version
+        """
+        if not self.root.exists():
+            return []
+        # the glob also matches other sessions starting with '<session>_v', e.g. 'mouse_v2' for 'mouse'
+        session = re.escape(self._safe_name(session_id)) if session_id else '.*'
+        snapshots = []
+        for path in self.root.glob('*' + SNAPSHOT_SUFFIX):
+            match = re.fullmatch(rf'({session})_v(\d+)', path.name[:-len(SNAPSHOT_SUFFIX)])
+            if match:
+                snapshots.append((match.group(1), int(match.group(2)), match.group(0)))
+        return [snapshot_id for _, _, snapshot_id in sorted(snapshots)]  # numeric versions, v1000 after v999
+
+    def latest(self, session_id: str) -> (str, None):
+        snapshots = self.list(session_id)
+        return snapshots[-1] if snapshots else None
+
+    def save(self, session_id: str, cameras: dict, general: dict = None) -> str:
+        """
+        Stores a new version for the session, unless the state did not change since the last version
+        :param session_id: session the snapshot belongs to
+        :param cameras: dict camera name -> settings
+        :param general: general settings (fps, codec, ...)
+        :return: snapshot ID
+        """
+        general = general or {}
+        digest = self._digest(cameras, general)
+        latest = self.latest(session_id)
+        if latest is not None and self.load(latest).get('digest') == digest:
+            self.log.debug(f'Settings unchanged, reusing snapshot {latest}')
+            return latest
+
+        version = int(latest.rsplit('_v', 1)[1]) + 1 if latest else 1
+        snapshot_id = f'{self._safe_name(session_id)}_v{version:03d}'
+        snapshot = {'id': snapshot_id, 'session_id': session_id, 'version': version,
+                    'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'digest': digest,
+                    'cameras': cameras, 'general': general}
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_path = self._path(snapshot_id).with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f, indent=4, sort_keys=True)
+        tmp_path.replace(self._path(snapshot_id))
+        self.log.info(f'Saved settings snapshot {snapshot_id}')
+        return snapshot_id
+
+    def load(self, snapshot_id: str) -> dict:
+        """
+        :param snapshot_id: ID of the snapshot
+        :return: snapshot dict with 'cameras' and 'general' settings
+        :raises FileNotFoundError: if there is no such snapshot
+        """
+        with open(self._path(snapshot_id), 'r') as f:
+            return json.load(f)
+
+    def resolve(self, reference: str) -> (str, None):
+        """
+        Maps a reference to a snapshot ID
+        :param reference: snapshot ID or session ID (latest snapshot of the session)
+        :return: snapshot ID or None if the reference is not a snapshot (e.g. a settings file)
+        """
+        if not reference:
+            return None
+        if self._path(reference).exists():
+            return reference
+        return self.latest(reference)
+
+
+if __name__ == '__main__':
+    import tempfile
+    logging.basicConfig(level=logging.DEBUG)
+    with tempfile.TemporaryDirectory() as folder:
+        store = SettingsStore(folder)
+        cams = {'cam1': {'gain': 1.0, 'exp_time': 5000.0}, 'cam2': {'gain': 2.0, 'exp_time': 5000.0}}
+        first = store.save('test session', cams, {'fps': 30})
+        same = store.save('test session', {'cam2': cams['cam2'], 'cam1': cams['cam1']}, {'fps': 30})
+        cams['cam1']['gain'] = 3.0
+        second = store.save('test session', cams, {'fps': 30})
+        print(first, same, second, store.list(), store.resolve('test session'))
@@ -1,5 +1,8 @@
+import logging
 import serial
 import time
+from serial.tools import list_ports
+from threading import Event, Lock, Thread
 from FreiPose_Recorder.configs.params import MAX_FPS
 
 class TriggerArduino:
@@ -53,6 +56,114 @@ class TriggerArduino:
         return s
 
 
+class PicoTrigger:
+    """
+    Serial connection to the CircuitPython trigger sketch with pyserial, the same line protocol as QtPicoSerial but
+    without Qt, e.g. for the headless recorder. Received lines are passed to line_callback from a reader thread.
+
+    :param line_callback: called with each received line (bytes, without line break)
+    :param baudrate: baud rate of the serial port
+    """
+    def __init__(self, line_callback=None, baudrate: int = 115200):
+        self.line_callback = line_callback
+        self.baudrate = baudrate
+        self._port = None
+        self._buffer = b''
+        self._write_lock = Lock()
+        self._stop_event = Event()
+        self._reader = None
+        self._fps = 30
+        self.is_pulsing = False
+        self.log = logging.getLogger('pico')
+        self.log.setLevel(logging.DEBUG)
+
+    @staticmethod
+    def available_ports() -> list:
+        """Return a list of device names of available serial ports."""
+        return [port.device for port in list_ports.comports()]
+
+    def is_open(self):
+        return self._port is not None
+
+    def open(self, port_name: str) -> bool:
+        """opens the port (closing an open one first), returns True if the port is open"""
+        if self._port is not None:
+            self.close()
+        try:
+            self._port = serial.Serial(port_name, self.baudrate, timeout=0.1)
+        except serial.SerialException as e:
+            self.log.warning(f"Failed to open serial port {port_name}: {e}")
+            self._port = None
+            return False
+        self._port.reset_input_buffer()
+        self._stop_event.clear()
+        self._reader = Thread(target=self._read_lines, daemon=True)
+        self._reader.start()
+        self.log.info(f"Opened serial port {port_name}")
+        return True
+
+    def close(self):
+        """Shut down the serial connection to the Pico."""
+        if self._port is None:
+            return
+        self._stop_event.set()
+        if self._reader is not None:
+            self._reader.join()
+            self._reader = None
+        self.log.info(f"Closing serial port {self._port.port}")
+        self._port.close()
+        self._port = None
+
+    def _read_lines(self):
+        while not self._stop_event.is_set():
+            try:
+                data = self._port.read(self._port.in_waiting or 1)
+            except serial.SerialException as e:
+                self.log.error(f"Serial port failed: {e}")
+                return
+            if not data:
+                continue
+            self._buffer += data
+            while b'\n' in self._buffer:
+                line, self._buffer = self._buffer.split(b'\n', 1)
+                self.log.debug("Received serial data: %s", line.rstrip())
+                if self.line_callback is not None:
+                    self.line_callback(line.rstrip())
+
+    def send(self, string: str):
+        """thread safe, sends a line to the Pico"""
+        if self._port is None:
+            self.log.error("Serial port not open during write.")
+            return
+        self.log.debug("Sending to serial port: %s", string)
+        with self._write_lock:
+            self._port.write(string.encode() + b'\n')
+            self._port.flush()
+
+    def ping(self):
+        self.send('P')
+
+    def start_trigger(self):
+        self.send(f'S{self.fps}')
+        self.is_pulsing = True
+
+    def stop_trigger(self):
+        self.send('Q')
+        self.is_pulsing = False
+
+    @property
+    def fps(self):
+        return self._fps
+
+    @fps.setter
+    def fps(self, fps: int):
+        fps = int(fps)
+        if fps < 1 or fps > MAX_FPS:
+            self.log.warning(f'Invalid fps value {fps}')
+            return
+        self._fps = fps
+
+
 if __name__ == '__main__':
     mod = TriggerArduino()
     mod.ping()
@@ -0,0 +1,356 @@
+"""
+Headless recording for remote controlled rigs, without Qt.
+
+Runs the Recorder, the remote control server and the serial link to the trigger. Nothing is rendered and Qt is never
+imported, which saves memory, startup time and cpu on acquisition machines. The remote client uses the same messages
+as with the GUI in remote mode.
+
+    python -m FreiPose_Recorder.headless --settings rig.settings.json --trigger_port /dev/ttyACM1
+"""
+import argparse
+import datetime
+import json
+import logging
+import signal
+import time
+from pathlib import Path
+from threading import Event, Timer
+
+from FreiPose_Recorder.configs.params import HOST, PORT, CALIB_DURATION, CALIB_WAIT, SAVE_TIMESTAMPS, \
+    COPY_WORKERS, LOG2FILE, MULTI_CLIENT_REMOTE, PREVIEW_STREAM_PORT
+from FreiPose_Recorder.core.Recorder import Recorder
+from FreiPose_Recorder.core.Trigger import PicoTrigger
+from FreiPose_Recorder.utils.async_server import RemoteServer
+from FreiPose_Recorder.utils.preview_stream import PreviewStreamer
+from FreiPose_Recorder.utils.socket_utils import SocketComm, SocketMessage, MessageType
+from FreiPose_Recorder.utils.transfer_utils import FileTransfer, SessionFiles
+from FreiPose_Recorder.version import VERSION
+
+DEFAULT_SETTINGS = ('default_settings.settings.json', 'default.settings.json')  # loaded after connecting, as the GUI
+
+
+class HeadlessRecorder(SessionFiles):
+    """
+    Remote controlled recording without GUI.
+
+    :param host: address of the remote control server
+    :param port: port of the remote control server
+    :param trigger_port: serial port of the trigger Pico, None records without hardware trigger
+    :param settings_file: settings file applied after connecting the cameras, defaults to DEFAULT_SETTINGS
+    """
+    def __init__(self, host: str = HOST, port: int = PORT, trigger_port: (str, None) = None,
+                 settings_file: (str, None) = None):
+        self.log = logging.getLogger('Headless')
+        self.log.setLevel(logging.DEBUG)
+        self.basler_recorder = Recorder(write_timestamps=SAVE_TIMESTAMPS)
+        if MULTI_CLIENT_REMOTE:
+            self.socket_comm = RemoteServer(host=host, port=port)
+        else:
+            self.socket_comm = SocketComm(type='server', host=host, port=port)
+        self.preview_streamer = PreviewStreamer(host=host, port=PREVIEW_STREAM_PORT)
+        self.file_transfer = FileTransfer(max_workers=COPY_WORKERS, progress_callback=self.report_copy_progress)
+        self.trigger = PicoTrigger(self.trigger_line_received) if trigger_port else None
+        self.trigger_port = trigger_port
+        self.settings_file = settings_file
+        self.general = {'save_path': '', 'fps': 30, 'HW_trigg': False, 'codec': 'libx264', 'crf': 17}
+        self.cam_lib = {}
+        self.profile = None
+        self.session_id = "test_sess"
+        self.session_path = None
+        self.files_copied = False
+        self.copy_thread = None
+        self.uploader = None
+        self.stop_event = None
+        self.calib_timers = []
+        self.shutdown_event = Event()
+
+    def setup(self) -> bool:
+        """connects cameras and trigger and applies the settings, returns False if there is no camera"""
+        self.basler_recorder.scan_cams()
+        if not self.basler_recorder.cam_array:
+            self.log.error('Found no cameras')
+            return False
+        self.basler_recorder.connect_cams()
+        for file in [self.settings_file] if self.settings_file else DEFAULT_SETTINGS:
+            try:
+                self.load_settings(file)
+                break
+            except FileNotFoundError:
+                self.log.info(f'No settings file {file}')
+        if self.trigger and not self.trigger.open(self.trigger_port):
+            self.log.error(f'Could not open the trigger port {self.trigger_port}, recording without trigger')
+            self.trigger = None
+        return True
+
+    ### Settings ####
+    def _set_general(self, general: dict):
+        self.general.update({key: general[key] for key in self.general if key in general})
+        self.basler_recorder.save_path = self.general['save_path']
+
+    def load_settings(self, file: (str, Path)):
+        with open(file, 'r') as fi:
+            cam_lib = json.load(fi)
+        self.cam_lib = cam_lib
+        self.profile = cam_lib.get('profile', None)
+        self.basler_recorder.apply_settings(cam_lib, self.profile)
+        self._set_general(cam_lib)
+        self.log.debug(f'Loaded settings from {file}')
+
+    def restore_snapshot(self, reference: str) -> bool:
+        snapshot = self.basler_recorder.restore_snapshot(reference)
+        if snapshot is None:
+            return False
+        self._set_general(snapshot['general'])
+        return True
+
+    def select_profile(self, profile: (str, None)):
+        if profile and profile not in self.cam_lib.get('profiles', {}):
+            self.log.error(f'Recording profile {profile} not found in the settings file')
+            return
+        self.profile = profile
+        self.basler_recorder.apply_settings(self.cam_lib, profile or '')
+
+    def general_settings(self) -> dict:
+        general = dict(self.general)
+        if self.cam_lib.get('profiles', None):
+            general.update(profiles=self.cam_lib['profiles'], profile=self.profile)
+        return general
+
+    ### Acquisition ####
+    def _start_trigger(self, use_hw_trigger: bool):
+        if self.trigger and use_hw_trigger:
+            self.trigger.fps = self.general['fps']
+            Timer(0.5, self.trigger.start_trigger).start()  # make sure the cameras are ready
+
+    def start_recording(self):
+        self.files_copied = False
+        self.stop_event = Event()
+        self.basler_recorder.fps = self.general['fps']
+        self.basler_recorder.codec = self.general['codec']
+        self.basler_recorder.crf = self.general['crf']
+        self.basler_recorder.snapshot_settings(self.session_id, self.general_settings())
+        self.basler_recorder.run_multi_cam_record(self.stop_event, filename=self.session_id,
+                                                  use_hw_trigger=self.general['HW_trigg'],
+                                                  camera_settings=self.basler_recorder.snapshot_cameras)
+        self.start_uploader()
+        self._start_trigger(self.general['HW_trigg'])
+
+    def start_viewing(self):
+        self.stop_event = Event()
+        self.basler_recorder.fps = self.general['fps']
+        self.basler_recorder.run_multi_cam_show(self.stop_event, self.general['HW_trigg'])
+        self._start_trigger(self.general['HW_trigg'])
+
+    def start_recording_calib(self):
+        self.general['HW_trigg'] = True
+        self.log.info(f'Started Calibration sequence..\nwaiting for {CALIB_WAIT}ms to start recording')
+        self.calib_timers = [Timer(CALIB_WAIT / 1000, self.start_recording),
+                             Timer((CALIB_DURATION + CALIB_WAIT) / 1000, self.stop_cams)]
+        for timer in self.calib_timers:
+            timer.start()
+
+    def stop_cams(self):
+        for timer in self.calib_timers:
+            timer.cancel()
+        self.calib_timers = []
+        if self.trigger and self.trigger.is_pulsing:
+            self.trigger.stop_trigger()
+            time.sleep(0.5)  # make sure the trigger stopped
+        if self.stop_event:
+            self.stop_event.set()
+        if self.basler_recorder.is_recording:
+            self.basler_recorder.stop_multi_cam_record()
+            if self.uploader:
+                self.uploader.stop_event.set()  # joined before the final copy
+        elif self.basler_recorder.is_viewing:
+            self.basler_recorder.stop_multi_cam_show()
+
+    def _drain_previews(self):
+        """keeps the preview queues from overflowing, the newest frames go to the preview stream if requested"""
+        if self.basler_recorder.multi_view_queue is None:
+            return
+        for cam_id in range(len(self.basler_recorder.multi_view_queue)):
+            frame = self.basler_recorder.take_preview(cam_id)
+            if frame is not None:
+                self.preview_streamer.offer(cam_id, frame)
+
+    def trigger_line_received(self, line: bytes):
+        if line.decode(errors='replace').startswith('PONG'):
+            self.log.info('Trigger responded to ping')
+
+    ### Remote control ####
+    def current_status(self) -> dict:
+        cameras = self.basler_recorder.get_camera_status()
+        if self.basler_recorder.is_recording:
+            return SocketMessage.with_cameras(SocketMessage.status_recording, cameras)
+        elif self.basler_recorder.is_viewing:
+            return SocketMessage.with_cameras(SocketMessage.status_viewing, cameras)
+        return SocketMessage.status_ready
+
+    def read_message(self) -> (dict, None):
+        """next message, waits up to 0.1 s"""
+        if isinstance(self.socket_comm, RemoteServer):
+            return self.socket_comm.read_json_message_fast_linebreak(timeout=0.1)
+        return self.socket_comm.read_json_message_fast_linebreak()  # waits up to the socket timeout
+
+    def handle_message(self, message: dict):
+        """same protocol as the GUI in remote mode"""
+        if message['type'] in (MessageType.start_video_rec.value, MessageType.start_video_view.value,
+                               MessageType.start_video_calibrec.value):
+            if self.basler_recorder.is_recording or self.basler_recorder.is_viewing:
+                self.socket_comm.send_json_message(SocketMessage.status_error)
+                self.log.info("got message to start, but something is already running!")
+                return
+            try:
+                if message["setting_file"] and self.restore_snapshot(message["setting_file"]):
+                    self.log.debug(f"restored settings snapshot {message['setting_file']}")
+                elif message["setting_file"]:
+                    self.load_settings(message["setting_file"])
+            except (FileNotFoundError, KeyError):
+                self.log.error("passed settings file not found")
+            if message.get("profile", None) is not None:
+                self.select_profile(message["profile"])
+            self.session_id = message["session_id"]
+            self.session_path = message.get("session_path", None)
+            if message.get("frame_rate", None):
+                self.general['fps'] = message["frame_rate"]
+
+            if message['type'] == MessageType.start_video_rec.value:
+                self.log.info("got message to start recording")
+                self.start_recording()
+                self.socket_comm.send_json_message(SocketMessage.respond_recording)
+                self.socket_comm.push_status(self.current_status())
+            elif message['type'] == MessageType.start_video_view.value:
+                self.log.info("got message to start viewing")
+                self.start_viewing()
+                self.socket_comm.send_json_message(SocketMessage.respond_viewing)
+                self.socket_comm.push_status(self.current_status())
+            else:
+                self.log.info("got message to start calibration_rec")
+                self.start_recording_calib()
+                self.socket_comm.send_json_message(SocketMessage.respond_calib)
+
+        elif message['type'] == MessageType.stop_video.value:
+            self.log.info("got message to stop")
+            self.stop_cams()
+            self.socket_comm.send_json_message(SocketMessage.respond_stop)
+            self.socket_comm.push_status(self.current_status())
+
+        elif message['type'] == MessageType.poll_status.value:
+            self.socket_comm.send_json_message(self.current_status())
+
+        elif message['type'] == MessageType.copy_files.value:
+            self.session_path = message['session_path']
+            if self.session_path:
+                self.copy_recorded_file()
+
+        elif message['type'] == MessageType.purge_files.value:
+            self.purge_recorded_file()
+
+        elif message['type'] == MessageType.stream_preview.value:
+            try:
+                settings = self.preview_streamer.configure(message)
+            except ValueError as e:
+                self.log.error(f'invalid stream_preview message: {e}')
+                self.socket_comm.send_json_message(
+                    SocketMessage.respond_stream_fail(str(e), self.preview_streamer.settings))
+                return
+            self.socket_comm.send_json_message(SocketMessage.respond_stream(PREVIEW_STREAM_PORT, settings))
+
+    def _check_acquisition(self):
+        """stops the cameras after an error of the recorder, also while no client is connected"""
+        if not self.basler_recorder.error_event.is_set():
+            return
+        self.log.error('Error in Basler recorder')
+        self.stop_cams()
+        self.basler_recorder.error_event.clear()
+        if self.socket_comm.connected:
+            self.socket_comm.broadcast(SocketMessage.respond_recording_fail)  # not a reply, for all clients
+
+    def wait_for_client(self) -> bool:
+        """
+        Waits for a remote client, a running acquisition goes on meanwhile
+        :return: True if a client connected, False on shutdown
+        """
+        self.socket_comm.threaded_accept_connection()
+        while not self.socket_comm.connected:
+            self._check_acquisition()
+            self._drain_previews()
+            if self.shutdown_event.wait(0.1):
+                self.socket_comm.stop_waiting_for_connection()
+                if getattr(self.socket_comm, 'acception_thread', None) is not None:  # SocketComm
+                    self.socket_comm.acception_thread.join()
+                return False
+        return True
+
+    def serve_client(self):
+        """handles the messages of a connected client until it disconnects or shutdown is requested"""
+        self.socket_comm.send_json_message(SocketMessage.status_ready)
+        while not self.shutdown_event.is_set():
+            self._check_acquisition()
+            self._drain_previews()
+            message = self.read_message()
+            if not message:
+                continue
+            if message['type'] == MessageType.disconnected.value:
+                self.log.info("got message that client disconnected")
+                return
+            self.handle_message(message)
+
+    def run(self):
+        """
+        Accepts remote clients (one after the other without MULTI_CLIENT_REMOTE) until shutdown is requested. As in
+        the remote mode of the GUI, a recording keeps running if the client disconnects (e.g. a network blip or a
+        restart of the controller), it only stops with a stop message or on shutdown
+        """
+        while not self.shutdown_event.is_set():
+            if not self.wait_for_client():
+                break
+            self.serve_client()
+            self.preview_streamer.close()  # nobody is watching, streaming has to be requested again
+            self.socket_comm.close_socket()
+
+    def shutdown(self, *args):
+        self.log.info('Shutting down')
+        self.shutdown_event.set()
+
+    def close(self):
+        self.stop_cams()
+        self.file_transfer.shutdown(wait=True)
+        self.socket_comm.close_socket()
+        self.preview_streamer.close()
+        if self.trigger:
+            self.trigger.close()
+        self.basler_recorder.disconnect_cams()
+
+
+def start_headless(args=None):
+    parser = argparse.ArgumentParser(description=f'FreiPose Recorder v.{VERSION} without GUI, remote controlled')
+    parser.add_argument('--host', type=str, default=HOST, help='address of the remote control server')
+    parser.add_argument('--port', type=int, default=PORT, help='port of the remote control server')
+    parser.add_argument('--trigger_port', type=str, default=None, help='serial port of the trigger, e.g. /dev/ttyACM1')
+    parser.add_argument('--settings', type=str, default=None, help='settings file applied after connecting')
+    args = parser.parse_args(args)
+
+    if LOG2FILE:
+        log_path = Path('logs')
+        log_path.mkdir(exist_ok=True)
+        logging.basicConfig(filename=log_path / f'headless{datetime.datetime.now().strftime("%m%d_%H%M")}.log',
+                            filemode='w', format='%(asctime)s - %(levelname)s - %(message)s')
+    else:
+        logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s')
+
+    recorder = HeadlessRecorder(args.host, args.port, args.trigger_port, args.settings)
+    signal.signal(signal.SIGTERM, recorder.shutdown)
+    signal.signal(signal.SIGINT, recorder.shutdown)
+    if not recorder.setup():
+        return 1
+    try:
+        recorder.run()
+    finally:
+        recorder.close()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(start_headless())
@@ -0,0 +1,205 @@
+"""
+Low resolution proxy videos and contact sheets to quickly check whether a recorded session is usable.
+
+Every camera video is decoded only once, by default only its keyframes (see VideoReaderFast), the downscaled
+frames are written to a proxy video and some of them are kept as thumbnails for the contact sheet of the session.
+Results are cached in a sub folder next to the videos and reused as long as the source video did not change.
+"""
+import argparse
+import json
+import logging
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from FreiPose_Recorder.utils.VideoReaderFast import VideoReaderFast
+
+PROXY_FOLDER = '.proxies'  # cache folder, created next to the videos
+PROXY_VERSION = 2  # bump to invalidate old caches if the format changes
+
+
+class ProxyGenerator:
+    """
+    Creates (and caches) proxy videos and contact sheets for a session folder.
+
+    :param scale: scaling factor of the proxy frames with respect to the source
+    :param step: only every step-th frame of the source ends up in the proxy, with keyframes the minimal distance
+        between the keyframes in the proxy
+    :param sheet_every: frame interval of the thumbnails on the contact sheet, rounded up to a multiple of step
+    :param seek: seek to the frames instead of grabbing through them, only used without keyframes
+    :param keyframes: only decode the keyframes, every other frame of a GOP (250 frames for libx264) is skipped
+        without decoding. False decodes all frames and keeps every step-th
+    :param cache_dir: folder for the cache, defaults to PROXY_FOLDER next to each video
+    """
+    def __init__(self, scale: float = 0.25, step: int = 10, sheet_every: int = 300, seek: bool = False,
+                 keyframes: bool = True, cache_dir: (str, Path, None) = None):
+        self.scale = scale
+        self.step = max(1, int(step))
+        self.sheet_every = max(self.step, int(np.ceil(sheet_every / self.step)) * self.step)
+        self.seek = seek
+        self.keyframes = keyframes
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.log = logging.getLogger('ProxyGenerator')
+        self.log.setLevel(logging.DEBUG)
+
+    def _cache_folder(self, video_path: Path) -> Path:
+        folder = self.cache_dir if self.cache_dir else video_path.parent / PROXY_FOLDER
+        folder.mkdir(parents=True, exist_ok=True)
+        return folder
+
+    def _cache_key(self, video_path: Path) -> dict:
+        """values which have to match for a cache entry to be valid"""
+        stat = video_path.stat()
+        return {'version': PROXY_VERSION, 'source_size': stat.st_size, 'source_mtime': stat.st_mtime,
+                'scale': self.scale, 'step': self.step, 'sheet_every': self.sheet_every, 'keyframes': self.keyframes}
+
+    def make_proxy(self, video_path: (str, Path), force: bool = False) -> dict:
+        """
+        Creates proxy video and thumbnails of a single video in one decoding pass
+        :param video_path: path to the source video
+        :param force: ignore existing cache entries
+        :return: dict with the cache entry (paths to proxy and thumbnails, frame indices of the thumbnails)
+        """
+        video_path = Path(video_path)
+        folder = self._cache_folder(video_path)
+        meta_file = folder / f'{video_path.stem}.proxy.json'
+        key = self._cache_key(video_path)
+
+        if meta_file.exists() and not force:
+            with open(meta_file, 'r') as f:
+                meta = json.load(f)
+            if meta.get('key') == key and Path(meta['proxy']).exists() and Path(meta['thumbs']).exists():
+                self.log.debug(f'Using cached proxy for {video_path.name}')
+                return meta
+
+        start = time.monotonic()
+        reader = VideoReaderFast(video_path, queue_size=32, step=self.step, seek=self.seek, with_index=True,
+                                 keyframes=self.keyframes)
+        n_frames = reader.get_size()
+        fps = reader.get_fps() or 30.0
+        reader.start()
+
+        proxy_path = folder / f'{video_path.stem}_proxy.mp4'
+        writer = None
+        pending = []  # (frame_idx, frame) until the distance of the frames and so the proxy fps is known
+        thumbs, thumb_idx = [], []
+        next_thumb = 0
+        while reader.running():
+            if not reader.more():
+                continue
+            frame_idx, frame = reader.read()
+            small = cv2.resize(frame, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+            if frame_idx >= next_thumb:
+                thumbs.append(small)
+                thumb_idx.append(frame_idx)
+                next_thumb = (frame_idx // self.sheet_every + 1) * self.sheet_every
+            pending.append((frame_idx, small))
+            if writer is None and len(pending) > 1:
+                writer = self._proxy_writer(proxy_path, fps / (pending[1][0] - pending[0][0]), small.shape)
+            if writer is not None:
+                for _, small in pending:
+                    writer.write(small)
+                pending.clear()
+        reader.stop()
+        if pending:  # only a single frame
+            writer = self._proxy_writer(proxy_path, fps / self.step, pending[0][1].shape)
+            writer.write(pending[0][1])
+        if writer is not None:
+            writer.release()
+
+        thumbs_path = folder / f'{video_path.stem}_thumbs.npz'
+        np.savez_compressed(thumbs_path, thumbs=np.array(thumbs), frame_idx=np.array(thumb_idx))
+
+        meta = {'key': key, 'source': video_path.as_posix(), 'proxy': proxy_path.as_posix(),
+                'thumbs': thumbs_path.as_posix(), 'frame_idx': thumb_idx, 'n_frames': n_frames}
+        with open(meta_file, 'w') as f:
+            json.dump(meta, f, indent=4)
+        self.log.info(f'Created proxy for {video_path.name} ({n_frames} frames) in {time.monotonic() - start:0.1f}s')
+        return meta
+
+    @staticmethod
+    def _proxy_writer(proxy_path: Path, fps: float, shape: tuple) -> cv2.VideoWriter:
+        return cv2.VideoWriter(proxy_path.as_posix(), cv2.VideoWriter_fourcc(*'mp4v'), max(fps, 1.0),
+                               (shape[1], shape[0]))
+
+    def make_contact_sheet(self, session_path: (str, Path), pattern: str = '*.mp4', n_cols: int = 10,
+                           force: bool = False) -> (Path, None):
+        """
+        Creates the contact sheet of a session, one row per camera video, one column per thumbnail
+        :param session_path: folder with the videos of the session
+        :param pattern: glob pattern to find the videos
+        :param n_cols: maximal number of thumbnails per camera, evenly picked from all thumbnails
+        :param force: ignore existing cache entries
+        :return: path to the contact sheet image or None if there are no videos
+        """
+        session_path = Path(session_path)
+        videos = sorted(p for p in session_path.glob(pattern) if not p.stem.endswith('_proxy'))
+        if not videos:
+            self.log.info(f'No videos found in {session_path}')
+            return None
+
+        rows = []
+        for video in videos:
+            meta = self.make_proxy(video, force=force)
+            with np.load(meta['thumbs']) as data:
+                thumbs, frame_idx = data['thumbs'], data['frame_idx']
+            if len(thumbs) == 0:
+                continue
+            pick = np.unique(np.linspace(0, len(thumbs) - 1, min(n_cols, len(thumbs))).astype(int))
+            rows.append((video.stem, thumbs[pick], frame_idx[pick]))
+        if not rows:
+            return None
+
+        # all tiles get the size of the first thumbnail, cameras might differ in resolution
+        tile_h, tile_w = rows[0][1].shape[1:3]
+        sheet = np.zeros((tile_h * len(rows), tile_w * n_cols, 3), np.uint8)
+        for r, (name, thumbs, frame_idx) in enumerate(rows):
+            for c, (thumb, idx) in enumerate(zip(thumbs, frame_idx)):
+                if thumb.shape[:2] != (tile_h, tile_w):
+                    thumb = cv2.resize(thumb, (tile_w, tile_h), interpolation=cv2.INTER_AREA)
+                if thumb.ndim == 2:
+                    thumb = np.stack([thumb] * 3, -1)
+                sheet[r * tile_h:(r + 1) * tile_h, c * tile_w:(c + 1) * tile_w] = thumb
+                cv2.putText(sheet, f'{idx}', (c * tile_w + 4, (r + 1) * tile_h - 6),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
+            cv2.putText(sheet, name, (4, r * tile_h + 14), cv2.FONT_HERSHEY_SIMPLEX, 0.45, (0, 255, 255), 1)
+
+        sheet_path = self._cache_folder(videos[0]) / 'contact_sheet.jpg'
+        cv2.imwrite(sheet_path.as_posix(), sheet)
+        self.log.info(f'Contact sheet saved to {sheet_path}')
+        return sheet_path
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Create proxy videos and a contact sheet for a session')
+    parser.add_argument('session_path', type=str, help='folder containing the videos of the session')
+    parser.add_argument('--scale', type=float, default=0.25, help='scaling factor of the proxies')
+    parser.add_argument('--step', type=int, default=10, help='keep every n-th frame in the proxies')
+    parser.add_argument('--sheet_every', type=int, default=300, help='frame interval on the contact sheet')
+    parser.add_argument('--seek', action='store_true', help='seek instead of grabbing, only with --all_frames')
+    parser.add_argument('--all_frames', action='store_true', help='decode all frames instead of keyframes only')
+    parser.add_argument('--force', action='store_true', help='ignore cached proxies')
+    parser.add_argument('--bench', action='store_true', help='compare against full decoding of the first video')
+    args = parser.parse_args()
+
+    generator = ProxyGenerator(scale=args.scale, step=args.step, sheet_every=args.sheet_every, seek=args.seek,
+                               keyframes=not args.all_frames)
+    t0 = time.monotonic()
+    generator.make_contact_sheet(args.session_path, force=args.force)
+    print(f'contact sheet took {time.monotonic() - t0:0.2f}s')
+
+    if args.bench:
+        video = sorted(p for p in Path(args.session_path).glob('*.mp4'))[0]
+        for step, seek, keyframes in ((1, False, False), (args.step, False, False), (args.step, True, False),
+                                      (args.step, False, True)):
+            t0 = time.monotonic()
+            reader = VideoReaderFast(video, step=step, seek=seek, keyframes=keyframes).start()
+            n = 0
+            while reader.running():
+                if reader.more():
+                    reader.read()
+                    n += 1
+            print(f'step={step} seek={seek} keyframes={keyframes}: {n} frames in {time.monotonic() - t0:0.2f}s')
@@ -1,21 +1,58 @@
 # import the necessary packages
 from threading import Thread
+import re
+import shutil
+import subprocess
 import sys
 import cv2
+import numpy as np
 import time
 
 from queue import Queue
 
+SHOWINFO_PTS = re.compile(r'\bn:\s*\d+\s+pts:\s*-?\d+\s+pts_time:(-?[\d.]+)')  # one line per frame of -vf showinfo
+
 
 
 
 class VideoReaderFast:
-    def __init__(self, path, transform=None, queue_size=128):
+    """
+    Threaded video reader.
+    step > 1 only decodes every step-th frame, the frames in between are skipped with grab() and never
+    converted or copied. With seek=True the reader jumps to the next frame instead, ffmpeg then only decodes
+    from the preceding keyframe on, which is much faster if step is a multiple of the keyframe interval.
+    Both still decode (almost) every frame of a GOP, with keyframes=True only the keyframes are decoded
+    (ffmpeg -skip_frame nokey), step is then the minimal distance between the returned keyframes. This needs the
+    ffmpeg binary, without it the reader falls back to grab().
+    with_index=True puts (frame_idx, frame) tuples into the queue instead of plain frames.
+    """
+    def __init__(self, path, transform=None, queue_size=128, step=1, seek=False, with_index=False,
+                 keyframes=False):
         # initialize the file video stream along with the boolean
         # used to indicate if the thread should be stopped or not
-        self.stream = cv2.VideoCapture(path)
+        self.stream = cv2.VideoCapture(str(path))
         self.stopped = False
         self.transform = transform
+        self.step = max(1, int(step))
+        self.seek = seek
+        self.with_index = with_index
+        self.frame_idx = -1  # index of the last decoded frame
+        self.keyframes = keyframes
+        self._ffmpeg = None  # ffmpeg process decoding the keyframes
+        self._pts_queue = Queue()  # pts_time of the keyframes, parsed from the ffmpeg log
+        self._first_pts = None
+        if keyframes:
+            ffmpeg = shutil.which('ffmpeg')
+            if ffmpeg is None:
+                print("ffmpeg not found, decoding all frames instead of keyframes only")
+                self.keyframes = False
+            else:
+                self._ffmpeg_cmd = [ffmpeg, '-hide_banner', '-nostats', '-skip_frame', 'nokey', '-i', str(path),
+                                    '-map', '0:v:0', '-vsync', 'passthrough', '-vf', 'showinfo',
+                                    '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-']
+                self._frame_shape = (int(self.stream.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                                     int(self.stream.get(cv2.CAP_PROP_FRAME_WIDTH)), 3)
+                self._fps = self.get_fps() or 30.0  # maps the pts of the keyframes to frame indices
 
         # initialize the queue used to store frames read from
         # the video file
@@ -26,9 +63,21 @@ class VideoReaderFast:
 
     def start(self):
         # start a thread to read frames from the file video stream
+        if self.keyframes:
+            self._ffmpeg = subprocess.Popen(self._ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                            stdin=subprocess.DEVNULL)
+            Thread(target=self._read_log, daemon=True).start()
         self.thread.start()
         return self
 
+    def _read_log(self):
+        """collects the pts of the decoded keyframes, the log has to be drained anyway so ffmpeg does not block"""
+        for line in self._ffmpeg.stderr:
+            match = SHOWINFO_PTS.search(line.decode(errors='replace'))
+            if match:
+                self._pts_queue.put(float(match.group(1)))
+        self._pts_queue.put(None)
+
     def update(self):
         # keep looping infinitely
         while True:
@@ -39,8 +88,8 @@ class VideoReaderFast:
 
             # otherwise, ensure the queue has room in it
             if not self.Q.full():
-                # read the next frame from the file
-                (grabbed, frame) = self.stream.read()
+                # read the next frame from the file, skipping frames if requested
+                (grabbed, frame) = self._read_next()
 
                 # if the `grabbed` boolean is `False`, then we have
                 # reached the end of the video file
@@ -64,11 +113,53 @@ class VideoReaderFast:
                     frame = self.transform(frame)
 
                 # add the frame to the queue
-                self.Q.put(frame)
+                if self.with_index:
+                    self.Q.put((self.frame_idx, frame))
+                else:
+                    self.Q.put(frame)
             else:
                 time.sleep(0.1)  # Rest for 10ms, we have a full queue
 
         self.stream.release()
+        if self._ffmpeg is not None:
+            self._ffmpeg.kill()
+            self._ffmpeg.wait()
+
+    def _read_next(self):
+        """reads the next frame to be returned, honouring self.step"""
+        if self.keyframes:
+            return self._read_next_keyframe()
+        target = self.frame_idx + self.step
+        if self.frame_idx < 0:
+            target = 0
+        elif self.seek and self.step > 1:
+            self.stream.set(cv2.CAP_PROP_POS_FRAMES, target)
+        else:
+            for _ in range(self.step - 1):
+                if not self.stream.grab():
+                    return False, None
+        grabbed, frame = self.stream.read()
+        if grabbed:
+            self.frame_idx = target
+        return grabbed, frame
+
+    def _read_next_keyframe(self):
+        """reads the next keyframe which is at least step frames after the last one"""
+        n_bytes = int(np.prod(self._frame_shape))
+        while True:
+            data = self._ffmpeg.stdout.read(n_bytes)
+            if len(data) < n_bytes:
+                return False, None
+            pts = self._pts_queue.get()
+            if pts is None:
+                return False, None
+            if self._first_pts is None:
+                self._first_pts = pts
+            frame_idx = int(round((pts - self._first_pts) * self._fps))
+            if self.frame_idx < 0 or frame_idx >= self.frame_idx + self.step:
+                self.frame_idx = frame_idx
+                # copy, frames from bytes are read only
+                return True, np.frombuffer(data, np.uint8).reshape(self._frame_shape).copy()
 
     def read(self):
         # return next frame in the queue
@@ -97,3 +188,6 @@ class VideoReaderFast:
 
     def get_size(self):
         return int(self.stream.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    def get_fps(self):
+        return self.stream.get(cv2.CAP_PROP_FPS)
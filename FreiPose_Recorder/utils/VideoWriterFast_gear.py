@@ -1,26 +1,77 @@
 # import the necessary packages
 import json
+import os
 from threading import Thread
 import time
-from vidgear.gears import WriteGear
 from queue import Queue
 
+from FreiPose_Recorder.utils.cpu_affinity import pin_thread
+
 class QueueOverflow(Exception):
    """Base class for other exceptions"""
    pass
 
 
+def available_cores() -> int:
+    """cores this process may run on, respects a cpu affinity mask"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def partition_cores(n_writers: int, cpu_count: int = None, reserved: int = 1) -> list:
+    """
+    Divides the cores among the writers, so the encoders do not oversubscribe the machine. Without a limit every
+    ffmpeg process starts a thread pool as large as the machine, with 8 cameras that are 8 times too many threads.
+    :param n_writers: number of writers encoding at the same time
+    :param cpu_count: available cores, defaults to the cores of this process
+    :param reserved: cores kept free for grabbing and conversion
+    :return: encoder threads per writer, at least 1, the first writers get the remaining cores
+    """
+    if n_writers <= 0:
+        return []
+    cpu_count = cpu_count or available_cores()
+    cores = max(cpu_count - reserved, n_writers)
+    return [cores // n_writers + (1 if i < cores % n_writers else 0) for i in range(n_writers)]
+
+
 class VideoWriterFast:
     """
     Utility for faster Video writing with VideoGear.
     Basically runs writing of frames in an separate thread.
+
+    preset, tune, threads and pix_fmt are passed to ffmpeg if set, None keeps the ffmpeg default. preset and tune
+    are codec specific, e.g. libx264 knows preset 'ultrafast'...'veryslow' and tune 'film', 'zerolatency', ...
+
+    Each segment is finalized as soon as it is closed: its frame timestamps are written next to it
+    (<segment>.txt) and on_segment_closed(writer, segment) is called, so a crash only loses the open segment.
     """
-    def __init__(self, video_path, fps, codec="libx264", crf=0, queue_size=512):
+    def __init__(self, video_path, fps, codec="libx264", crf=0, queue_size=512, segment_frames=0,
+                 segment_minutes=0, preset=None, tune=None, threads=None, pix_fmt=None, cores=None,
+                 on_segment_closed=None):
         self.crf = crf
         self.fps = fps
         self.codec = codec
+        self.preset = preset
+        self.tune = tune
+        self.threads = threads  # encoder threads, see partition_cores
+        self.pix_fmt = pix_fmt
+        # vidgear (with cv2) takes a while to import, only when writing and not in the grab thread with the first frame
+        from vidgear.gears import WriteGear
+        self._write_gear = WriteGear
+        self.cores = cores  # pin the writer thread and its ffmpeg process to these cores, None floats
         self.video_path = video_path
 
+        # segmented mode, rolls over to a new file every segment_frames frames or segment_minutes minutes
+        # 0 disables the respective limit, if both are 0 a single file is written to video_path
+        self.segment_frames = int(segment_frames) if segment_frames else 0
+        self.segment_minutes = segment_minutes if segment_minutes else 0
+        self.segments = []  # list of dicts describing the written files
+        self.frame_count = 0  # number of frames written so far
+        self._closing_threads = []  # threads closing finished segments
+        self._rollover_requested = False  # start a new file with the next frame, e.g. after a camera reconnected
+        self.on_segment_closed = on_segment_closed  # called from the closing thread once a segment file is complete
+
         # initialize the file video stream along with the boolean
         # used to indicate if the thread should be stopped or not
         self.stream = None  # this is initialized when we get the first frame
@@ -39,6 +90,10 @@ class VideoWriterFast:
         self.thread = Thread(target=self.update, args=())
         self.thread.daemon = True
 
+    @property
+    def is_segmented(self) -> bool:
+        return bool(self.segment_frames or self.segment_minutes)
+
     def start(self):
         """starts the thread to write frames to the video file"""
         self.started = True
@@ -46,8 +101,83 @@ class VideoWriterFast:
         self.thread.start()
         return self
 
+    def _segment_path(self, seg_id: int) -> str:
+        if not self.is_segmented and seg_id == 0:
+            return self.video_path
+        base, ext = os.path.splitext(self.video_path)
+        return f"{base}_seg{seg_id:03d}{ext}"
+
+    @property
+    def output_params(self) -> dict:
+        """ffmpeg output parameters of this writer"""
+        output_params = {"-input_framerate": self.fps, "-vcodec": self.codec, "-crf": self.crf}
+        for key, value in (("-preset", self.preset), ("-tune", self.tune), ("-threads", self.threads),
+                           ("-pix_fmt", self.pix_fmt)):
+            if value is not None:
+                output_params[key] = value
+        return output_params
+
+    def _open_stream(self):
+        """opens a new WriteGear stream, the first frame of each file is a keyframe"""
+        path = self._segment_path(len(self.segments))
+        #output_params = {"-input_framerate": self.fps, "-vcodec": "h264_nvenc", "-crf": 0}
+        self.stream = self._write_gear(output=path, **self.output_params)
+        '''
+        working codecs h264_nvenc, libx264, mpeg4, mpeg2video, libxvid, libx264rgb
+        
+        '''
+        self.segments.append({'file': os.path.basename(path), 'path': path,
+                              'first_frame': self.frame_count, 'last_frame': None,
+                              'first_ts': None, 'last_ts': None, 'first_mono': None,
+                              'frame_ts': [], 'timestamps': None, 'closed': False})
+
+    def _close_stream(self):
+        """closes the current stream in the background, so frames keep being written to the next segment"""
+        stream, self.stream = self.stream, None
+        closer = Thread(target=self._finish_segment, args=(stream, self.segments[-1]))
+        closer.start()
+        self._closing_threads.append(closer)
+
+    def _finish_segment(self, stream, segment: dict):
+        """closes the stream of a segment, writes its frame timestamps and reports it as complete"""
+        stream.close()
+        if segment['frame_ts']:
+            ts_path = os.path.splitext(segment['path'])[0] + '.txt'
+            with open(ts_path, 'w') as f:
+                json.dump(segment['frame_ts'], f)
+            segment['timestamps'] = os.path.basename(ts_path)
+        segment['closed'] = True
+        if self.on_segment_closed is not None:
+            try:
+                self.on_segment_closed(self, segment)
+            except Exception as e:
+                print("Error in segment closed callback: {}".format(e))
+
+    def request_rollover(self):
+        """the next frame is written to a new segment file, also if the writer is not segmented"""
+        self._rollover_requested = True
+
+    def _needs_rollover(self, frame_mono: float) -> bool:
+        if self.stream is None:
+            return False
+        if self._rollover_requested:
+            self._rollover_requested = False
+            return True
+        if not self.is_segmented:
+            return False
+        segment = self.segments[-1]
+        n_frames = self.frame_count - segment['first_frame']
+        if self.segment_frames and n_frames >= self.segment_frames:
+            return True
+        if self.segment_minutes and frame_mono - segment['first_mono'] >= self.segment_minutes * 60:
+            return True
+        return False
+
     def update(self):
         """"""
+        if self.cores:
+            # before the first frame, ffmpeg is started by this thread and inherits the affinity
+            pin_thread(self.cores, os.path.basename(self.video_path))
         # keep looping infinitely
         while True:
             # if the thread indicator variable is set, stop the
@@ -55,10 +185,15 @@ class VideoWriterFast:
             if self.stopped:
                 break
 
-            # otherwise, ensure the there is something in the queue and the stream was initialized
-            if self.Q.qsize() > 0 and self.stream is not None:
+            # otherwise, ensure the there is something in the queue
+            if self.Q.qsize() > 0:
                 # get the next frame from the queue
-                frame = self.Q.get()
+                frame, frame_time, frame_mono, frame_ts = self.Q.get()
+
+                if self._needs_rollover(frame_mono):
+                    self._close_stream()
+                if self.stream is None:
+                    self._open_stream()
 
                 start = time.time()
                 # write to stream
@@ -67,6 +202,14 @@ class VideoWriterFast:
                 except ValueError as e:
                     self.stopped = True
                     print("Error writing frame to stream: {}".format(e))
+                segment = self.segments[-1]
+                if segment['first_ts'] is None:
+                    segment['first_ts'], segment['first_mono'] = frame_time, frame_mono
+                segment['last_frame'], segment['last_ts'] = self.frame_count, frame_time
+                if frame_ts is not None:
+                    segment['frame_ts'].append(frame_ts)
+                self.frame_count += 1
+
                 if self.write_speed is None:
                     self.write_speed = time.time() - start
                 else:
@@ -75,28 +218,23 @@ class VideoWriterFast:
             else:
                 time.sleep(0.001)  # Rest for 1ms, we have an empty queue
 
-        self.stream.close()
+        if self.stream is not None:
+            stream, self.stream = self.stream, None
+            self._finish_segment(stream, self.segments[-1])
+        for closer in self._closing_threads:
+            closer.join()
 
     def feed(self, frame):
-        if self.stream is None:
-            output_params = {"-input_framerate": self.fps, "-vcodec": self.codec, "-crf": self.crf}
-            #output_params = {"-input_framerate": self.fps, "-vcodec": "h264_nvenc", "-crf": 0}
-            #output_params = {"-vcodec": "libx264", "-crf": 0, "-preset": "fast"}
-            self.stream = WriteGear(output=self.video_path, **output_params)
-            '''
-            working codecs h264_nvenc, libx264, mpeg4, mpeg2video, libxvid, libx264rgb
-            
-            '''
         if not self.started:
             self.start()
 
         if not self.Q.full():
-            # add the frame to the queue
+            # add the frame to the queue, together with the host time for the segment bookkeeping
             if isinstance(frame, (list, tuple)):
                 self.frame_ts.append(frame[1:])
-                return self.Q.put(frame[0])
+                return self.Q.put((frame[0], time.time(), time.monotonic(), frame[1:]))
             else:
-                return self.Q.put(frame)
+                return self.Q.put((frame, time.time(), time.monotonic(), None))
         else:
             raise QueueOverflow
 
@@ -125,9 +263,22 @@ class VideoWriterFast:
         # wait until stream resources are released (producer thread might be still grabbing frame)
         if self.started:
             self.thread.join()
-        if self.frame_ts:
-            with open(self.video_path.replace('.mp4', '.txt'), 'w') as f:
-                json.dump(self.frame_ts, f)
+        # the frame timestamps are written per segment when it is closed, see _finish_segment
+
+    def get_files(self) -> list:
+        """returns the paths of all video files written by this writer"""
+        if not self.segments and not self.is_segmented:
+            return [self.video_path]
+        return [segment['path'] for segment in self.segments]
+
+    def get_manifest(self) -> list:
+        """
+        returns the segments with their first/last frame index, first/last frame time (epoch seconds), the file of
+        their frame timestamps and whether the segment file is complete
+        """
+        return [{key: segment[key] for key in ('file', 'first_frame', 'last_frame', 'first_ts', 'last_ts',
+                                               'timestamps', 'closed')}
+                for segment in list(self.segments)]
 
     def get_state(self):
         state = f'Queue {self.Q.qsize()}/{self.queue_size};'
@@ -138,12 +289,50 @@ class VideoWriterFast:
         return state
 
 
+def benchmark_partitioning(n_writers: int, n_frames: int = 120, width: int = 1280, height: int = 1024,
+                           codec: str = "libx264", preset: str = "veryfast", cpu_count: int = None) -> dict:
+    """
+    Encodes the same frames with n_writers writers at once, once with the ffmpeg default thread pools and once with
+    the cores partitioned among the writers
+    :return: aggregate frames/s (all writers together) for 'default' and 'partitioned'
+    """
+    import tempfile
+    import numpy as np
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 255, (height, width, 3), dtype=np.uint8) for _ in range(8)]
+    result = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for mode, threads in (('default', [None] * n_writers),
+                              ('partitioned', partition_cores(n_writers, cpu_count, reserved=0))):
+            writers = [VideoWriterFast(os.path.join(folder, f'{mode}_{i}.mp4'), fps=30, codec=codec, crf=23,
+                                       queue_size=n_frames + 1, preset=preset, threads=threads[i])
+                       for i in range(n_writers)]
+            start = time.perf_counter()
+            for i in range(n_frames):
+                for writer in writers:
+                    writer.feed(frames[i % len(frames)])
+            for writer in writers:
+                writer.wait_to_finish()
+                writer.stop()
+            result[mode] = n_writers * n_frames / (time.perf_counter() - start)
+    return result
+
+
 if __name__ == '__main__':
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        # python -m FreiPose_Recorder.utils.VideoWriterFast_gear benchmark [n_writers]
+        n = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+        print(f'{available_cores()} cores, {n} writers, threads per writer {partition_cores(n, reserved=0)}')
+        for mode, fps in benchmark_partitioning(n).items():
+            print(f'{mode:>12s}: {fps:6.1f} frames/s in total')
+        sys.exit(0)
+
     NUM_FRAMES = 30*4
 
     # 1. TIME FAST VERSION
     import numpy as np
-    writer = VideoWriterFast('./test.avi', fps=30)
+    writer = VideoWriterFast('./test.mp4', fps=30, segment_frames=NUM_FRAMES // 3)
     start = time.time()
     writer.start()
     for _ in range(NUM_FRAMES):
@@ -155,4 +344,5 @@ if __name__ == '__main__':
     print('Not active anymore')
     print('time passed', time.time() - start)
     writer.stop()
+    print('segments', writer.get_manifest())
     print('finished')
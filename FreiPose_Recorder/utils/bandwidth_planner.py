@@ -0,0 +1,222 @@
+"""
+Estimates whether a rig configuration can be recorded without dropping frames.
+
+For every camera the link bandwidth (frame size, pixel format, fps), the cost of the conversion to RGB8, the encoder
+load (from measured encoder profiles of this machine if available) and the disk write rate are estimated and compared
+against the limits of link, CPU and disk. Works with the connected cameras of a Recorder or offline with a settings
+file:
+
+    python -m FreiPose_Recorder.utils.bandwidth_planner my.settings.json --fps 100
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+from FreiPose_Recorder.configs.params import ENCODER_PROFILE_FILE, DISK_WRITE_RATE
+from FreiPose_Recorder.core.SettingsStore import apply_profile
+from FreiPose_Recorder.utils.encoder_profiler import load_encoder_profiles
+
+# bytes per pixel on the link for the usual pylon pixel formats
+PIXEL_BYTES = {'Mono8': 1.0, 'Mono10p': 1.25, 'Mono12p': 1.5, 'Mono10': 2.0, 'Mono12': 2.0,
+               'BayerRG8': 1.0, 'BayerBG8': 1.0, 'BayerGR8': 1.0, 'BayerGB8': 1.0,
+               'BayerRG12p': 1.5, 'BayerBG12p': 1.5, 'BayerRG12': 2.0, 'BayerBG12': 2.0,
+               'YCbCr422_8': 2.0, 'YUV422_8': 2.0, 'YUV422_8_UYVY': 2.0, 'RGB8': 3.0, 'BGR8': 3.0}
+# usable payload of a single link in bytes/s
+LINK_RATES = {'gige': 115e6, 'usb': 360e6, 'unknown': 115e6}
+# conservative encoder throughput in frames/s for a 1 MP RGB frame on a single core, used if the codec was not
+# profiled on this machine (see the encoder profiles)
+DEFAULT_ENCODER_FPS = {'libx264': 40.0, 'libx264rgb': 30.0, 'h264_nvenc': 300.0, 'mpeg4': 150.0,
+                       'mpeg2video': 200.0, 'libxvid': 120.0, 'divx': 120.0}
+HEADROOM = 1.2  # required reserve of all rates
+
+
+class BandwidthPlanner:
+    """
+    Estimates link, conversion, encoder and disk load of a rig.
+
+    :param encoder_profiles: path to the measured encoder profiles, codec -> {'fps': frames/s on one core,
+        'pixels': frame size}
+    :param disk_rate: sustained write rate of the recording disk in bytes/s
+    :param cpu_count: number of cores available for conversion and encoding, defaults to all cores
+    """
+    def __init__(self, encoder_profiles: (str, Path) = ENCODER_PROFILE_FILE, disk_rate: float = DISK_WRITE_RATE,
+                 cpu_count: int = None):
+        self.encoder_profiles = load_encoder_profiles(encoder_profiles) if encoder_profiles else {}
+        self.disk_rate = disk_rate
+        self.cpu_count = cpu_count or os.cpu_count() or 1
+        self._conversion_cache = {}  # (width, height, pixel format) -> seconds per frame
+        self.log = logging.getLogger('BandwidthPlanner')
+        self.log.setLevel(logging.DEBUG)
+
+    def encoder_fps(self, codec: str, pixels: int) -> (float, bool):
+        """
+        Encoder throughput on a single core for frames of the given size
+        :return: frames/s and whether the value was measured on this machine
+        """
+        profile = self.encoder_profiles.get(codec, None)
+        if profile:
+            # encoding time scales roughly linearly with the number of pixels
+            return profile['fps'] * profile['pixels'] / pixels, True
+        return DEFAULT_ENCODER_FPS.get(codec, 30.0) * 1e6 / pixels, False
+
+    def conversion_time(self, width: int, height: int, pixel_format: str) -> float:
+        """time in s to convert one frame to RGB8, measured once per frame size with OpenCV as stand in for pylon"""
+        key = (width, height, pixel_format)
+        if key not in self._conversion_cache:
+            if pixel_format in ('RGB8', 'BGR8'):
+                self._conversion_cache[key] = 0.0
+            else:
+                self._conversion_cache[key] = self._measure_conversion(width, height, pixel_format)
+        return self._conversion_cache[key]
+
+    @staticmethod
+    def _measure_conversion(width: int, height: int, pixel_format: str, repeats: int = 5) -> float:
+        try:
+            import cv2
+        except ImportError:
+            return width * height * 2e-9  # about 2 ns per pixel for a demosaicing pass
+        frame = np.random.randint(0, 255, (height, width), np.uint8)
+        code = cv2.COLOR_BayerRG2RGB if pixel_format.startswith('Bayer') else cv2.COLOR_GRAY2RGB
+        cv2.cvtColor(frame, code)  # warm up
+        start = time.perf_counter()
+        for _ in range(repeats):
+            cv2.cvtColor(frame, code)
+        return (time.perf_counter() - start) / repeats
+
+    @staticmethod
+    def output_rate(pixels: int, fps: float, codec: str, crf: int) -> float:
+        """
+        Rough size of the encoded stream in bytes/s. Rule of thumb for x264 like encoders: ~0.1 bit per pixel at
+        crf 23, the size doubles every 6 crf steps. crf 0 is lossless, about half of the raw RGB data.
+        """
+        if crf <= 0:
+            bits_per_pixel = 12.0
+        else:
+            bits_per_pixel = min(0.1 * 2 ** ((23 - crf) / 6.0), 12.0)
+        if codec in ('mpeg4', 'mpeg2video', 'libxvid', 'divx'):
+            bits_per_pixel *= 2  # older codecs need roughly twice the bitrate
+        return pixels * fps * bits_per_pixel / 8
+
+    def plan_camera(self, name: str, width: int, height: int, pixel_format: str, fps: float, codec: str, crf: int,
+                    link: str = 'unknown') -> dict:
+        """estimates of a single camera, rates in bytes/s, cpu in cores"""
+        pixels = width * height
+        enc_fps, measured = self.encoder_fps(codec, pixels)
+        conversion = self.conversion_time(width, height, pixel_format)
+        return {'name': name, 'size': (width, height), 'pixel_format': pixel_format, 'link': link,
+                'link_rate': pixels * PIXEL_BYTES.get(pixel_format, 3.0) * fps,
+                'link_limit': LINK_RATES.get(link, LINK_RATES['unknown']),
+                'conversion_cpu': conversion * fps,
+                'encoder_fps': enc_fps, 'encoder_profiled': measured, 'encoder_cpu': fps / enc_fps,
+                'disk_rate': self.output_rate(pixels, fps, codec, crf)}
+
+    def plan(self, cameras: list, fps: float, codec: str, crf: int) -> dict:
+        """
+        :param cameras: list of dicts with name, width, height, pixel_format and optional link ('gige' or 'usb')
+        :param fps: recording frame rate
+        :param codec: encoder of the writers
+        :param crf: constant rate factor of the writers
+        :return: dict with the per camera estimates, totals and warnings
+        """
+        plans = [self.plan_camera(cam['name'], cam['width'], cam['height'], cam['pixel_format'], fps, codec, crf,
+                                  cam.get('link', 'unknown')) for cam in cameras]
+        warnings = []
+        for p in plans:
+            if p['link_rate'] * HEADROOM > p['link_limit']:
+                warnings.append(f"{p['name']}: link needs {p['link_rate'] / 1e6:0.0f} MB/s, "
+                                f"{p['link']} link carries about {p['link_limit'] / 1e6:0.0f} MB/s")
+            if p['encoder_fps'] * self.cpu_count < fps * HEADROOM:
+                warnings.append(f"{p['name']}: {codec} encodes about {p['encoder_fps'] * self.cpu_count:0.0f} FPS "
+                                f"at {p['size'][0]}x{p['size'][1]} using all cores, {fps} FPS requested")
+        usb_rate = sum(p['link_rate'] for p in plans if p['link'] == 'usb')
+        if usb_rate * HEADROOM > LINK_RATES['usb']:
+            warnings.append(f'USB cameras together need {usb_rate / 1e6:0.0f} MB/s, more than a single USB3 '
+                            f'controller carries ({LINK_RATES["usb"] / 1e6:0.0f} MB/s)')
+        total = {'link_rate': sum(p['link_rate'] for p in plans),
+                 'cpu': sum(p['conversion_cpu'] + p['encoder_cpu'] for p in plans),
+                 'disk_rate': sum(p['disk_rate'] for p in plans)}
+        if total['cpu'] * HEADROOM > self.cpu_count:
+            warnings.append(f"Conversion and encoding need about {total['cpu']:0.1f} cores, "
+                            f"{self.cpu_count} available")
+        if self.disk_rate and total['disk_rate'] * HEADROOM > self.disk_rate:
+            warnings.append(f"Writing {total['disk_rate'] / 1e6:0.0f} MB/s, disk sustains about "
+                            f"{self.disk_rate / 1e6:0.0f} MB/s")
+        if not all(p['encoder_profiled'] for p in plans):
+            warnings.append(f'{codec} was not profiled on this machine, encoder estimates are rough defaults')
+        return {'fps': fps, 'codec': codec, 'crf': crf, 'cameras': plans, 'total': total, 'warnings': warnings}
+
+    @staticmethod
+    def cameras_from_settings(cam_lib: dict, default_size: tuple = (1920, 1200), link: str = 'unknown') -> list:
+        """
+        Camera list from the content of a settings file or snapshot, the frame size is taken from the roi if present
+        """
+        cameras = []
+        for name, settings in cam_lib.items():
+            if not isinstance(settings, dict) or name == 'profiles' or 'color_mode' not in settings:
+                continue
+            roi = settings.get('roi', None)
+            width, height = (roi[0], roi[1]) if isinstance(roi, (list, tuple)) else default_size
+            binning = settings.get('binning', [1, 1])
+            if roi is None or isinstance(roi, str):
+                width, height = width // binning[0], height // binning[1]
+            cameras.append({'name': name, 'width': int(width), 'height': int(height),
+                            'pixel_format': settings['color_mode'], 'link': link})
+        return cameras
+
+    @staticmethod
+    def cameras_from_recorder(recorder) -> list:
+        """camera list of the connected cameras of a Recorder"""
+        cameras = []
+        for cam in recorder.cam_array:
+            device_class = cam.DeviceInfo.GetDeviceClass().lower()
+            link = 'gige' if 'gige' in device_class else 'usb' if 'usb' in device_class else 'unknown'
+            cameras.append({'name': cam.DeviceInfo.GetUserDefinedName(), 'width': cam.Width.GetValue(),
+                            'height': cam.Height.GetValue(), 'pixel_format': cam.PixelFormat.GetValue(),
+                            'link': link})
+        return cameras
+
+    @staticmethod
+    def format_report(plan: dict) -> str:
+        lines = [f"{plan['fps']} FPS, codec {plan['codec']}, crf {plan['crf']}"]
+        for p in plan['cameras']:
+            lines.append(f"  {p['name']:>10s} {p['size'][0]}x{p['size'][1]} {p['pixel_format']:<10s} "
+                         f"link {p['link_rate'] / 1e6:6.1f} MB/s  conversion {p['conversion_cpu']:4.2f} cores  "
+                         f"encoder {p['encoder_fps']:6.0f} FPS{'' if p['encoder_profiled'] else '*'}  "
+                         f"disk {p['disk_rate'] / 1e6:5.1f} MB/s")
+        total = plan['total']
+        lines.append(f"  total link {total['link_rate'] / 1e6:0.1f} MB/s, cpu {total['cpu']:0.1f} cores, "
+                     f"disk {total['disk_rate'] / 1e6:0.1f} MB/s")
+        lines += [f'  WARNING {warning}' for warning in plan['warnings']]
+        return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Estimate bandwidth and load of a recording from a settings file')
+    parser.add_argument('settings_file', type=str, help='settings file or snapshot')
+    parser.add_argument('--fps', type=float, default=None, help='recording fps, defaults to the file')
+    parser.add_argument('--codec', type=str, default=None, help='codec, defaults to the file')
+    parser.add_argument('--crf', type=int, default=None, help='crf, defaults to the file')
+    parser.add_argument('--size', type=str, default='1920x1200', help='sensor size of cameras without roi')
+    parser.add_argument('--link', type=str, default='unknown', choices=list(LINK_RATES), help='camera link')
+    parser.add_argument('--profile', type=str, default=None, help='recording profile of the settings file')
+    args = parser.parse_args()
+
+    with open(args.settings_file, 'r') as f:
+        content = json.load(f)
+    if 'cameras' in content and 'general' in content:  # snapshot
+        cam_lib, general = content['cameras'], content['general']
+    else:
+        cam_lib, general = content, content
+    cam_lib = apply_profile({**cam_lib, 'profiles': general.get('profiles', {}),
+                             'profile': general.get('profile', None)}, args.profile)
+    size = tuple(int(v) for v in args.size.split('x'))
+    planner = BandwidthPlanner()
+    plan = planner.plan(BandwidthPlanner.cameras_from_settings(cam_lib, size, args.link),
+                        args.fps or general.get('fps', 30), args.codec or general.get('codec', 'libx264'),
+                        args.crf if args.crf is not None else general.get('crf', 23))
+    print(BandwidthPlanner.format_report(plan))
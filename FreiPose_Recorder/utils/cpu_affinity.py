@@ -0,0 +1,141 @@
+"""
+Pins the grab and encoder workers to fixed cores (Linux only).
+
+Under load the scheduler migrates the grab thread between cores, which shows up as skipped frames. With PIN_CORES the
+grab thread runs on GRAB_CORES with a raised priority (negative nice values need CAP_SYS_NICE, otherwise the default
+priority is kept) and every camera writer gets its own set of the remaining cores. The writer thread pins itself
+before it starts ffmpeg, the ffmpeg process inherits the affinity of the thread which spawned it.
+"""
+import logging
+import os
+import threading
+
+log = logging.getLogger('CpuAffinity')
+log.setLevel(logging.DEBUG)
+
+
+def affinity_supported() -> bool:
+    return hasattr(os, 'sched_setaffinity')
+
+
+def available_cpus() -> list:
+    """ids of the cores this process may run on"""
+    if affinity_supported():
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def plan_affinity(n_writers: int, grab_cores: list, cpus: list = None) -> dict:
+    """
+    Assigns cores to the grab thread and the writers
+    :param n_writers: number of camera writers
+    :param grab_cores: cores of the grab thread, the other cores are divided among the writers
+    :param cpus: available cores, defaults to the cores of this process
+    :return: dict with 'grab' (cores) and 'writers' (list of cores per writer), writers share cores if there are
+             fewer cores than writers
+    """
+    cpus = available_cpus() if cpus is None else list(cpus)
+    grab = [core for core in grab_cores if core in cpus] or cpus[:1]
+    rest = [core for core in cpus if core not in grab] or cpus
+    if n_writers <= 0:
+        return {'grab': grab, 'writers': []}
+    if len(rest) < n_writers:
+        return {'grab': grab, 'writers': [[rest[i % len(rest)]] for i in range(n_writers)]}
+    # contiguous blocks, the first writers get the remaining cores
+    writers, start = [], 0
+    for i in range(n_writers):
+        size = len(rest) // n_writers + (1 if i < len(rest) % n_writers else 0)
+        writers.append(rest[start:start + size])
+        start += size
+    return {'grab': grab, 'writers': writers}
+
+
+def pin_thread(cores: list, name: str = '') -> bool:
+    """
+    Restricts the calling thread (and processes it starts later) to the cores
+    :return: True if the affinity was set
+    """
+    if not affinity_supported() or not cores:
+        return False
+    try:
+        os.sched_setaffinity(threading.get_native_id(), set(cores))
+    except OSError as e:
+        log.warning(f'Could not pin {name or "thread"} to cores {cores}: {e}')
+        return False
+    return True
+
+
+def raise_priority(nice: int, name: str = '') -> bool:
+    """
+    Sets the nice value of the calling thread, negative values need CAP_SYS_NICE
+    :return: True if the priority was changed
+    """
+    if not hasattr(os, 'setpriority') or nice is None:
+        return False
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), nice)
+    except (OSError, PermissionError) as e:
+        log.info(f'Could not set the nice value of {name or "thread"} to {nice} ({e}), keeping the default priority')
+        return False
+    return True
+
+
+def child_processes(name: str = 'ffmpeg', pid: int = None) -> list:
+    """pids of the child processes with the given command name, read from /proc"""
+    pid = pid or os.getpid()
+    children = []
+    try:
+        entries = os.listdir('/proc')
+    except OSError:
+        return children
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'r') as f:
+                stat = f.read()
+        except OSError:
+            continue  # process exited meanwhile
+        # the command is in parentheses and may contain spaces, the parent pid is the second field after it
+        command = stat[stat.find('(') + 1:stat.rfind(')')]
+        fields = stat[stat.rfind(')') + 2:].split()
+        if int(fields[1]) == pid and command == name:
+            children.append(int(entry))
+    return sorted(children)
+
+
+def process_affinity(pid: int) -> list:
+    """cores of a process or thread, empty if it does not exist anymore"""
+    try:
+        return sorted(os.sched_getaffinity(pid))
+    except (OSError, AttributeError):
+        return []
+
+
+def format_layout(layout: dict, names: list = None, nice: int = None) -> str:
+    names = names or [f'writer {i}' for i in range(len(layout['writers']))]
+    lines = [f"grab thread: cores {layout['grab']}" + (f', nice {nice}' if nice is not None else '')]
+    for name, cores in zip(names, layout['writers']):
+        lines.append(f'{name} encoder: cores {cores}')
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import subprocess
+    import time
+    logging.basicConfig(level=logging.DEBUG)
+    cpus = available_cpus()
+    layout = plan_affinity(4, [cpus[0]])
+    print(format_layout(layout, nice=-10))
+
+    def writer(cores):
+        pin_thread(cores, 'writer')
+        subprocess.run(['sleep', '0.5'])
+
+    threads = [threading.Thread(target=writer, args=(cores,)) for cores in layout['writers']]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.2)
+    print('sleep processes:', {pid: process_affinity(pid) for pid in child_processes('sleep')})
+    for thread in threads:
+        thread.join()
@@ -0,0 +1,204 @@
+"""
+Measures which codecs this machine can sustain and picks the cheapest one for a recording.
+
+The profiling command encodes synthetic frames (noise on a moving gradient, so they do not compress trivially) with
+every available codec of codec_to_try for each resolution and crf and stores the achieved frames/s and the used CPU
+time in ENCODER_PROFILE_FILE. The bandwidth planner and Recorder (codec 'auto') use this cache.
+
+    python -m FreiPose_Recorder.utils.encoder_profiler --sizes 1920x1200,960x600 --crf 17,23
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from FreiPose_Recorder.configs.params import ENCODER_PROFILE_FILE, codec_to_try
+
+AUTO_CODEC = 'auto'  # codec name which lets the Recorder choose from the profiles
+HEADROOM = 1.2  # required reserve of the cpu when choosing a codec
+
+
+def machine_id() -> str:
+    """profiles are only valid on the machine they were measured on"""
+    return f'{platform.node()}/{platform.machine()}/{os.cpu_count()}'
+
+
+def load_encoder_profiles(path: (str, Path) = ENCODER_PROFILE_FILE) -> dict:
+    """
+    :return: codec -> profile, empty if there is no cache or it was measured on another machine
+    """
+    path = Path(path)
+    if not path.exists():
+        return {}
+    with open(path, 'r') as f:
+        profiles = json.load(f)
+    if profiles.get('_machine', None) != machine_id():
+        logging.getLogger('EncoderProfiler').warning(f'{path} was measured on {profiles.get("_machine")}, ignored')
+        return {}
+    return {codec: profile for codec, profile in profiles.items() if not codec.startswith('_')}
+
+
+def synthetic_frames(width: int, height: int, n: int = 16) -> list:
+    """frames with noise on a horizontally moving gradient, a rough stand in for camera images"""
+    rng = np.random.default_rng(0)
+    gradient = np.tile(np.linspace(0, 200, width, dtype=np.float32), (height, 1))
+    frames = []
+    for i in range(n):
+        base = np.roll(gradient, i * width // n, axis=1)
+        noise = rng.normal(0, 8, (height, width)).astype(np.float32)
+        gray = np.clip(base + noise, 0, 255).astype(np.uint8)
+        frames.append(np.stack([gray, np.roll(gray, 3, axis=0), np.roll(gray, 3, axis=1)], -1))
+    return frames
+
+
+def _cpu_time() -> float:
+    """
+    user + system time of this process and of finished child processes (the ffmpeg encoders). resource is POSIX
+    only, elsewhere only the time of this process is counted
+    """
+    try:
+        import resource
+    except ImportError:
+        return time.process_time()
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+class EncoderProfiler:
+    """
+    Encodes synthetic frames and measures frames/s and cpu time per codec, resolution and crf.
+
+    :param n_frames: number of frames encoded per measurement
+    :param output_dir: folder for the temporary videos
+    """
+    def __init__(self, n_frames: int = 150, output_dir: (str, Path, None) = None):
+        self.n_frames = n_frames
+        self.output_dir = Path(output_dir) if output_dir else Path(tempfile.gettempdir())
+        from vidgear.gears.helper import get_valid_ffmpeg_path  # slow import, only needed for profiling
+        self.ffmpeg = get_valid_ffmpeg_path()
+        self.log = logging.getLogger('EncoderProfiler')
+        self.log.setLevel(logging.DEBUG)
+
+    def available_codecs(self, codecs: list = codec_to_try) -> list:
+        """codecs of the list which the ffmpeg of this machine supports"""
+        if not self.ffmpeg:
+            return []
+        from vidgear.gears.helper import get_supported_vencoders
+        supported = get_supported_vencoders(self.ffmpeg)
+        return [codec for codec in codecs if codec in supported]
+
+    def measure(self, codec: str, width: int, height: int, crf: int) -> dict:
+        """
+        Encodes n_frames synthetic frames
+        :return: dict with frames/s (wall clock), cpu cores used and frames/s per core
+        """
+        from vidgear.gears import WriteGear
+        frames = synthetic_frames(width, height)
+        path = (self.output_dir / f'encoder_profile_{codec}_{width}x{height}.mp4').as_posix()
+        writer = WriteGear(output=path, logging=False, **{'-vcodec': codec, '-crf': crf, '-input_framerate': 30})
+        cpu_start, start = _cpu_time(), time.perf_counter()
+        for i in range(self.n_frames):
+            writer.write(frames[i % len(frames)], rgb_mode=True)
+        writer.close()
+        seconds, cpu = time.perf_counter() - start, _cpu_time() - cpu_start
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if os.path.exists(path):
+            os.remove(path)
+        return {'width': width, 'height': height, 'crf': crf, 'fps': self.n_frames / seconds,
+                'cpu': cpu / seconds, 'core_fps': self.n_frames / max(cpu, 1e-6),
+                'bytes_per_frame': size / self.n_frames}
+
+    def run(self, sizes: list, crfs: list, codecs: list = codec_to_try,
+            path: (str, Path) = ENCODER_PROFILE_FILE) -> dict:
+        """
+        Profiles all available codecs and writes the cache
+        :param sizes: list of (width, height)
+        :param crfs: list of crf values
+        :param codecs: codecs to try, unavailable ones are skipped
+        :param path: cache file
+        :return: codec -> profile
+        """
+        available = self.available_codecs(codecs)
+        if not available:
+            self.log.error('No valid ffmpeg found or none of the codecs is supported, nothing to profile')
+            return {}
+        profiles = {'_machine': machine_id(), '_created': time.strftime('%Y-%m-%d %H:%M:%S')}
+        for codec in available:
+            results = []
+            for width, height in sizes:
+                for crf in crfs:
+                    try:
+                        result = self.measure(codec, width, height, crf)
+                    except Exception as e:  # ffmpeg refuses e.g. hardware encoders without the hardware
+                        self.log.warning(f'{codec} failed at {width}x{height}: {e}')
+                        continue
+                    results.append(result)
+                    self.log.info(f"{codec:>12s} {width}x{height} crf {crf:2d}: {result['fps']:6.1f} FPS, "
+                                  f"{result['cpu']:4.2f} cores, {result['core_fps']:6.1f} FPS per core")
+            if not results:
+                continue
+            # the planner scales by pixels, use the largest size as reference (worst case per pixel)
+            reference = max(results, key=lambda r: (r['width'] * r['height'], -r['core_fps']))
+            profiles[codec] = {'fps': reference['core_fps'], 'wall_fps': reference['fps'],
+                               'pixels': reference['width'] * reference['height'], 'results': results}
+        with open(path, 'w') as f:
+            json.dump(profiles, f, indent=4)
+        self.log.info(f'Encoder profiles written to {path}')
+        return {codec: profile for codec, profile in profiles.items() if not codec.startswith('_')}
+
+
+def choose_codec(profiles: dict, fps: float, frame_sizes: list, codecs: list = codec_to_try,
+                 cpu_count: int = None) -> (str, None):
+    """
+    Picks the codec with the lowest cpu load which sustains the recording. Besides the cpu load, the measured
+    throughput (wall clock) has to keep up with all cameras, hardware encoders use hardly any cpu but are limited by
+    the encoder chip and its sessions
+    :param profiles: codec -> profile, see load_encoder_profiles
+    :param fps: recording frame rate
+    :param frame_sizes: (width, height) of every camera
+    :param codecs: candidates
+    :param cpu_count: available cores, defaults to all cores
+    :return: codec or None if no profiled codec is fast enough
+    """
+    cpu_count = cpu_count or os.cpu_count() or 1
+    best, best_cores = None, None
+    pixel_rate = fps * sum(width * height for width, height in frame_sizes)  # pixels/s of all cameras
+    for codec in codecs:
+        profile = profiles.get(codec, None)
+        if not profile:
+            continue
+        # cores needed by all writers, encoding time scales roughly with the number of pixels
+        cores = sum(fps * width * height / (profile['fps'] * profile['pixels']) for width, height in frame_sizes)
+        if 'wall_fps' not in profile:
+            continue  # profiled before the throughput was stored, profile again
+        if profile['wall_fps'] * profile['pixels'] < pixel_rate * HEADROOM:
+            continue
+        if cores * HEADROOM <= cpu_count and (best_cores is None or cores < best_cores):
+            best, best_cores = codec, cores
+    return best
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Profile the available encoders of this machine')
+    parser.add_argument('--sizes', type=str, default='1920x1200,1280x1024,640x480', help='comma separated WxH')
+    parser.add_argument('--crf', type=str, default='17,23', help='comma separated crf values')
+    parser.add_argument('--codecs', type=str, default=','.join(codec_to_try), help='comma separated codecs')
+    parser.add_argument('--frames', type=int, default=150, help='frames per measurement')
+    parser.add_argument('--output', type=str, default=ENCODER_PROFILE_FILE, help='cache file')
+    args = parser.parse_args()
+
+    sizes = [tuple(int(v) for v in size.split('x')) for size in args.sizes.split(',')]
+    profiler = EncoderProfiler(n_frames=args.frames)
+    profiles = profiler.run(sizes, [int(crf) for crf in args.crf.split(',')], args.codecs.split(','), args.output)
+    for n_cams in (1, 4, 8):
+        for fps in (30, 100):
+            codec = choose_codec(profiles, fps, [sizes[0]] * n_cams, args.codecs.split(','))
+            print(f'{n_cams} cameras {sizes[0][0]}x{sizes[0][1]} at {fps} FPS: {codec or "no codec fast enough"}')
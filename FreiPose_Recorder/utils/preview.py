@@ -0,0 +1,169 @@
+"""
+Downscaling of preview frames to the size they are displayed with.
+
+The camera views get full resolution frames, with 8 cameras of 1.3 MP that are 8 ARGB conversions and scaled paints
+of 1.3 MP per tick although each view is only a few hundred pixels wide. The preview is reduced to the pixel size of
+the widget first: 'stride' takes every n-th pixel (a view, no copy), 'area' averages n x n blocks (smoother, slower).
+
+The Mosaic composes the previews of all cameras into one preallocated canvas, so a grid of cameras is painted once
+per tick instead of once per camera.
+
+    python -m FreiPose_Recorder.utils.preview  # cpu time per tick for 8 cameras with and without downscaling
+"""
+import math
+import time
+
+import numpy as np
+
+
+def downscale_factor(shape: tuple, target_size: tuple) -> int:
+    """
+    Largest integer factor which keeps the image at least as large as the target
+    :param shape: shape of the image (height, width, ...)
+    :param target_size: (width, height) in pixels
+    """
+    width, height = target_size
+    if width <= 0 or height <= 0:
+        return 1
+    return max(1, min(shape[1] // width, shape[0] // height))
+
+
+def downscale(image: np.ndarray, target_size: tuple, method: str = 'stride') -> np.ndarray:
+    """
+    Reduces the image to about the target size, the display scales the rest
+    :param image: HxW or HxWxC image
+    :param target_size: (width, height) in pixels of the widget
+    :param method: 'stride' (every n-th pixel) or 'area' (mean of n x n blocks)
+    :return: downscaled image, the image itself if it is already small enough
+    """
+    factor = downscale_factor(image.shape, target_size)
+    if factor == 1:
+        return image
+    if method == 'area':
+        height, width = image.shape[0] // factor, image.shape[1] // factor
+        # sum of the factor^2 strided sub images, much faster than a mean over a reshaped block axis
+        total = np.zeros((height, width) + image.shape[2:], dtype=np.uint32)
+        for y in range(factor):
+            for x in range(factor):
+                total += image[y:height * factor:factor, x:width * factor:factor]
+        return (total // (factor * factor)).astype(image.dtype)
+    return image[::factor, ::factor]
+
+
+class PreviewThrottle:
+    """
+    Decides if a view is redrawn: not for the same frame again and not faster than max_fps.
+
+    :param max_fps: maximal redraw rate, 0 disables the limit
+    """
+    def __init__(self, max_fps: float = 30):
+        self.min_interval = 1.0 / max_fps if max_fps else 0.0
+        self._last_frame = None  # a reference, ids of freed frames are reused
+        self._last_draw = 0.0
+        self.skipped = 0
+
+    def should_draw(self, image: np.ndarray = None) -> bool:
+        """
+        :param image: the new frame, None only checks the rate (e.g. for a canvas which is updated in place)
+        """
+        now = time.monotonic()
+        if (image is not None and image is self._last_frame) or now - self._last_draw < self.min_interval:
+            self.skipped += 1
+            return False
+        self._last_frame, self._last_draw = image, now
+        return True
+
+
+def grid_columns(n_cams: int) -> int:
+    """columns of the camera grid, the same layout as MultiCameraViewer"""
+    return 2 if n_cams <= 4 else 3
+
+
+class Mosaic:
+    """
+    One canvas for the previews of all cameras, tiles are written in place.
+
+    :param n_cams: number of cameras
+    :param canvas_size: (width, height) of the canvas in pixels, i.e. the size of the widget
+    :param channels: 3 for RGB previews, mono frames are written to all channels
+    """
+    def __init__(self, n_cams: int, canvas_size: tuple, channels: int = 3):
+        self.n_cams = n_cams
+        self.cols = grid_columns(n_cams)
+        self.rows = max(1, math.ceil(n_cams / self.cols))
+        self.channels = channels
+        self.canvas = None
+        self.tile_size = (0, 0)
+        self.dirty = False  # a tile changed since the canvas was painted last
+        self._placed = {}  # cam_id -> size of the image last written into its tile
+        self.resize(canvas_size)
+
+    def resize(self, canvas_size: tuple):
+        """reallocates the canvas if the tile size changed, e.g. after the window was resized"""
+        tile_size = (max(1, canvas_size[0] // self.cols), max(1, canvas_size[1] // self.rows))
+        if tile_size == self.tile_size and self.canvas is not None:
+            return
+        self.tile_size = tile_size
+        self.canvas = np.zeros((self.rows * tile_size[1], self.cols * tile_size[0], self.channels), np.uint8)
+        self._placed = {}
+        self.dirty = True
+
+    def put(self, cam_id: int, image: np.ndarray):
+        """writes the preview of a camera into its tile, centered and reduced to fit"""
+        tile_w, tile_h = self.tile_size
+        factor = max(1, math.ceil(max(image.shape[0] / tile_h, image.shape[1] / tile_w)))
+        small = image[::factor, ::factor]
+        h, w = small.shape[:2]
+        tile_y, tile_x = (cam_id // self.cols) * tile_h, (cam_id % self.cols) * tile_w
+        if self._placed.get(cam_id) != (h, w):
+            # the frame size changed (e.g. ROI or binning), the old frame must not stay visible around the new one
+            self.canvas[tile_y:tile_y + tile_h, tile_x:tile_x + tile_w] = 0
+            self._placed[cam_id] = (h, w)
+        y0 = tile_y + (tile_h - h) // 2
+        x0 = tile_x + (tile_w - w) // 2
+        tile = self.canvas[y0:y0 + h, x0:x0 + w]
+        if small.ndim == 2:
+            tile[...] = small[..., None]
+        else:
+            tile[...] = small[..., :self.channels]
+        self.dirty = True
+
+
+def _to_argb(image: np.ndarray) -> np.ndarray:
+    """the conversion RawImageWidget does for every paint (pyqtgraph makeARGB without levels)"""
+    argb = np.empty(image.shape[:2] + (4,), dtype=np.uint8)
+    argb[..., :3] = image
+    argb[..., 3] = 255
+    return argb
+
+
+if __name__ == '__main__':
+    n_cams, ticks = 8, 30
+    frames = [np.random.randint(0, 255, (1024, 1280, 3), np.uint8) for _ in range(n_cams)]
+    view_size = (426, 341)  # a 3x3 grid in a 1280x1024 window
+    try:
+        from pyqtgraph.functions import makeARGB
+
+        def convert(image):
+            return makeARGB(image.transpose(1, 0, 2))[0]
+    except ImportError:
+        def convert(image):
+            return _to_argb(image.transpose(1, 0, 2))
+    for name, prepare in (('full resolution', lambda image: image),
+                          ('stride', lambda image: downscale(image, view_size, 'stride')),
+                          ('area', lambda image: downscale(image, view_size, 'area'))):
+        start = time.process_time()
+        for _ in range(ticks):
+            for frame in frames:
+                convert(prepare(frame))
+        cpu = (time.process_time() - start) / ticks
+        print(f'{name:>16s}: {cpu * 1000:6.1f} ms cpu per tick for {n_cams} cameras, '
+              f'{cpu * 30 * 100:5.0f} % of a core at 30 ticks/s')
+    mosaic = Mosaic(n_cams, (view_size[0] * 3, view_size[1] * 3))
+    start = time.process_time()
+    for _ in range(ticks):
+        for cam_id, frame in enumerate(frames):
+            mosaic.put(cam_id, frame)
+        convert(mosaic.canvas)
+    cpu = (time.process_time() - start) / ticks
+    print(f'{"mosaic":>16s}: {cpu * 1000:6.1f} ms cpu per tick for {n_cams} cameras, one paint per tick')
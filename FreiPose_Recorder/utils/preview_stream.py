@@ -0,0 +1,314 @@
+"""
+Live camera previews for remote clients, e.g. a dashboard monitoring the rig.
+
+A remote client requests the previews with a stream_preview message on the control connection and connects to
+PREVIEW_STREAM_PORT, where the frames are sent as binary messages: a FRAME_HEADER followed by the payload, either jpeg
+or the raw pixels (height x width x channels, uint8). The json control connection is not involved.
+
+The recorder thread only hands over a reference to the frame if the camera is due (offer). Downscaling, encoding and
+sending run in the streamer thread, which only keeps the newest frame per camera: a frame which is not sent yet is
+replaced by the next one, and a client which does not read fast enough misses frames instead of delaying the others.
+
+    python -m FreiPose_Recorder.utils.preview_stream  # streamed frames and cpu time of 8 cameras over loopback
+"""
+import logging
+import math
+import select
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+
+from FreiPose_Recorder.configs.params import PREVIEW_STREAM_FPS, PREVIEW_STREAM_SIZE, PREVIEW_STREAM_QUALITY
+from FreiPose_Recorder.utils.preview import downscale
+
+FRAME_MAGIC = b'FPRV'
+# magic, cam_id, encoding, channels, width, height, timestamp (s, monotonic clock of the recorder), payload bytes
+FRAME_HEADER = struct.Struct('!4sBBBHHdI')
+ENCODINGS = {'raw': 0, 'jpeg': 1}
+SEND_TIMEOUT = 1.0  # s, a client which takes longer for a single frame is disconnected
+
+
+class PreviewStreamer:
+    """
+    Sends downscaled previews to the clients connected to its port.
+
+    :param host: address to listen on
+    :param port: port to listen on
+    :param fps: frames per second and camera, 0 pauses the stream
+    :param max_size: (width, height) the previews are reduced to
+    :param encoding: 'jpeg' or 'raw'
+    :param quality: jpeg quality 1-100
+    """
+    def __init__(self, host: str = "localhost", port: int = 8882, fps: float = PREVIEW_STREAM_FPS,
+                 max_size: tuple = PREVIEW_STREAM_SIZE, encoding: str = 'jpeg', quality: int = PREVIEW_STREAM_QUALITY):
+        self.host = host
+        self.port = port
+        self.fps = fps
+        self.max_size = tuple(max_size)
+        self.encoding = encoding
+        self.quality = quality
+        self.cameras = None  # cam_ids to stream, None streams all
+        self.enabled = False
+        self.clients = []
+        self.sent = 0
+        self.sent_bytes = 0
+        self.dropped = 0  # frames replaced before they were sent or skipped for a busy client
+        self._latest = {}  # cam_id -> (timestamp, frame) not sent yet
+        self._last_offer = {}  # cam_id -> time the last frame was taken
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._server_sock = None
+        self._thread = None
+        self.log = logging.getLogger("PreviewStreamer")
+        self.log.setLevel(logging.DEBUG)
+
+    @property
+    def settings(self) -> dict:
+        return {'enabled': self.enabled, 'cameras': self.cameras, 'fps': self.fps, 'max_size': list(self.max_size),
+                'encoding': self.encoding, 'quality': self.quality}
+
+    @staticmethod
+    def _validate(message: dict) -> dict:
+        """
+        Checks the fields of a stream_preview message, they come from remote clients
+        :return: the settings of the message
+        :raises ValueError: if a field is invalid
+        """
+        def is_int(value) -> bool:
+            return isinstance(value, int) and not isinstance(value, bool)
+
+        settings = {}
+        if 'enabled' in message:
+            if not isinstance(message['enabled'], bool):
+                raise ValueError(f"enabled has to be true or false, not {message['enabled']!r}")
+            settings['enabled'] = message['enabled']
+        if 'cameras' in message:
+            cameras = message['cameras']
+            if cameras is not None and (not isinstance(cameras, list)
+                                        or not all(is_int(cam_id) and 0 <= cam_id < 256 for cam_id in cameras)):
+                raise ValueError(f'cameras has to be null or a list of camera ids, not {cameras!r}')
+            settings['cameras'] = cameras
+        if 'fps' in message:
+            fps = message['fps']
+            if not (is_int(fps) or isinstance(fps, float)) or not math.isfinite(fps) or fps < 0:
+                raise ValueError(f'fps has to be a number >= 0, not {fps!r}')
+            settings['fps'] = float(fps)
+        if 'max_size' in message:
+            max_size = message['max_size']
+            if not isinstance(max_size, (list, tuple)) or len(max_size) != 2 \
+                    or not all(is_int(size) and 0 < size < 65536 for size in max_size):
+                raise ValueError(f'max_size has to be [width, height] in pixels, not {max_size!r}')
+            settings['max_size'] = tuple(max_size)
+        if 'encoding' in message:
+            if message['encoding'] not in ENCODINGS:
+                raise ValueError(f"encoding has to be one of {', '.join(ENCODINGS)}, not {message['encoding']!r}")
+            settings['encoding'] = message['encoding']
+        if 'quality' in message:
+            if not is_int(message['quality']) or not 1 <= message['quality'] <= 100:
+                raise ValueError(f"quality has to be an integer from 1 to 100, not {message['quality']!r}")
+            settings['quality'] = message['quality']
+        return settings
+
+    def configure(self, message: dict) -> dict:
+        """
+        Applies the fields of a stream_preview message, fields which are missing keep their value
+        :param message: with the optional fields enabled, cameras, fps, max_size, encoding and quality
+        :return: the settings in effect
+        :raises ValueError: if a field is invalid, nothing is changed then
+        """
+        settings = self._validate(message)
+        with self._lock:
+            self.enabled = settings.get('enabled', self.enabled)
+            self.cameras = settings.get('cameras', self.cameras)
+            self.fps = settings.get('fps', self.fps)
+            self.max_size = settings.get('max_size', self.max_size)
+            self.encoding = settings.get('encoding', self.encoding)
+            self.quality = settings.get('quality', self.quality)
+            self._latest.clear()
+        if self.enabled:
+            self.start()
+        self.log.info(f'Preview stream {self.settings}')
+        return self.settings
+
+    def start(self):
+        """starts listening, does nothing if the streamer is running"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            self._server_sock.bind((self.host, self.port))
+        except OSError as e:
+            self.log.error(f'Could not listen on {self.host}:{self.port}: {e}')
+            self._server_sock.close()
+            self._server_sock = None
+            return
+        self._server_sock.listen()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """stops streaming and disconnects all clients"""
+        self.enabled = False
+        self._stop_event.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for client in self.clients:
+            client.close()
+        self.clients = []
+        if self._server_sock is not None:
+            self._server_sock.close()
+            self._server_sock = None
+
+    def offer(self, cam_id: int, frame: np.ndarray, timestamp: float = None):
+        """
+        Hands a preview frame to the streamer, cheap enough for the thread showing the previews
+        :param cam_id: camera of the frame
+        :param frame: HxW or HxWxC uint8 image, must not be changed afterwards (a reference is kept)
+        :param timestamp: time of the frame, defaults to now
+        """
+        if not self.enabled or not self.clients or not self.fps:
+            return
+        if self.cameras is not None and cam_id not in self.cameras:
+            return
+        now = time.monotonic()
+        if now - self._last_offer.get(cam_id, 0.0) < 1.0 / self.fps:
+            return
+        self._last_offer[cam_id] = now
+        with self._lock:
+            if cam_id in self._latest:
+                self.dropped += 1  # drop the old frame, the newest one is sent
+            self._latest[cam_id] = (now if timestamp is None else timestamp, frame)
+        self._wakeup.set()
+
+    def encode(self, cam_id: int, frame: np.ndarray, timestamp: float) -> bytes:
+        """downscaled frame with header"""
+        small = np.ascontiguousarray(downscale(frame, self.max_size))
+        channels = 1 if small.ndim == 2 else small.shape[2]
+        if self.encoding == 'jpeg':
+            import cv2  # only if jpeg previews are streamed
+            _, payload = cv2.imencode('.jpg', small[..., ::-1] if channels == 3 else small,  # RGB previews
+                                       [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+            payload = payload.tobytes()
+        else:
+            payload = small.tobytes()
+        return FRAME_HEADER.pack(FRAME_MAGIC, cam_id, ENCODINGS[self.encoding], channels, small.shape[1],
+                                 small.shape[0], timestamp, len(payload)) + payload
+
+    def _run(self):
+        self.log.info(f'Streaming previews on {self.host}:{self.port}')
+        while not self._stop_event.is_set():
+            self._accept_clients()
+            if not self._wakeup.wait(0.1):
+                continue
+            self._wakeup.clear()
+            with self._lock:
+                frames, self._latest = self._latest, {}
+            for cam_id, (timestamp, frame) in frames.items():
+                if not self.clients:
+                    break  # the last client left during this batch
+                self._send(self.encode(cam_id, frame, timestamp))
+
+    def _accept_clients(self):
+        ready, _, _ = select.select([self._server_sock], [], [], 0)
+        if ready:
+            client, addr = self._server_sock.accept()
+            client.settimeout(SEND_TIMEOUT)
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.clients.append(client)
+            self.log.info(f'Preview client {addr} connected ({len(self.clients)} clients)')
+
+    def _send(self, data: bytes):
+        """sends to every client which can take more data right now, the others miss this frame"""
+        if not self.clients:
+            return  # select with empty lists fails on Windows
+        _, writable, _ = select.select([], self.clients, [], 0)
+        for client in list(self.clients):
+            if client not in writable:
+                self.dropped += 1
+                continue
+            try:
+                client.sendall(data)
+                self.sent += 1
+                self.sent_bytes += len(data)
+            except OSError as e:  # timeout, reset or closed by the client
+                self.log.info(f'Preview client disconnected: {e}')
+                client.close()
+                self.clients.remove(client)
+
+
+def receive_frame(sock: socket.socket) -> tuple:
+    """
+    Reads the next frame from the preview stream, for remote clients
+    :return: cam_id, timestamp, image (HxWxC or HxW uint8)
+    """
+    def recv_exactly(size: int) -> bytearray:
+        data = bytearray()
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError('preview stream closed')
+            data += chunk
+        return data
+
+    magic, cam_id, encoding, channels, width, height, timestamp, size = FRAME_HEADER.unpack(
+        recv_exactly(FRAME_HEADER.size))
+    if magic != FRAME_MAGIC:
+        raise ValueError('not a preview frame, the stream is out of sync')
+    payload = recv_exactly(size)
+    if encoding == ENCODINGS['jpeg']:
+        import cv2
+        image = cv2.imdecode(np.frombuffer(payload, np.uint8), cv2.IMREAD_UNCHANGED)
+        if image.ndim == 3:
+            image = image[..., ::-1]
+    else:
+        image = np.frombuffer(payload, np.uint8).reshape((height, width, channels) if channels > 1 else (height, width))
+    return cam_id, timestamp, image
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    N_CAMS, CAM_FPS, DURATION, PORT = 8, 100, 3.0, 8898
+    frames = [np.random.randint(0, 255, (1024, 1280, 3), np.uint8) for _ in range(N_CAMS)]
+
+    for encoding in ('jpeg', 'raw'):
+        streamer = PreviewStreamer('localhost', PORT)
+        streamer.configure({'enabled': True, 'encoding': encoding})
+        client = socket.create_connection(('localhost', PORT))
+        while not streamer.clients:
+            time.sleep(0.01)
+        received = [0] * N_CAMS
+
+        def read_stream():
+            try:
+                while True:
+                    cam_id, _, image = receive_frame(client)
+                    received[cam_id] += 1
+            except (ConnectionError, OSError):
+                pass
+        reader = threading.Thread(target=read_stream, daemon=True)
+        reader.start()
+
+        offer_time, start = 0.0, time.perf_counter()
+        n_ticks = int(DURATION * CAM_FPS)
+        for tick in range(n_ticks):
+            tick_start = time.perf_counter()
+            for cam_id, frame in enumerate(frames):
+                streamer.offer(cam_id, frame)
+            offer_time += time.perf_counter() - tick_start
+            time.sleep(max(0.0, start + (tick + 1) / CAM_FPS - time.perf_counter()))
+        time.sleep(0.2)
+        streamer.close()
+        client.close()
+        reader.join(1.0)
+        print(f'{encoding:>5s}: {sum(received) / DURATION / N_CAMS:5.1f} frames/s per camera '
+              f'(limit {streamer.fps:g}), {streamer.sent_bytes / max(streamer.sent, 1) / 1e3:6.1f} kB per frame, '
+              f'offer {offer_time / (n_ticks * N_CAMS) * 1e6:5.1f} us per frame, '
+              f'{streamer.dropped} dropped')
@@ -1,10 +1,15 @@
+import json
 import socket
 import ssl
 import threading
 import select
 import logging
+import time
 from enum import Enum
 
+RECV_SIZE = 65536  # bytes per recv call
+MAX_LINE = 16 * 1024 * 1024  # a line without delimiter longer than this is dropped
+
 
 class MessageType(Enum):
     """Enum class to represent the message types"""
@@ -23,6 +28,7 @@ class MessageType(Enum):
     disconnected = 'disconnected'
     copy_files = 'copy_files'
     purge_files = 'purge_files'
+    stream_preview = 'stream_preview'
 
 
 class MessageStatus(Enum):
@@ -39,6 +45,9 @@ class MessageStatus(Enum):
     calib_ok = 'calib_ok'
     copy_ok = 'copy_ok'
     copy_fail = 'copy_fail'
+    copy_progress = 'copy_progress'
+    stream_ok = 'stream_ok'
+    stream_fail = 'stream_fail'
 
 
 class SocketMessage:
@@ -60,6 +69,28 @@ class SocketMessage:
     respond_copy_fail = {'type': MessageType.response.value, 'status': MessageStatus.copy_fail.value}
     client_disconnected = {'type': MessageType.disconnected.value}
 
+    @staticmethod
+    def copy_progress(file_name: str, bytes_done: int, bytes_total: int) -> dict:
+        """status message reporting the progress of copying a single file"""
+        return {'type': MessageType.status.value, 'status': MessageStatus.copy_progress.value,
+                'file': file_name, 'bytes_done': bytes_done, 'bytes_total': bytes_total}
+
+    @staticmethod
+    def respond_stream(port: int, settings: dict) -> dict:
+        """response to stream_preview, the frames are sent to the clients connected to port"""
+        return {'type': MessageType.response.value, 'status': MessageStatus.stream_ok.value, 'port': port, **settings}
+
+    @staticmethod
+    def respond_stream_fail(error: str, settings: dict) -> dict:
+        """response to an invalid stream_preview message, the settings in effect are unchanged"""
+        return {'type': MessageType.response.value, 'status': MessageStatus.stream_fail.value, 'error': error,
+                **settings}
+
+    @staticmethod
+    def with_cameras(message: dict, cameras: list) -> dict:
+        """adds the per camera state (see Recorder.get_camera_status) to a status message"""
+        return {**message, 'cameras': cameras}
+
     def __init__(self):
         self._session_path = None
         self._fps = 30
@@ -78,7 +109,8 @@ class SocketMessage:
         self.poll_status = {'type': MessageType.poll_status.value}
 
         self.start_video_rec = {'type': MessageType.start_video_rec.value, 'session_id': self._session_id,
-                                'setting_file': self._basler_setting_file, 'frame_rate': self._fps}
+                                'setting_file': self._basler_setting_file, 'frame_rate': self._fps,
+                                'session_path': self._session_path}
         self.start_video_view = {'type': MessageType.start_video_view.value, 'session_id': self._session_id,
                                  'setting_file': self._basler_setting_file, 'frame_rate': self._fps}
         self.stop_video = {'type': MessageType.stop_video.value}
@@ -157,7 +189,7 @@ class SocketMessage:
                                          'setting_file': self.daq_setting_file})
         self.start_daq_pulses.update(**{'fps': self.fps, 'pulse_lag': self.pulse_lag})
         self.start_video_rec.update(**{'session_id': self.session_id, 'setting_file': self.basler_setting_file,
-                                       'frame_rate': self.fps})
+                                       'frame_rate': self.fps, 'session_path': self._session_path})
         self.start_video_view.update(**{'session_id': self._session_id, 'setting_file': self.basler_setting_file,
                                         'frame_rate': self.fps})
         self.start_video_calibrec.update(**{'session_id': 'calibration', 'setting_file': self.basler_setting_file})
@@ -165,6 +197,56 @@ class SocketMessage:
         self.purge_files.update(**{'session_id': self._session_id})
 
 
+class LineBuffer:
+    """
+    Frames a byte stream into delimited messages. Received chunks may hold a part of a message or several messages,
+    complete lines are returned one by one and the rest stays buffered until the next chunk arrives.
+
+    :param delimiter: message delimiter, not part of the returned lines
+    :param max_line: bytes buffered without delimiter until the buffer is dropped
+    """
+    def __init__(self, delimiter: bytes = b'\n', max_line: int = MAX_LINE):
+        self.delimiter = delimiter
+        self.max_line = max_line
+        self._buffer = bytearray()
+        self._start = 0  # start of the unread data, consumed lines are removed in one go
+        self._searched = 0  # no delimiter before this position
+        self.log = logging.getLogger("LineBuffer")
+        self.log.setLevel(logging.DEBUG)
+
+    def __len__(self):
+        return len(self._buffer) - self._start
+
+    def feed(self, data: bytes):
+        if self._start:
+            del self._buffer[:self._start]
+            self._searched = max(self._searched - self._start, 0)
+            self._start = 0
+        self._buffer += data
+        if len(self._buffer) > self.max_line and self._buffer.find(self.delimiter, self._searched) == -1:
+            self.log.error(f'Dropped {len(self._buffer)} bytes without delimiter')
+            self.clear()
+
+    def next_line(self) -> (bytes, None):
+        """next complete line without the delimiter, None if there is none yet"""
+        end = self._buffer.find(self.delimiter, max(self._searched, self._start))
+        if end == -1:
+            self._searched = max(len(self._buffer) - len(self.delimiter) + 1, 0)
+            return None
+        line = bytes(self._buffer[self._start:end])
+        self._start = self._searched = end + len(self.delimiter)
+        return line
+
+    def take_all(self) -> bytes:
+        data = bytes(self._buffer[self._start:])
+        self.clear()
+        return data
+
+    def clear(self):
+        self._buffer = bytearray()
+        self._start = self._searched = 0
+
+
 class SocketComm:
     """
     Socket communication class. Enables server-client communitation via network.
@@ -189,6 +271,8 @@ class SocketComm:
         self.log = logging.getLogger(f"SocketComm_{self.type}")
         self.log.setLevel(logging.DEBUG)
         self.message_time = time.monotonic()
+        self._send_lock = threading.Lock()  # messages might be sent from background threads
+        self._rx = LineBuffer()
 
     def create_socket(self):
         """"""
@@ -214,6 +298,7 @@ class SocketComm:
                 ready, _, _ = select.select([self._ssl_sock], [], [], 0.1)
                 if ready:
                     self.ssl_sock, self.addr = self._ssl_sock.accept()
+                    self._rx.clear()
                     self.ssl_sock.settimeout(0.1)
                     self.connected = True
                     self.log.info(f"Connected to {self.addr}")
@@ -222,6 +307,7 @@ class SocketComm:
                 ready, _, _ = select.select([self._sock], [], [], 0.1)
                 if ready:
                     self.sock, self.addr = self._sock.accept()
+                    self._rx.clear()
                     self.sock.settimeout(0.1)
                     self.connected = True
                     self.log.info(f"Connected to {self.addr}")
@@ -256,6 +342,7 @@ class SocketComm:
             else:
                 self.sock = self._sock
                 self.sock.settimeout(0.1)  # otherwise we get issues if nothing is comming
+            self._rx.clear()
             self._connect(self.host, self.port)
             self.connected = True
             return True
@@ -279,29 +366,11 @@ class SocketComm:
         reads message from socket and decodes it into dict
         returns: dict
         """
-        try:
-            message = self._recv_until(b'\n')
-            if message is not None:
-                message = json.loads(message.decode())
-            else:
-                return message
-        except json.decoder.JSONDecodeError:
-            message = None
-        return message
+        return self.read_json_message_fast_linebreak()
 
     def read_json_message_fast(self) -> dict:
-        try:
-            message = self._recv(1024)
-            if message == -1:
-                return SocketMessage.client_disconnected
-            if message is not None:
-                message = json.loads(message.decode())
-            else:
-                return message
-        except json.decoder.JSONDecodeError:
-            message = None
-            print('message decoding failed')
-        return message
+        """same as read_json_message_fast_linebreak, messages larger than a single recv are framed correctly"""
+        return self.read_json_message_fast_linebreak()
 
     def read_json_message_fast_linebreak(self) -> dict:
         """
@@ -325,6 +394,14 @@ class SocketComm:
         message += b'\n'
         self._send(message)
 
+    def broadcast(self, message: dict):
+        """there is only one client, see RemoteServer for several"""
+        self.send_json_message(message)
+
+    def push_status(self, message: dict):
+        """status events go to further clients, the single client only gets replies (see RemoteServer)"""
+        pass
+
     def _connect(self, host, port):
         if self.use_ssl:
             self.ssl_sock.connect((host, port))
@@ -333,10 +410,11 @@ class SocketComm:
 
     def _send(self, data):
         try:
-            if self.use_ssl:
-                self.ssl_sock.sendall(data)
-            else:
-                self.sock.sendall(data)
+            with self._send_lock:
+                if self.use_ssl:
+                    self.ssl_sock.sendall(data)
+                else:
+                    self.sock.sendall(data)
         except ConnectionResetError:
             self.log.error("Connection reset by peer")
 
@@ -352,24 +430,28 @@ class SocketComm:
             self.log.warning("Client disconnected")
             return -1
 
-    def _recv_until(self, delimiter) -> bytes:
-        data = b''
-        try:
-            if self.use_ssl:
-                while not data.endswith(delimiter):
-                    data += self.ssl_sock.recv(1)
-            else:
-                while not data.endswith(delimiter):
-                    data += self.sock.recv(1)
-        except socket.timeout:
-            data = None
-        except ConnectionResetError:
-            self.log.warning("Client disconnected")
-            data = -1
-        return data
+    def _recv_until(self, delimiter) -> (bytes, int):
+        """
+        next message up to the delimiter, reads as much as available per recv call and keeps the rest buffered
+        returns: the message without delimiter, None if no complete message arrived before the timeout,
+                 -1 if the connection was closed
+        """
+        if delimiter != self._rx.delimiter:
+            self._rx.delimiter = delimiter
+        while True:
+            line = self._rx.next_line()
+            if line is not None:
+                return line
+            data = self._recv(RECV_SIZE)
+            if data is None or data == -1:
+                return data  # a partial message stays buffered
+            if not data:
+                self.log.warning("Connection closed by peer")
+                return -1
+            self._rx.feed(data)
 
     def _recv_all(self):
-        data = b''
+        data = self._rx.take_all()
         if self.use_ssl:
             while True:
                 try:
@@ -386,47 +468,47 @@ class SocketComm:
 
 
 if __name__ == "__main__":
-    import time
     import argparse
-    import json
 
-    """
-    parser = argparse.ArgumentParser(description='Socket communication test')
-    parser.add_argument('--type', type=str, default='server', help='Socket type: client or server')
-    parser.add_argument('--host', type=str, default='localhost', help='Host IP address')
-    parser.add_argument('--port', type=int, default=8800, help='Port number')
-    parser.add_argument('--use_ssl', type=bool, default=False, help='Use SSL')
+    parser = argparse.ArgumentParser(description='Message throughput of SocketComm over loopback')
+    parser.add_argument('--port', type=int, default=8880, help='Port number')
+    parser.add_argument('--messages', type=int, default=20000, help='number of messages')
+    parser.add_argument('--payload', type=int, default=200, help='bytes of filler per message')
     args = parser.parse_args()
 
-    sock = SocketComm('server')
-    sock.create_socket()
-    sock.threaded_accept_connection()
-    while not sock.connected:
-        print('no connection established,waiting...')
-        time.sleep(1)
-    try:
-        data = sock.read_json_message()
-        print(data)
-    except Exception as e:
-        print(e)
-        pass
-    sock.close_socket()
-    """
+    server = SocketComm('server', port=args.port)
+    server.threaded_accept_connection()
+    client = SocketComm('client', port=args.port)
+    client.create_socket()
+    client.connect()
+    server.acception_thread.join()
 
-    import json
-    sock = SocketComm('client',port=8880)
-    sock.create_socket()
-    sock.connect()
-    time.sleep(0.5)
-    response = sock.read_json_message_fast()
-
-    # print(response)
-    # message = {'type': 'start_rec', 'session_id': 'test2', 'setting_file': ''}
-    # time.sleep(5)
-    # print("sending message")
-    # sock._send(json.dumps(message).encode())
-    # time.sleep(25)
-    # print("sending stop")
-    # message = {'type': 'stop'}
-    # sock._send(json.dumps(message).encode())
-    # sock.close_socket()
\ No newline at end of file
+    def read_bytewise(comm: SocketComm):
+        """the framing before LineBuffer, one recv call per byte"""
+        data = b''
+        try:
+            while not data.endswith(b'\n'):
+                data += comm.sock.recv(1)
+        except socket.timeout:
+            return None
+        return json.loads(data.decode())
+
+    for name, read in (('buffered', server.read_json_message_fast_linebreak), ('bytewise', None)):
+        n_messages = args.messages if read else max(args.messages // 10, 1)
+        message = {'type': MessageType.poll_status.value, 'filler': 'x' * args.payload}
+        sender = threading.Thread(target=lambda: [client.send_json_message(dict(message, i=i))
+                                                  for i in range(n_messages)])
+        start = time.perf_counter()
+        sender.start()
+        received = 0
+        while received < n_messages:
+            message_in = read() if read else read_bytewise(server)
+            if message_in is not None:
+                assert message_in['i'] == received, 'message lost or corrupted'
+                received += 1
+        duration = time.perf_counter() - start
+        sender.join()
+        print(f'{name:>9s}: {n_messages / duration:9.0f} messages/s, '
+              f'{n_messages * (len(json.dumps(message)) + 8) / duration / 1e6:6.1f} MB/s ({n_messages} messages)')
+    client.close_socket()
+    server.close_socket()
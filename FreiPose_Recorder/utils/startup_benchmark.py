@@ -0,0 +1,86 @@
+"""
+Measures the startup of the recorder: import time per module, time until the window is shown and time until the
+cameras are connected.
+
+Import times are measured in a fresh interpreter per module with -X importtime, so modules imported before do not
+hide their cost. Emulated cameras can be used for the camera timing, e.g. PYLON_CAMEMU=4.
+
+    python -m FreiPose_Recorder.utils.startup_benchmark            # import times
+    python -m FreiPose_Recorder.utils.startup_benchmark --gui      # + window shown and cameras connected
+"""
+import argparse
+import subprocess
+import sys
+import time
+
+MODULES = ['FreiPose_Recorder', 'FreiPose_Recorder.configs.params', 'FreiPose_Recorder.utils.VideoWriterFast_gear',
+           'FreiPose_Recorder.utils.bandwidth_planner', 'FreiPose_Recorder.core.Recorder',
+           'FreiPose_Recorder.headless', 'FreiPose_Recorder.ImageViewer', 'FreiPose_Recorder.GUI_run']
+HEAVY = ['numpy', 'cv2', 'vidgear', 'pypylon', 'PyQt6', 'pyqtgraph', 'serial']  # reported if a module loads them
+
+
+def import_time(module: str) -> dict:
+    """
+    Imports the module in a fresh interpreter
+    :return: dict with the cumulative import time in ms (None if the import failed), the heavy packages it loaded
+             and the error message
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True)
+    total, loaded, error = None, [], None
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            if line.strip():
+                error = line.strip()  # the last line of a traceback
+            continue
+        fields = line.split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue  # header
+        name = fields[2].strip()
+        if name == module:
+            total = int(fields[1]) / 1000
+        if name in HEAVY:
+            loaded.append(name)
+    if result.returncode != 0:
+        total = None
+    return {'ms': total, 'loaded': loaded, 'error': error if result.returncode != 0 else None}
+
+
+def gui_startup(connect: bool = True) -> dict:
+    """
+    Starts the GUI in this process
+    :return: times in ms since the start of the measurement until the window is shown and the cameras are connected
+    """
+    start = time.perf_counter()
+    from PyQt6.QtWidgets import QApplication
+    from FreiPose_Recorder.GUI_run import BASLER_GUI
+    times = {'imported': (time.perf_counter() - start) * 1000}
+    app = QApplication([])
+    win = BASLER_GUI()
+    win.show()
+    app.processEvents()
+    times['window_shown'] = (time.perf_counter() - start) * 1000
+    app.processEvents()  # the deferred camera scan
+    times['cameras_found'] = (time.perf_counter() - start) * 1000
+    if connect and win.basler_recorder.cam_array:
+        win.connect_to_cams()
+        times['cameras_connected'] = (time.perf_counter() - start) * 1000
+    win.app_is_exiting()
+    return times
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Startup time of the recorder')
+    parser.add_argument('--gui', action='store_true', help='also start the GUI and connect the cameras')
+    parser.add_argument('--modules', type=str, default=','.join(MODULES), help='comma separated modules')
+    args = parser.parse_args()
+
+    for module in args.modules.split(','):
+        result = import_time(module)
+        if result['ms'] is None:
+            print(f'{module:>45s}: failed ({result["error"]})')
+        else:
+            print(f'{module:>45s}: {result["ms"]:7.1f} ms  loads {", ".join(result["loaded"]) or "-"}')
+    if args.gui:
+        for step, ms in gui_startup().items():
+            print(f'{step:>45s}: {ms:7.1f} ms')
@@ -0,0 +1,133 @@
+from threading import Event, Lock, Thread
+import logging
+import time
+
+from PyQt6.QtCore import QObject, pyqtSignal
+
+
+class CameraTaskRunner(QObject):
+    """Runs blocking camera operations (auto exposure etc.) in background threads, one thread per camera.
+    Results and progress are reported via Qt signals, which are delivered on the GUI thread."""
+
+    progress = pyqtSignal(int, str, int)  # cam_id, task name, number of grabbed images
+    finished = pyqtSignal(int, str, float)  # cam_id, task name, resulting value
+    failed = pyqtSignal(int, str, str)  # cam_id, task name, error message
+    all_finished = pyqtSignal(str)  # task name, emitted once all cameras are done
+
+    def __init__(self, parent=None):
+        super(CameraTaskRunner, self).__init__(parent)
+        self.cancel_event = Event()
+        self.task_name = None
+        self._pending = 0
+        self._threads = []
+        self._idle_callbacks = []  # run on the GUI thread once the running tasks are finished
+        self._lock = Lock()
+        self.log = logging.getLogger('CameraTasks')
+        self.log.setLevel(logging.DEBUG)
+        self.all_finished.connect(self._run_idle_callbacks)  # connected first, runs before the slots of the GUI
+
+    def is_running(self) -> bool:
+        with self._lock:
+            return self._pending > 0
+
+    def when_idle(self, callback):
+        """
+        Calls callback once no task holds the cameras anymore, right away if none is running. Running tasks are
+        cancelled, the callback then runs with all_finished on the GUI thread, which is not blocked meanwhile
+        """
+        with self._lock:
+            if self._pending > 0:
+                self._idle_callbacks.append(callback)
+                callback = None
+        if callback is None:
+            self.log.debug(f'Cancelling {self.task_name} before using the cameras')
+            self.cancel()
+        else:
+            callback()
+
+    def _run_idle_callbacks(self, task_name: str):
+        with self._lock:
+            if self._pending > 0:
+                return
+            callbacks, self._idle_callbacks = self._idle_callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def start(self, task_name: str, function, cam_ids):
+        """
+        Runs function(cam_id, cancel_event=..., progress_callback=...) for all cam_ids concurrently
+        :param task_name: name reported with the signals
+        :param function: blocking function returning a float (or None)
+        :param cam_ids: iterable of camera ids
+        """
+        cam_ids = list(cam_ids)
+        self.cancel_event.clear()
+        self.task_name = task_name
+        if not cam_ids:
+            self.all_finished.emit(task_name)  # nothing to do, the GUI re-enables its buttons
+            return
+        with self._lock:
+            self._pending = len(cam_ids)
+        self._threads = [Thread(target=self._run, args=(task_name, function, cam_id), daemon=True)
+                         for cam_id in cam_ids]
+        for thread in self._threads:
+            thread.start()
+
+    def start_array(self, task_name: str, function):
+        """
+        Runs function(cancel_event=..., progress_callback=...) handling all cameras at once in a single thread,
+        e.g. Recorder.run_auto_array. function returns a dict cam_id -> {'value': float, ...}
+        """
+        self.cancel_event.clear()
+        self.task_name = task_name
+        with self._lock:
+            self._pending = 1
+        self._threads = [Thread(target=self._run_array, args=(task_name, function), daemon=True)]
+        self._threads[0].start()
+
+    def _run_array(self, task_name: str, function):
+        try:
+            results = function(cancel_event=self.cancel_event,
+                               progress_callback=lambda cam_id, i: self.progress.emit(cam_id, task_name, i))
+            for cam_id, result in results.items():
+                self.finished.emit(cam_id, task_name, float(result['value']))
+        except Exception as e:
+            self.log.error(f'{task_name} failed for the camera array: {e}')
+            self.failed.emit(-1, task_name, str(e))
+        with self._lock:
+            self._pending -= 1
+        self.all_finished.emit(task_name)
+
+    def _run(self, task_name: str, function, cam_id: int):
+        try:
+            value = function(cam_id, cancel_event=self.cancel_event,
+                             progress_callback=lambda i: self.progress.emit(cam_id, task_name, i))
+            self.finished.emit(cam_id, task_name, float(value or 0))
+        except Exception as e:  # report any pylon error back instead of killing the thread silently
+            self.log.error(f'{task_name} failed for camera {cam_id}: {e}')
+            self.failed.emit(cam_id, task_name, str(e))
+        with self._lock:
+            self._pending -= 1
+            done = self._pending == 0
+        if done:
+            self.all_finished.emit(task_name)
+
+    def cancel(self):
+        """signals all running tasks to stop after the current image"""
+        self.cancel_event.set()
+
+    def wait(self, timeout: float = 10.0) -> bool:
+        """
+        Cancels the running tasks and waits until their threads released the cameras, blocks e.g. on exit (see
+        when_idle for the GUI thread)
+        :param timeout: time in s to wait for all threads together
+        :return: True if no task is running anymore
+        """
+        self.cancel()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+        if self._threads:
+            self.log.error(f'{self.task_name} did not stop within {timeout} s')
+        return not self._threads
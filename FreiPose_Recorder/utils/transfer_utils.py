@@ -0,0 +1,426 @@
+"""
+Background transfer of recorded files, e.g. to a network share.
+
+Files are copied concurrently by a bounded worker pool. Data is streamed in large chunks (or via os.sendfile if no
+checksum is requested) and checksummed on the fly. Copies go to a .part file first, an interrupted copy is resumed
+from the existing part after comparing it chunk-wise with the source and rewriting chunks which differ.
+SessionUploader uses this to copy data of a running recording incrementally, the final copy is then mostly a
+verification pass.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from threading import Event, Lock, Thread
+
+from FreiPose_Recorder.configs.params import VIDEO_FOLDER, COPY_WHILE_RECORDING, UPLOAD_RATE_LIMIT
+from FreiPose_Recorder.utils.socket_utils import SocketMessage
+
+PART_SUFFIX = '.part'
+
+
+class FileTransfer:
+    """
+    Copies files with a bounded pool of worker threads.
+
+    :param max_workers: number of files copied at the same time
+    :param chunk_size: size of the copy buffer in bytes
+    :param checksum: hashlib algorithm used for the streaming checksum, None disables it and allows sendfile
+    :param verify: re-read the destination after copying and compare checksums
+    :param progress_callback: called as progress_callback(file_name, bytes_done, bytes_total) from worker threads
+    :param progress_interval: minimal time in s between two progress reports of the same file
+    :param rate_limit: maximal write rate in bytes/s over all workers, 0 disables throttling
+    """
+    def __init__(self, max_workers: int = 4, chunk_size: int = 8 * 1024 * 1024, checksum: (str, None) = 'sha1',
+                 verify: bool = False, progress_callback=None, progress_interval: float = 0.5, rate_limit: float = 0):
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.checksum = checksum
+        self.verify = verify
+        self.progress_callback = progress_callback
+        self.progress_interval = progress_interval
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='FileTransfer')
+        self._progress_lock = Lock()
+        self.rate_limit = rate_limit
+        self._rate_lock = Lock()
+        self._rate_next = 0.0  # time at which the next chunk may be written
+        self._appended = {}  # part file -> number of bytes appended by append_file
+        self.log = logging.getLogger('FileTransfer')
+        self.log.setLevel(logging.DEBUG)
+
+    def _new_hash(self):
+        return hashlib.new(self.checksum) if self.checksum else None
+
+    def _report(self, name: str, done: int, total: int):
+        if self.progress_callback is None:
+            return
+        with self._progress_lock:  # callbacks might not be thread safe (e.g. sockets)
+            try:
+                self.progress_callback(name, done, total)
+            except Exception as e:
+                self.log.warning(f'Progress callback failed: {e}')
+
+    def _throttle(self, n_bytes: int):
+        """sleeps such that the average write rate stays below rate_limit"""
+        if not self.rate_limit:
+            return
+        with self._rate_lock:
+            now = time.monotonic()
+            wait = self._rate_next - now
+            self._rate_next = max(now, self._rate_next) + n_bytes / self.rate_limit
+        if wait > 0:
+            time.sleep(wait)
+
+    def _sync_part(self, src_f, part_f, digest) -> (int, int):
+        """
+        compares an existing part file chunk-wise with the beginning of the source and rewrites chunks which differ,
+        hashing the source on the way
+        :return: offset up to which the part is in sync with the source, number of rewritten bytes
+        """
+        part_size = os.fstat(part_f.fileno()).st_size
+        buffer = bytearray(self.chunk_size)
+        buffer_part = bytearray(self.chunk_size)
+        view, view_part = memoryview(buffer), memoryview(buffer_part)
+        offset, patched = 0, 0
+        while offset < part_size:
+            n = src_f.readinto(view[:min(self.chunk_size, part_size - offset)])
+            if n == 0:
+                break  # part is longer than the source
+            n_part = part_f.readinto(view_part[:n])
+            if n != n_part or view[:n] != view_part[:n]:
+                self._throttle(n)
+                part_f.seek(offset)
+                part_f.write(view[:n])
+                patched += n
+            if digest is not None:
+                digest.update(view[:n])
+            offset += n
+        return offset, patched
+
+    def copy_file(self, src: (str, Path), dst: (str, Path)) -> dict:
+        """
+        Copies a single file, resuming a partial copy if possible
+        :return: dict with src, dst, bytes, checksum, resumed, patched, skipped and seconds
+        """
+        src, dst = Path(src), Path(dst)
+        start = time.monotonic()
+        total = src.stat().st_size
+        result = {'src': src.as_posix(), 'dst': dst.as_posix(), 'bytes': total, 'checksum': None,
+                  'resumed': 0, 'patched': 0, 'skipped': False, 'seconds': 0.0}
+
+        # a finished copy keeps the mtime of the source, no need to copy again
+        if dst.exists() and dst.stat().st_size == total and dst.stat().st_mtime == src.stat().st_mtime:
+            result['skipped'] = True
+            self._report(src.name, total, total)
+            return result
+
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        part = dst.with_name(dst.name + PART_SUFFIX)
+        digest = self._new_hash()
+
+        with open(src, 'rb') as src_f, open(part, 'r+b' if part.exists() else 'w+b') as dst_f:
+            offset, patched = self._sync_part(src_f, dst_f, digest)
+            if offset:
+                self.log.info(f'Resuming copy of {src.name} at {offset / 1e6:0.1f} MB, '
+                              f'rewrote {patched / 1e6:0.1f} MB which differed')
+            result['resumed'], result['patched'] = offset, patched
+            dst_f.seek(offset)
+            dst_f.truncate()
+            self._copy_stream(src_f, dst_f, offset, total, digest, src.name)
+        self._appended.pop(part, None)
+
+        if digest is not None:
+            result['checksum'] = digest.hexdigest()
+            if self.verify:
+                dst_digest = self.file_checksum(part, self.checksum, self.chunk_size)
+                if dst_digest != result['checksum']:
+                    part.unlink()
+                    raise IOError(f'Checksum mismatch after copying {src} to {dst}')
+        elif part.stat().st_size != total:
+            raise IOError(f'Size mismatch after copying {src} to {dst}')
+
+        os.replace(part, dst)
+        shutil.copystat(src, dst)
+        result['seconds'] = time.monotonic() - start
+        return result
+
+    def _copy_stream(self, src_f, dst_f, offset: int, total: int, digest, name: str):
+        """copies from the current positions of src_f and dst_f until the end of the source"""
+        last_report = 0
+        if digest is None and hasattr(os, 'sendfile'):
+            src_f.seek(offset)
+            while offset < total:
+                self._throttle(min(self.chunk_size, total - offset))
+                sent = os.sendfile(dst_f.fileno(), src_f.fileno(), offset, min(self.chunk_size, total - offset))
+                if sent == 0:
+                    break
+                offset += sent
+                if time.monotonic() - last_report > self.progress_interval:
+                    last_report = time.monotonic()
+                    self._report(name, offset, total)
+        else:
+            buffer = bytearray(self.chunk_size)
+            view = memoryview(buffer)
+            while True:
+                n = src_f.readinto(view)
+                if not n:
+                    break
+                if digest is not None:
+                    digest.update(view[:n])
+                self._throttle(n)
+                dst_f.write(view[:n])
+                offset += n
+                if time.monotonic() - last_report > self.progress_interval:
+                    last_report = time.monotonic()
+                    self._report(name, offset, total)
+        self._report(name, offset, total)
+
+    def append_file(self, src: (str, Path), dst: (str, Path)) -> int:
+        """
+        Copies the data appended to a growing source since the last call to the part file of dst. The part is
+        not verified here, a final copy_file call verifies it and fixes bytes changed by the writer afterwards.
+        :return: number of bytes copied
+        """
+        src, dst = Path(src), Path(dst)
+        part = dst.with_name(dst.name + PART_SUFFIX)
+        offset = self._appended.get(part, 0)
+        size = src.stat().st_size
+        if size <= offset:
+            return 0
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        buffer = bytearray(self.chunk_size)
+        view = memoryview(buffer)
+        copied = 0
+        with open(src, 'rb') as src_f, open(part, 'r+b' if offset else 'wb') as dst_f:
+            src_f.seek(offset)
+            dst_f.seek(offset)
+            while copied < size - offset:
+                n = src_f.readinto(view[:min(self.chunk_size, size - offset - copied)])
+                if not n:
+                    break
+                self._throttle(n)
+                dst_f.write(view[:n])
+                copied += n
+        self._appended[part] = offset + copied
+        return copied
+
+    @staticmethod
+    def file_checksum(path: (str, Path), algorithm: str = 'sha1', chunk_size: int = 8 * 1024 * 1024) -> str:
+        """streaming checksum of a file"""
+        digest = hashlib.new(algorithm)
+        buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+        with open(path, 'rb') as f:
+            while True:
+                n = f.readinto(view)
+                if not n:
+                    break
+                digest.update(view[:n])
+        return digest.hexdigest()
+
+    def submit(self, src: (str, Path), dst: (str, Path)):
+        """queues a single copy, returns a concurrent.futures.Future"""
+        return self.executor.submit(self.copy_file, src, dst)
+
+    def copy_files(self, pairs: list) -> list:
+        """
+        Copies all (src, dst) pairs concurrently and blocks until all are done
+        :return: list of result dicts, failed copies have an 'error' entry
+        """
+        futures = {self.submit(src, dst): (src, dst) for src, dst in pairs}
+        results = []
+        for future in as_completed(futures):
+            src, dst = futures[future]
+            try:
+                results.append(future.result())
+            except (OSError, IOError) as e:
+                self.log.error(f'Copying {src} to {dst} failed: {e}')
+                results.append({'src': str(src), 'dst': str(dst), 'error': str(e)})
+        return results
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait)
+
+
+class SessionUploader(Thread):
+    """
+    Follows the video writers of a running recording and copies their data to target while recording.
+    Finished segments are copied completely, the file currently written is appended incrementally. After the
+    recording, a normal FileTransfer.copy_files call completes the copies, skipping finished segments and only
+    verifying (and patching) the already copied parts of the other files.
+
+    :param writers: list of VideoWriterFast
+    :param target: folder to copy to
+    :param rate_limit: maximal write rate in bytes/s, keeps the uploader from starving the encoders
+    :param interval: time in s between two passes over the writers
+    """
+    def __init__(self, writers: list, target: (str, Path), rate_limit: float = 50e6, interval: float = 5.0):
+        super(SessionUploader, self).__init__(daemon=True)
+        self.writers = writers
+        self.target = Path(target)
+        self.interval = interval
+        self.transfer = FileTransfer(max_workers=1, rate_limit=rate_limit)
+        self.stop_event = Event()
+        self.copied = set()  # finished segments which are copied completely
+        self.bytes_copied = 0
+        self.log = logging.getLogger('SessionUploader')
+        self.log.setLevel(logging.DEBUG)
+
+    def run(self):
+        self.log.info(f'Copying recorded data to {self.target} during recording')
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.upload_pass()
+            except OSError as e:  # e.g. share not reachable, retry in the next pass
+                self.log.warning(f'Upload pass failed: {e}')
+        self.log.info(f'Stopped, copied {self.bytes_copied / 1e6:0.0f} MB during recording')
+
+    def upload_pass(self):
+        for writer in self.writers:
+            files = writer.get_files()
+            for i, file in enumerate(files):
+                if self.stop_event.is_set():
+                    return
+                if file in self.copied or not Path(file).exists():
+                    continue
+                dst = self.target / Path(file).name
+                finished = writer.is_segmented and i < len(writer.segments) - 1
+                if finished:
+                    # segment is closed in the background, wait until its closing thread is done
+                    if any(closer.is_alive() for closer in writer._closing_threads):
+                        continue
+                    self.bytes_copied += self.transfer.copy_file(file, dst)['bytes']
+                    self.copied.add(file)
+                else:
+                    self.bytes_copied += self.transfer.append_file(file, dst)
+
+    def stop(self):
+        """stops after the current file, the remaining data is copied by the final copy_files call"""
+        self.stop_event.set()
+        self.join()
+        self.transfer.shutdown()
+
+
+class SessionFiles:
+    """
+    Copying and purging of the recorded files on request of the remote client, shared by the GUI and the headless
+    recorder. The class using it provides basler_recorder, socket_comm, file_transfer, session_id, session_path,
+    files_copied, copy_thread, uploader and log.
+    """
+    def purge_recorded_file(self):
+        if self.copy_thread and self.copy_thread.is_alive():
+            self.log.info("Cant delete files while they are being copied")
+            return
+        for videowriter in self.basler_recorder.video_writer_list:
+            if videowriter.stopped:
+                for file in videowriter.get_files():
+                    self.log.info(f"Deleting file {file}")
+                    Path(file).unlink()
+            else:
+                self.log.info(f"Cant delete file {videowriter.video_path} as recorder hasnt finished yet")
+
+    def copy_recorded_file(self):
+        """Copies the recorded files to the session path in a background thread"""
+        if self.basler_recorder.is_recording or self.files_copied:
+            return
+        if self.copy_thread and self.copy_thread.is_alive():
+            self.log.info("Files are already being copied")
+            return
+        if not Path(self.session_path).exists():
+            self.log.error(f"Session path {self.session_path} does not exist")
+            self.socket_comm.send_json_message(SocketMessage.respond_copy_fail)
+            return
+
+        target = self.get_copy_target()
+        pairs = []
+        for videowriter in self.basler_recorder.video_writer_list:
+            if videowriter.stopped:
+                self.log.info(f"Copying file {videowriter.video_path} to {target}")
+                pairs.extend((file, target / Path(file).name) for file in videowriter.get_files())
+        if self.basler_recorder.manifest_path:
+            pairs.append((self.basler_recorder.manifest_path, target / Path(self.basler_recorder.manifest_path).name))
+
+        self.copy_thread = Thread(target=self._copy_files, args=(pairs, target), daemon=True)
+        self.copy_thread.start()
+
+    def get_copy_target(self) -> Path:
+        """folder in the session path the videos are copied to"""
+        if 'MusterMaus' in self.session_id:
+            return Path(self.session_path)
+        return Path(self.session_path) / VIDEO_FOLDER
+
+    def start_uploader(self):
+        """Starts copying the recording to the session path while recording, if enabled and the path is known"""
+        if not COPY_WHILE_RECORDING or not self.session_path:
+            return
+        if not Path(self.session_path).exists():
+            self.log.warning(f"Session path {self.session_path} does not exist, not copying during recording")
+            return
+        self.uploader = SessionUploader(self.basler_recorder.video_writer_list, self.get_copy_target(),
+                                        rate_limit=UPLOAD_RATE_LIMIT)
+        self.uploader.start()
+
+    def _copy_files(self, pairs: list, target: Path):
+        """copies the files with the transfer engine and reports the result to the remote client"""
+        start = time.monotonic()
+        if self.uploader:
+            # data copied during recording is only verified and completed
+            self.uploader.stop()
+            self.uploader = None
+        results = self.file_transfer.copy_files(pairs)
+        failed = [result for result in results if 'error' in result]
+        if failed:
+            self.log.error(f"Error copying files {[result['src'] for result in failed]}")
+            self.socket_comm.send_json_message(SocketMessage.respond_copy_fail)
+            return
+        self.files_copied = True
+        n_bytes = sum(result['bytes'] for result in results)
+        self.log.info(f"Finished copying {n_bytes / 1e6:0.0f} MB to {target} in {time.monotonic() - start:0.1f}s")
+        checksums = {Path(result['dst']).name: result['checksum'] for result in results}
+        self.socket_comm.send_json_message(dict(**SocketMessage.respond_copy, checksums=checksums))
+
+    def report_copy_progress(self, file_name: str, bytes_done: int, bytes_total: int):
+        """forwards progress of the transfer engine to the remote client, called from the copy threads"""
+        if self.socket_comm and self.socket_comm.connected:
+            self.socket_comm.send_json_message(SocketMessage.copy_progress(file_name, bytes_done, bytes_total))
+
+
+if __name__ == '__main__':
+    import argparse
+    import tempfile
+
+    parser = argparse.ArgumentParser(description='Benchmark serial shutil copy against FileTransfer')
+    parser.add_argument('--target', type=str, default=None, help='target folder, e.g. on /dev/shm or a share')
+    parser.add_argument('--n_files', type=int, default=8)
+    parser.add_argument('--size_mb', type=int, default=256)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as src_dir, tempfile.TemporaryDirectory(dir=args.target) as dst_dir:
+        files = []
+        for i in range(args.n_files):
+            path = Path(src_dir) / f'cam{i:02d}.mp4'
+            with open(path, 'wb') as f:
+                f.write(os.urandom(args.size_mb * 1024 * 1024))
+            files.append(path)
+        total_mb = args.n_files * args.size_mb
+
+        (Path(dst_dir) / 'serial').mkdir()
+        start = time.monotonic()
+        for path in files:
+            shutil.copyfile(path, Path(dst_dir) / 'serial' / path.name)
+        t_serial = time.monotonic() - start
+        print(f'serial shutil.copyfile: {t_serial:0.2f}s ({total_mb / t_serial:0.0f} MB/s)')
+
+        for checksum in ('sha1', None):
+            transfer = FileTransfer(max_workers=args.workers, checksum=checksum)
+            target = Path(dst_dir) / f'engine_{checksum}'
+            start = time.monotonic()
+            transfer.copy_files([(path, target / path.name) for path in files])
+            t_engine = time.monotonic() - start
+            transfer.shutdown()
+            print(f'FileTransfer checksum={checksum}: {t_engine:0.2f}s ({total_mb / t_engine:0.0f} MB/s), '
+                  f'speedup {t_serial / t_engine:0.2f}x')